@@ -0,0 +1,260 @@
+"""Concurrent-connection capacity: thread-pool WSGI vs cooperative (gevent) mode.
+
+Serves the app from a subprocess in each mode, logs in ``--concurrency``
+users, then has all of them request an SMS token at once while the fake
+Authy server takes ``--latency`` seconds per call, so every connection
+spends its time waiting upstream:
+
+    python -m benchmarks.concurrency --concurrency 500 --latency 0.5 --threads 32
+
+``threaded`` is a fixed pool of ``--threads`` worker threads, the shape of a
+gunicorn gthread or mod_wsgi deployment; ``gevent`` is gevent_app.
+Reports latency percentiles, throughput and the server's peak thread count
+and resident memory.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_authy import FakeAuthyServer
+from benchmarks.load_test import PASSWORD, percentile
+
+MODES = ('threaded', 'gevent')
+
+# The gevent server must patch the standard library before this module (and
+# the threading and socket imports above) is loaded, as gevent_app does.
+GEVENT_SERVE = (
+    'from gevent import monkey; monkey.patch_all(); '
+    'from benchmarks.concurrency import main; main()'
+)
+
+
+def serve(mode, port, users, threads):
+    """Run in the server subprocess; the config comes from the environment."""
+    if mode == 'gevent':
+        from twofa.cooperative import app
+    else:
+        from twofa import create_app
+
+        app = create_app('production')
+    from benchmarks.load_test import seed_users
+    from twofa import db
+
+    app.config.update(WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+    seed_users(app, db, users)
+
+    if mode == 'gevent':
+        from gevent.pywsgi import WSGIServer
+
+        WSGIServer(('127.0.0.1', port), app, log=None, backlog=1024).serve_forever()
+    else:
+        _thread_pool_server(port, app, threads).serve_forever()
+
+
+def _thread_pool_server(port, app, threads):
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+            pass
+
+    class ThreadPoolWSGIServer(BaseWSGIServer):
+        request_queue_size = 1024
+
+        def __init__(self, *args, **kwargs):
+            super(ThreadPoolWSGIServer, self).__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    return ThreadPoolWSGIServer('127.0.0.1', port, app, handler=QuietHandler)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(port, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('server exited with {}'.format(proc.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+class ProcessSampler(threading.Thread):
+    """Tracks a process's peak thread count and resident memory from /proc."""
+
+    def __init__(self, pid, interval=0.05):
+        super(ProcessSampler, self).__init__(daemon=True)
+        self.path = '/proc/{}/status'.format(pid)
+        self.interval = interval
+        self.threads = self.rss_kb = 0
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                with open(self.path) as f:
+                    fields = dict(line.split(':', 1) for line in f)
+            except OSError:
+                return
+            self.threads = max(self.threads, int(fields['Threads']))
+            self.rss_kb = max(self.rss_kb, int(fields['VmRSS'].split()[0]))
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+
+def run(mode, concurrency, latency, threads):
+    import requests
+
+    authy = FakeAuthyServer(latency=latency)
+    authy.start()
+    workdir = tempfile.mkdtemp(prefix='twofa-concurrency-')
+    port = _free_port()
+    env = dict(
+        os.environ,
+        FLASK_ENV='production',
+        ACCOUNT_SECURITY_API_URI=authy.url,
+        ACCOUNT_SECURITY_API_KEY='benchmark-key',
+        DATABASE_URI='sqlite:///' + os.path.join(workdir, 'bench.sqlite'),
+        PASSWORD_HASH_METHOD='pbkdf2:sha256:1000',
+        RATE_LIMIT_ENABLED='0',
+        # Let every connection reach Authy at once: the point is to measure
+        # the serving model, not the bulkhead.
+        AUTHY_POOL_SIZE=str(concurrency),
+        AUTHY_BULKHEAD_SIZE='0',
+    )
+    if mode == 'gevent':
+        command = [sys.executable, '-c', GEVENT_SERVE]
+    else:
+        command = [sys.executable, '-m', 'benchmarks.concurrency']
+    proc = subprocess.Popen(
+        command + ['--serve', mode, '--port', str(port),
+                   '--concurrency', str(concurrency), '--threads', str(threads)],
+        env=env,
+    )
+    base = 'http://127.0.0.1:{}'.format(port)
+    try:
+        _wait_for(port, proc)
+        sessions = [requests.Session() for _ in range(concurrency)]
+
+        def login(index):
+            sessions[index].post(
+                base + '/login',
+                data={'username': 'bench{}'.format(index), 'password': PASSWORD},
+                allow_redirects=False,
+            )
+
+        with ThreadPoolExecutor(16) as pool:
+            list(pool.map(login, range(concurrency)))
+
+        start_gate = threading.Barrier(concurrency + 1)
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def request_sms(session):
+            start_gate.wait()
+            started = time.perf_counter()
+            try:
+                status = session.post(base + '/token/sms', timeout=120).status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                (latencies if status == 200 else errors).append(elapsed)
+
+        clients = [
+            threading.Thread(target=request_sms, args=(s,), daemon=True) for s in sessions
+        ]
+        for client in clients:
+            client.start()
+        sampler = ProcessSampler(proc.pid)
+        sampler.start()
+        start_gate.wait()
+        started = time.perf_counter()
+        for client in clients:
+            client.join()
+        wall_time = time.perf_counter() - started
+        sampler.stop()
+    finally:
+        proc.terminate()
+        proc.wait()
+        authy.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'ok': len(latencies),
+        'errors': len(errors),
+        'wall_s': wall_time,
+        'rps': len(latencies) / wall_time,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+        'peak_threads': sampler.threads,
+        'peak_rss_mb': sampler.rss_kb / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--concurrency', type=int, default=200, help='simultaneous users')
+    parser.add_argument(
+        '--latency', type=float, default=0.5, help='Authy seconds per call'
+    )
+    parser.add_argument('--threads', type=int, default=32, help='threaded mode pool size')
+    parser.add_argument('--json', action='store_true', help='emit machine-readable JSON')
+    parser.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.concurrency, args.threads)
+        return
+
+    rows = [
+        run(mode, args.concurrency, args.latency, args.threads) for mode in args.modes
+    ]
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    header = '{:<10} {:>6} {:>6} {:>8} {:>9} {:>9} {:>8} {:>8}'
+    print(header.format('mode', 'ok', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'threads',
+                        'rss MB'))
+    for row in rows:
+        print('{:<10} {:>6} {:>6} {:>8.1f} {:>9.1f} {:>9.1f} {:>8} {:>8.1f}'.format(
+            row['mode'], row['ok'], row['errors'], row['rps'], row['p50_ms'] or 0,
+            row['p99_ms'] or 0, row['peak_threads'], row['peak_rss_mb'],
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""A local stand-in for the Authy API used by the benchmarks.
+
+Serves the handful of endpoints the quickstart talks to, with injectable
+latency and error rates, so load tests never leave the machine:
+
+    python -m benchmarks.fake_authy --port 8089 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse
+
+FAKE_AUTHY_ID = 1234567
+
+
+def _user_created(match, body):
+    return {'success': True, 'user': {'id': FAKE_AUTHY_ID}}
+
+
+def _token_sent(match, body):
+    return {'success': True, 'message': 'Token was sent.', 'cellphone': '+1-XXX-XXX-0123'}
+
+
+def _token_verified(match, body):
+    return {'success': 'true', 'token': 'is valid', 'message': 'Token is valid.'}
+
+
+def _approval_created(match, body):
+    return {'success': True, 'approval_request': {'uuid': str(uuid.uuid4())}}
+
+
+def _approval_status(match, body):
+    return {
+        'success': True,
+        'approval_request': {'uuid': match.group('uuid'), 'status': 'approved'},
+    }
+
+
+def _verification_started(match, body):
+    return {'success': True, 'carrier': 'Fake Carrier', 'is_cellphone': True}
+
+
+def _verification_checked(match, body):
+    return {'success': True, 'message': 'Verification code is correct.'}
+
+
+ROUTES = [
+    ('POST', re.compile(r'^/protected/json/users/new$'), _user_created),
+    ('GET', re.compile(r'^/protected/json/sms/[^/]+$'), _token_sent),
+    ('GET', re.compile(r'^/protected/json/call/[^/]+$'), _token_sent),
+    ('GET', re.compile(r'^/protected/json/verify/[^/]+/[^/]+$'), _token_verified),
+    (
+        'POST',
+        re.compile(r'^/onetouch/json/users/[^/]+/approval_requests$'),
+        _approval_created,
+    ),
+    (
+        'GET',
+        re.compile(r'^/onetouch/json/approval_requests/(?P<uuid>[^/]+)$'),
+        _approval_status,
+    ),
+    (
+        'POST',
+        re.compile(r'^/protected/json/phones/verification/start$'),
+        _verification_started,
+    ),
+    (
+        'GET',
+        re.compile(r'^/protected/json/phones/verification/check$'),
+        _verification_checked,
+    ),
+]
+
+
+class FakeAuthyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Keep-alive clients otherwise stall on delayed ACKs between writes.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path = urlparse(self.path).path
+        server = self.server
+
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+        server.record(method, path)
+
+        if random.random() < server.error_rate:
+            errors = {'message': 'Injected failure'}
+            self._respond(503, {'success': False, 'errors': errors})
+            return
+
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                self._respond(200, handler(match, body))
+                return
+        self._respond(404, {'success': False, 'errors': {'message': 'Not found'}})
+
+    def _respond(self, status, payload):
+        # Compact separators matter: authy's Token.ok() string-matches the body.
+        data = json.dumps(payload, separators=(',', ':')).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeAuthyServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # Room for a burst of new connections from a highly concurrent client.
+    request_queue_size = 1024
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+        super().__init__((host, port), FakeAuthyHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def record(self, method, path):
+        # Collapse ids so the counters group by operation, not by user.
+        key = '{} {}'.format(method, re.sub(r'/[0-9a-f-]{6,}', '/:id', path))
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='0.0 - 1.0')
+    args = parser.parse_args()
+
+    server = FakeAuthyServer(
+        args.host, args.port, args.latency, args.jitter, args.error_rate
+    )
+    print('Fake Authy listening on {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""Load test for the login -> 2FA -> /protected flow.
+
+Every virtual user runs the full flow against the app in-process, with all
+Authy traffic going to a local fake server (see benchmarks.fake_authy):
+
+    python -m benchmarks.load_test --concurrency 8 --iterations 25 --latency 0.05
+
+Reports p50/p95/p99 latency, requests/sec and SQL queries per endpoint.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks.fake_authy import FAKE_AUTHY_ID, FakeAuthyServer
+
+PASSWORD = 'benchmark'
+
+# (label, method, path, form data) executed in order by every virtual user.
+FLOW = [
+    ('login', 'POST', '/login', lambda user: {'username': user, 'password': PASSWORD}),
+    ('2fa (GET)', 'GET', '/2fa', None),
+    ('token/sms', 'POST', '/token/sms', None),
+    ('token/onetouch', 'POST', '/token/onetouch', None),
+    ('onetouch-status', 'POST', '/onetouch-status', None),
+    ('2fa (POST)', 'POST', '/2fa', lambda user: {'token': '0000000'}),
+    ('protected', 'GET', '/protected', None),
+    ('logout', 'GET', '/logout', None),
+    (
+        'verification',
+        'POST',
+        '/verification',
+        lambda user: {'country_code': '1', 'phone_number': '2015550123', 'via': 'sms'},
+    ),
+    ('verification/token', 'POST', '/verification/token', lambda user: {'token': '1234'}),
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class QueryCounter(object):
+    """Counts SQL statements issued by the current thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def __call__(self, *args, **kwargs):
+        self._local.count = self.count + 1
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+class Results(object):
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, label, elapsed, queries, status):
+        with self._lock:
+            self.latencies[label].append(elapsed)
+            self.queries[label] += queries
+            if status >= 500:
+                self.errors[label] += 1
+
+    def summary(self, wall_time):
+        rows = []
+        for label, _, _, _ in FLOW:
+            samples = self.latencies.get(label, [])
+            count = len(samples)
+            rows.append({
+                'endpoint': label,
+                'requests': count,
+                'errors': self.errors[label],
+                'rps': count / wall_time if wall_time else 0.0,
+                'p50_ms': percentile(samples, 50) * 1000,
+                'p95_ms': percentile(samples, 95) * 1000,
+                'p99_ms': percentile(samples, 99) * 1000,
+                'queries_per_request': self.queries[label] / count if count else 0.0,
+            })
+        return rows
+
+
+def build_app(authy_url, database_uri):
+    # twofa's config classes read the environment at import time, so it has
+    # to point at the fake server and scratch database before the import.
+    os.environ['ACCOUNT_SECURITY_API_URI'] = authy_url
+    os.environ['ACCOUNT_SECURITY_API_KEY'] = 'benchmark-key'
+    os.environ['DATABASE_URI'] = database_uri
+    # Every virtual user requests a token on each iteration, far more often
+    # than the per-user rate limits allow.
+    os.environ['RATE_LIMIT_ENABLED'] = '0'
+
+    from twofa import create_app, db
+
+    app = create_app(os.environ.get('FLASK_ENV', 'production'))
+    app.config.update(WTF_CSRF_ENABLED=False, TESTING=True)
+    with app.app_context():
+        db.create_all()
+    return app, db
+
+
+def seed_users(app, db, count):
+    from twofa.models import User
+
+    with app.app_context():
+        for index in range(count):
+            db.session.add(User(
+                username='bench{}'.format(index),
+                email='bench{}@example.com'.format(index),
+                password=PASSWORD,
+                authy_id=str(FAKE_AUTHY_ID),
+            ))
+        db.session.commit()
+
+
+def virtual_user(app, username, iterations, counter, results):
+    client = app.test_client()
+    for _ in range(iterations):
+        for label, method, path, data in FLOW:
+            kwargs = {'data': data(username)} if data else {}
+            before = counter.count
+            start = time.perf_counter()
+            response = client.open(path, method=method, **kwargs)
+            elapsed = time.perf_counter() - start
+            results.record(label, elapsed, counter.count - before, response.status_code)
+
+
+def render_times(app):
+    """Mean render milliseconds and render count per template."""
+    totals = {}
+    for name, labels, value in app.jinja_env.metrics.render_duration.samples():
+        if name.endswith(('_sum', '_count')):
+            totals.setdefault(labels['template'], {})[name.rsplit('_', 1)[1]] = value
+    return {
+        template: {'renders': t['count'], 'mean_ms': t['sum'] / t['count'] * 1000}
+        for template, t in sorted(totals.items())
+    }
+
+
+def run(concurrency, iterations, latency, jitter, error_rate):
+    from sqlalchemy import event
+
+    server = FakeAuthyServer(latency=latency, jitter=jitter, error_rate=error_rate)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix='twofa-bench-')
+    database_uri = 'sqlite:///' + os.path.join(workdir, 'bench.sqlite')
+    try:
+        app, db = build_app(server.url, database_uri)
+        seed_users(app, db, concurrency)
+
+        counter = QueryCounter()
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', counter)
+
+        results = Results()
+        threads = [
+            threading.Thread(
+                target=virtual_user,
+                args=(app, 'bench{}'.format(index), iterations, counter, results),
+            )
+            for index in range(concurrency)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - start
+        return (
+            results.summary(wall_time), wall_time, dict(server.calls), render_times(app)
+        )
+    finally:
+        server.stop()
+
+
+def print_report(rows, wall_time, upstream_calls, templates):
+    header = '{:<20} {:>8} {:>6} {:>9} {:>9} {:>9} {:>9} {:>8}'
+    print(header.format('endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms',
+                        'p99 ms', 'queries'))
+    for row in rows:
+        print('{:<20} {:>8} {:>6} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8.2f}'.format(
+            row['endpoint'], row['requests'], row['errors'], row['rps'], row['p50_ms'],
+            row['p95_ms'], row['p99_ms'], row['queries_per_request'],
+        ))
+    total = sum(row['requests'] for row in rows)
+    print('\n{} requests in {:.2f}s ({:.1f} req/s)'.format(
+        total, wall_time, total / wall_time
+    ))
+    print('upstream calls: {}'.format(sum(upstream_calls.values())))
+    for key, count in sorted(upstream_calls.items()):
+        print('  {:<60} {:>6}'.format(key, count))
+    print('template renders:')
+    for template, row in templates.items():
+        print('  {:<30} {:>8} {:>9.3f} ms'.format(
+            template, row['renders'], row['mean_ms']
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=4, help='virtual users')
+    parser.add_argument('--iterations', type=int, default=10, help='flows per user')
+    parser.add_argument(
+        '--latency', type=float, default=0.0, help='Authy seconds per call'
+    )
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='0.0 - 1.0')
+    parser.add_argument('--json', action='store_true', help='emit machine-readable JSON')
+    args = parser.parse_args()
+
+    rows, wall_time, upstream_calls, templates = run(
+        args.concurrency, args.iterations, args.latency, args.jitter, args.error_rate
+    )
+    if args.json:
+        print(json.dumps({
+            'wall_time': wall_time,
+            'endpoints': rows,
+            'upstream_calls': upstream_calls,
+            'templates': templates,
+        }, indent=2))
+    else:
+        print_report(rows, wall_time, upstream_calls, templates)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Micro-benchmark for password hashing settings.
+
+Reports hashes/sec and milliseconds per hash for each werkzeug method, which
+is roughly the CPU one login costs:
+
+    python -m benchmarks.password_hashing --rounds 20 pbkdf2:sha256:260000
+"""
+import argparse
+import time
+
+from twofa.models import PasswordHasher
+
+DEFAULT_METHODS = [
+    'pbkdf2:sha256:150000',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha512:210000',
+]
+
+
+def measure(method, salt_length, rounds):
+    hasher = PasswordHasher(method, salt_length)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pw_hash = hasher.hash('benchmark-password')
+    hash_time = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        hasher.verify(pw_hash, 'benchmark-password')
+    verify_time = (time.perf_counter() - start) / rounds
+    return {
+        'method': method,
+        'hashes_per_sec': 1 / hash_time,
+        'hash_ms': hash_time * 1000,
+        'verify_ms': verify_time * 1000,
+        'hash_length': len(pw_hash),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('methods', nargs='*', default=DEFAULT_METHODS)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--salt-length', type=int, default=16)
+    args = parser.parse_args()
+
+    print('{:<26} {:>10} {:>10} {:>10} {:>8}'.format(
+        'method', 'hashes/s', 'hash ms', 'verify ms', 'length'
+    ))
+    for method in args.methods:
+        row = measure(method, args.salt_length, args.rounds)
+        print('{method:<26} {hashes_per_sec:>10.1f} {hash_ms:>10.2f} '
+              '{verify_ms:>10.2f} {hash_length:>8}'.format(**row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Micro-benchmark for phone number validation.
+
+Compares uncached validation against the shared cached validator on a
+workload with repeated numbers, and times the phonenumbers metadata load:
+
+    python -m benchmarks.phone_validation --requests 20000 --distinct 500
+"""
+import argparse
+import random
+import subprocess
+import sys
+import time
+
+from twofa.phones import PhoneNumberValidator
+
+# (country code, national number prefix) pairs that yield valid numbers.
+REGIONS = [('1', '201555'), ('44', '7400'), ('49', '15123'), ('55', '1196123')]
+
+
+def workload(requests, distinct, seed=0):
+    rng = random.Random(seed)
+    numbers = []
+    for _ in range(distinct):
+        country_code, prefix = rng.choice(REGIONS)
+        suffix = ''.join(rng.choice('0123456789') for _ in range(10 - len(prefix)))
+        numbers.append(('+' + country_code, prefix + suffix))
+    return [rng.choice(numbers) for _ in range(requests)]
+
+
+METADATA_LOAD = '''
+import time
+start = time.perf_counter()
+import phonenumbers
+imported = time.perf_counter()
+phonenumbers.PhoneMetadata.load_all()
+print(imported - start, time.perf_counter() - imported)
+'''
+
+
+def metadata_load_times():
+    # Run in a fresh interpreter: importing twofa may already have loaded it.
+    output = subprocess.check_output([sys.executable, '-c', METADATA_LOAD])
+    return [float(value) for value in output.split()]
+
+
+def rate(validate, numbers):
+    start = time.perf_counter()
+    for country_code, phone_number in numbers:
+        validate(country_code, phone_number)
+    return len(numbers) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--distinct', type=int, default=500)
+    args = parser.parse_args()
+
+    import_time, load_time = metadata_load_times()
+    print('phonenumbers import: {:.1f} ms, eager metadata load: {:.1f} ms'.format(
+        import_time * 1000, load_time * 1000
+    ))
+
+    numbers = workload(args.requests, args.distinct)
+    validator = PhoneNumberValidator(cache_size=4096)
+
+    def uncached(country_code, phone_number):
+        return validator._error(*validator.normalize(country_code, phone_number))
+
+    print('uncached: {:>10.0f} validations/sec'.format(rate(uncached, numbers)))
+    print('cached:   {:>10.0f} validations/sec'.format(rate(validator.validate, numbers)))
+    print(validator.cache_info())
+
+
+if __name__ == '__main__':
+    main()
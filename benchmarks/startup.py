@@ -0,0 +1,57 @@
+"""Startup benchmark: import time, app build time and first-request latency.
+
+Each sample runs in a fresh interpreter, like a newly forked or recycled
+worker that did not preload the app:
+
+    python -m benchmarks.startup --runs 10 --config production
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import twofa
+imported = time.perf_counter()
+app = twofa.create_app(sys.argv[1])
+app.config.update(SERVER_NAME='bench.test')
+built = time.perf_counter()
+client = app.test_client()
+client.get('/login')
+first = time.perf_counter()
+client.get('/login')
+second = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (built - imported) * 1000,
+    'first_request_ms': (first - built) * 1000,
+    'warm_request_ms': (second - first) * 1000,
+    'modules': len(sys.modules),
+}))
+'''
+
+
+def sample(config_name):
+    output = subprocess.check_output([sys.executable, '-c', PROBE, config_name])
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--config', default='production')
+    args = parser.parse_args()
+
+    samples = [sample(args.config) for _ in range(args.runs)]
+    for key in samples[0]:
+        values = [s[key] for s in samples]
+        print('{:<18} median {:>9.1f}  min {:>9.1f}  max {:>9.1f}'.format(
+            key, statistics.median(values), min(values), max(values)
+        ))
+
+
+if __name__ == '__main__':
+    main()
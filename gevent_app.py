@@ -0,0 +1,19 @@
+"""Entry point for cooperative (gevent) serving.
+
+The standard library has to be monkey-patched before Flask, SQLAlchemy or
+anything in the twofa package imports it, so the patching happens here,
+outside the package, and only then is twofa.cooperative imported:
+
+    gunicorn -k gevent --worker-connections 2000 'gevent_app:app'
+    python gevent_app.py --port 5000
+
+Requires the gevent package.
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+from twofa.cooperative import app, main  # noqa: E402,F401
+
+if __name__ == '__main__':
+    main()
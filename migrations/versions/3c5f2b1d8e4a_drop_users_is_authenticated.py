@@ -0,0 +1,29 @@
+"""drop users.is_authenticated
+
+Authentication state now lives in the Flask-Login session, so logging in
+and out no longer writes to the users table.
+
+Revision ID: 3c5f2b1d8e4a
+Revises: 770b2a122a82
+Create Date: 2026-10-18 09:12:31.104227
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5f2b1d8e4a'
+down_revision = '770b2a122a82'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('is_authenticated')
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('is_authenticated', sa.Boolean(), nullable=True))
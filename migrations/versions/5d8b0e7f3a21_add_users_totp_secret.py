@@ -0,0 +1,28 @@
+"""add users.totp_secret
+
+Holds the encrypted secret of a locally verified authenticator app.
+
+Revision ID: 5d8b0e7f3a21
+Revises: 9a7e4c6d2f10
+Create Date: 2026-10-18 14:21:09.318442
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8b0e7f3a21'
+down_revision = '9a7e4c6d2f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('totp_secret', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('totp_secret')
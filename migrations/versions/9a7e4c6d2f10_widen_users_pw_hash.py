@@ -0,0 +1,39 @@
+"""widen users.pw_hash
+
+Salted pbkdf2 hashes are already longer than 50 characters, and other
+hashing methods need more room still.
+
+Revision ID: 9a7e4c6d2f10
+Revises: 3c5f2b1d8e4a
+Create Date: 2026-10-18 10:03:47.512930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a7e4c6d2f10'
+down_revision = '3c5f2b1d8e4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column(
+            'pw_hash',
+            existing_type=sa.String(length=50),
+            type_=sa.String(length=255),
+            existing_nullable=True,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column(
+            'pw_hash',
+            existing_type=sa.String(length=255),
+            type_=sa.String(length=50),
+            existing_nullable=True,
+        )
@@ -0,0 +1,70 @@
+"""index users by authy_id and normalized email
+
+Adds users.email_normalized (lowercased email) and indexes it and authy_id,
+and drops the unique constraint on username, which duplicated the primary
+key's own index.
+
+Revision ID: b7e2d4a9c613
+Revises: 5d8b0e7f3a21
+Create Date: 2026-10-18 16:42:55.107381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d4a9c613'
+down_revision = '5d8b0e7f3a21'
+branch_labels = None
+depends_on = None
+
+
+def _users_table(unique_username):
+    # The table as of the previous revision, for SQLite's batch mode: its
+    # unnamed unique constraint can only be dropped by rebuilding the table
+    # from a definition that leaves it out.
+    constraints = [sa.UniqueConstraint('username')] if unique_username else []
+    return sa.Table(
+        'users',
+        sa.MetaData(),
+        sa.Column('username', sa.String(length=50), primary_key=True),
+        sa.Column('email', sa.String(length=120), nullable=True),
+        sa.Column('authy_id', sa.String(length=12), nullable=True),
+        sa.Column('pw_hash', sa.String(length=255), nullable=True),
+        sa.Column('totp_secret', sa.String(length=255), nullable=True),
+        *constraints
+    )
+
+
+def _username_unique_constraints():
+    inspector = sa.inspect(op.get_bind())
+    return [
+        c['name'] for c in inspector.get_unique_constraints('users')
+        if c['column_names'] == ['username']
+    ]
+
+
+def upgrade():
+    names = _username_unique_constraints()
+    batch_args = {}
+    if names and None in names:
+        batch_args = {'copy_from': _users_table(False), 'recreate': 'always'}
+    with op.batch_alter_table('users', **batch_args) as batch_op:
+        for name in names:
+            if name is not None:
+                batch_op.drop_constraint(name, type_='unique')
+        batch_op.add_column(
+            sa.Column('email_normalized', sa.String(length=120), nullable=True)
+        )
+        batch_op.create_index('ix_users_authy_id', ['authy_id'])
+        batch_op.create_index('ix_users_email_normalized', ['email_normalized'])
+    op.execute('UPDATE users SET email_normalized = lower(trim(email))')
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_index('ix_users_email_normalized')
+        batch_op.drop_index('ix_users_authy_id')
+        batch_op.drop_column('email_normalized')
+        batch_op.create_unique_constraint('uq_users_username', ['username'])
@@ -0,0 +1,102 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from tests.base import BaseTestCase
+from twofa.assets import VENDOR_ASSETS, assets
+from twofa.templating import TemplatePrecompiler
+
+
+class AssetsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(AssetsTestCase, self).setUp()
+        self.static = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.static, 'js'))
+        with open(os.path.join(self.static, 'js', 'app.js'), 'w') as f:
+            f.write('console.log("hello");\n' * 20)
+        self.app.static_url_path = '/static'
+        self.app.static_folder = self.static
+        self.app.config['ASSETS_FINGERPRINT'] = True
+        assets.init_app(self.app)
+
+    def tearDown(self):
+        shutil.rmtree(self.static)
+        super(AssetsTestCase, self).tearDown()
+
+    def _asset_url(self, filename):
+        template = self.app.jinja_env.from_string('{{ asset_url(name) }}')
+        return template.render(name=filename)
+
+    def test_urls_carry_the_content_hash(self):
+        # Act
+        url = self._asset_url('js/app.js')
+
+        # Assert
+        self.assertRegex(url, r'^/static/js/app\.[0-9a-f]{12}\.js$')
+
+    def test_fingerprinted_files_are_cached_for_a_year(self):
+        # Arrange
+        url = self._asset_url('js/app.js')
+
+        # Act
+        response = self.client.get(url)
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'hello', response.data)
+        self.assertEqual(
+            response.headers['Cache-Control'], 'public, max-age=31536000, immutable'
+        )
+
+    def test_stale_hashes_are_not_marked_immutable(self):
+        # Act
+        response = self.client.get('/static/js/app.000000000000.js')
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+
+    def test_precompressed_variant_is_served_when_accepted(self):
+        # Arrange
+        runner = self.app.test_cli_runner()
+        runner.invoke(args=['assets', 'compress'])
+        url = self._asset_url('js/app.js')
+
+        # Act
+        compressed = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        plain = self.client.get(url)
+
+        # Assert
+        self.assertTrue(os.path.exists(os.path.join(self.static, 'js', 'app.js.gz')))
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(compressed.mimetype.endswith('/javascript'))
+        self.assertIn(b'hello', gzip.decompress(compressed.data))
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+    def test_missing_vendor_files_fall_back_to_the_cdn(self):
+        # Act
+        url = self._asset_url('vendor/bootstrap.min.js')
+
+        # Assert
+        self.assertEqual(url, VENDOR_ASSETS['vendor/bootstrap.min.js'][0])
+
+
+class TemplatePrecompilerTestCase(BaseTestCase):
+
+    def test_every_template_is_compiled(self):
+        # Arrange
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.app.config['JINJA_BYTECODE_CACHE_DIR'] = cache_dir
+        self.app.config['TEMPLATES_PRECOMPILE'] = True
+
+        # Act
+        TemplatePrecompiler(self.app)
+
+        # Assert
+        compiled = len(self.app.jinja_env.list_templates(extensions=('html',)))
+        self.assertEqual(len(self.app.jinja_env.cache), compiled)
+        self.assertEqual(len(os.listdir(cache_dir)), compiled)
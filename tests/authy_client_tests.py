@@ -0,0 +1,215 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from tests.base import BaseTestCase
+from twofa.authy_client import (
+    AuthyUnavailable,
+    PooledAuthyApiClient,
+    Transport,
+    authy,
+    authy_api,
+    operation_for,
+)
+
+
+class AuthyClientTestCase(TestCase):
+
+    def setUp(self):
+        self.session = MagicMock()
+        self.transport = Transport(
+            self.session,
+            connect_timeout=1,
+            read_timeout=2,
+            operation_timeouts={'tokens.verify': 5},
+        )
+        self.client = PooledAuthyApiClient('key', 'https://authy.test', self.transport)
+
+    def test_operation_for_maps_paths_to_client_methods(self):
+        self.assertEqual(
+            operation_for('POST', '/protected/json/users/new'), 'users.create'
+        )
+        self.assertEqual(
+            operation_for('GET', '/onetouch/json/approval_requests/abc'),
+            'one_touch.get_approval_status',
+        )
+        self.assertEqual(operation_for('GET', '/nope'), 'unknown')
+
+    def test_requests_share_the_pooled_session(self):
+        # Act
+        self.client.users.request_sms('42', {'force': True})
+
+        # Assert
+        self.session.request.assert_called_once()
+        args, kwargs = self.session.request.call_args
+        self.assertEqual(args, ('GET', 'https://authy.test/protected/json/sms/42'))
+        self.assertEqual(kwargs['params'], {'force': True})
+        self.assertEqual(kwargs['headers']['X-Authy-API-Key'], 'key')
+        self.assertEqual(kwargs['timeout'], (1, 2))
+
+    def test_operation_timeout_overrides_read_timeout(self):
+        # Act
+        self.client.tokens.verify('42', '1234567')
+
+        # Assert
+        _, kwargs = self.session.request.call_args
+        self.assertEqual(kwargs['timeout'], (1, 5))
+
+    def test_timeout_raises_authy_unavailable(self):
+        # Arrange
+        self.session.request.side_effect = requests.Timeout('too slow')
+
+        # Act / Assert
+        with self.assertRaises(AuthyUnavailable) as context:
+            self.client.users.request_call('42')
+        self.assertEqual(context.exception.operation, 'users.request_call')
+
+    def test_open_circuit_fails_fast_without_calling_authy(self):
+        # Arrange
+        self.transport.circuit_failures = 2
+        self.session.request.side_effect = requests.ConnectionError('refused')
+        for _ in range(2):
+            with self.assertRaises(AuthyUnavailable):
+                self.client.users.request_sms('42')
+        self.session.request.reset_mock()
+
+        # Act
+        with self.assertRaises(AuthyUnavailable) as context:
+            self.client.users.request_call('42')
+
+        # Assert
+        self.session.request.assert_not_called()
+        self.assertGreater(context.exception.retry_after, 0)
+        self.assertEqual(self.transport.metrics()['circuits_open'], 1)
+
+    def test_open_circuit_is_per_operation_family(self):
+        # Arrange
+        self.transport.circuit_failures = 1
+        self.session.request.side_effect = requests.Timeout('too slow')
+        with self.assertRaises(AuthyUnavailable):
+            self.client.users.request_sms('42')
+        self.session.request.reset_mock(side_effect=True)
+
+        # Act
+        self.client.tokens.verify('42', '1234567')
+
+        # Assert
+        self.session.request.assert_called_once()
+
+    def test_unexpected_errors_keep_a_half_open_circuit_open(self):
+        # Arrange
+        self.transport.circuit_failures = 1
+        self.transport.circuit_reset_timeout = 0
+        self.session.request.side_effect = requests.Timeout('too slow')
+        with self.assertRaises(AuthyUnavailable):
+            self.client.users.request_sms('42')
+        self.session.request.side_effect = ValueError('bad payload')
+
+        # Act
+        with self.assertRaises(ValueError):
+            self.client.users.request_sms('42')
+
+        # Assert
+        breaker, _ = self.transport.guards_for('users')
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertEqual(breaker.failures, 2)
+
+    def test_client_errors_do_not_open_the_circuit(self):
+        # Arrange
+        self.transport.circuit_failures = 1
+        self.session.request.return_value = MagicMock(ok=False, status_code=401)
+
+        # Act
+        self.client.tokens.verify('42', '1234567')
+        self.client.tokens.verify('42', '1234567')
+
+        # Assert
+        self.assertEqual(self.session.request.call_count, 2)
+
+    def test_bulkhead_rejects_calls_over_the_cap(self):
+        # Arrange
+        self.transport.bulkhead_size = 1
+        observed = []
+
+        def request(*args, **kwargs):
+            with self.assertRaises(AuthyUnavailable):
+                self.client.users.request_call('42')
+            observed.append(self.transport.rejected)
+            return MagicMock()
+
+        self.session.request.side_effect = request
+
+        # Act
+        self.client.users.request_sms('42')
+
+        # Assert
+        self.assertEqual(observed, [1])
+
+
+class AuthyExtensionTestCase(BaseTestCase):
+
+    def test_client_is_built_once_and_shared(self):
+        # Act
+        client = authy.client
+
+        # Assert
+        self.assertIsInstance(client, PooledAuthyApiClient)
+        self.assertIs(authy.client, client)
+        self.assertIs(authy_api.users, client.users)
+
+    def test_metrics_report_in_flight_calls(self):
+        # Arrange
+        transport = authy.client.transport
+        observed = {}
+
+        def request(*args, **kwargs):
+            observed.update(authy.metrics())
+            return MagicMock()
+
+        # Act
+        with patch.object(transport.session, 'request', side_effect=request):
+            authy.client.users.request_sms('42')
+
+        # Assert
+        self.assertEqual(observed['in_flight'], 1)
+        self.assertEqual(authy.metrics()['in_flight'], 0)
+        self.assertEqual(authy.metrics()['connections_opened'], 0)
+
+
+class AuthyUnavailableViewTestCase(BaseTestCase):
+
+    @patch('twofa.views.authy_api')
+    def test_unreachable_authy_returns_503(self, authy_api):
+        # Arrange
+        authy_api.phones.verification_start.side_effect = AuthyUnavailable(
+            'phones.verification_start', 'timed out'
+        )
+
+        # Act
+        response = self.client.post('/verification', data={
+            'country_code': '1',
+            'phone_number': '2015550123',
+            'via': 'sms',
+        })
+
+        # Assert
+        self.assertEqual(response.status_code, 503)
+
+    @patch('twofa.views.authy_api')
+    def test_open_circuit_sets_retry_after(self, authy_api):
+        # Arrange
+        authy_api.phones.verification_start.side_effect = AuthyUnavailable(
+            'phones.verification_start', 'circuit open', retry_after=12.5
+        )
+
+        # Act
+        response = self.client.post('/verification', data={
+            'country_code': '1',
+            'phone_number': '2015550123',
+            'via': 'sms',
+        })
+
+        # Assert
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '13')
@@ -1,16 +1,19 @@
 from unittest import TestCase
 
-from twofa import app, db
+from twofa import create_app, db
 
 
 class BaseTestCase(TestCase):
     render_templates = False
 
     def setUp(self):
-        self.client = app.test_client()
-        app.app_context().push()
+        self.app = create_app('testing')
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
         db.create_all()
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
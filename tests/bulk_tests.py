@@ -0,0 +1,195 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
+
+from tests.base import BaseTestCase
+from twofa.authy_client import AuthyUnavailable
+from twofa.bulk import Checkpoint, UserImporter, read_records
+from twofa.database import db
+from twofa.executors import ExecutorSaturated
+from twofa.models import User, password_hasher
+
+CSV = '''username,email,password,country_code,phone_number
+alice,alice@example.com,secret,+1,2015550123
+bob,bob@example.com,secret,1,201-555-0124
+carol,carol@example.com,secret,+1,123
+'''
+
+
+def authy_client(start_id=100):
+    client = MagicMock()
+    ids = iter(range(start_id, start_id + 1000))
+
+    def create(email, phone_number, country_code):
+        return MagicMock(ok=lambda: True, id=next(ids))
+
+    client.users.create.side_effect = create
+    return client
+
+
+class UserImporterTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(UserImporterTestCase, self).setUp()
+        self.rejects = []
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _importer(self, client, **kwargs):
+        def on_reject(record, reason):
+            self.rejects.append((record['username'], reason))
+
+        return UserImporter(client, workers=2, on_reject=on_reject, **kwargs)
+
+    def test_valid_records_are_enrolled_and_inserted(self):
+        # Arrange
+        client = authy_client()
+
+        # Act
+        stats = self._importer(client).run(read_records(io.StringIO(CSV), 'csv'))
+
+        # Assert
+        self.assertEqual((stats.imported, stats.rejected), (2, 1))
+        self.assertEqual(self.rejects[0][0], 'carol')
+        self.assertEqual(client.users.create.call_count, 2)
+        client.users.create.assert_any_call('bob@example.com', '2015550124', '1')
+        alice = User.query.get('alice')
+        self.assertTrue(alice.check_password('secret'))
+        self.assertIn(alice.authy_id, ('100', '101'))
+        self.assertEqual(User.find_by_email('Alice@Example.com'), alice)
+
+    def test_existing_users_and_known_authy_ids_skip_enrollment(self):
+        # Arrange
+        db.session.add(User('alice', 'alice@example.com', 'old', '7'))
+        db.session.commit()
+        records = [
+            {'username': 'alice', 'email': 'a@example.com', 'password': 'new'},
+            {'username': 'dave', 'email': 'd@example.com', 'authy_id': '42',
+             'pw_hash': User('x', password='hashed').pw_hash},
+        ]
+        client = authy_client()
+
+        # Act
+        stats = self._importer(client).run(iter(records))
+
+        # Assert
+        self.assertEqual((stats.imported, stats.skipped), (1, 1))
+        client.users.create.assert_not_called()
+        self.assertTrue(User.query.get('alice').check_password('old'))
+        dave = User.query.get('dave')
+        self.assertEqual(dave.authy_id, '42')
+        self.assertTrue(dave.check_password('hashed'))
+
+    def test_authy_rejections_and_outages_are_reported(self):
+        # Arrange
+        client = MagicMock()
+        client.users.create.side_effect = [
+            MagicMock(ok=lambda: False, errors=lambda: {'email': 'is invalid'}),
+            AuthyUnavailable('users.create', 'circuit open', retry_after=0.01),
+            AuthyUnavailable('users.create', 'circuit open', retry_after=0.01),
+        ]
+        importer = self._importer(client, retries=2)
+        importer.workers = 1
+
+        # Act
+        stats = importer.run(read_records(io.StringIO(CSV), 'csv'))
+
+        # Assert
+        self.assertEqual((stats.imported, stats.rejected), (0, 3))
+        reasons = dict(self.rejects)
+        self.assertEqual(reasons['alice'], 'email: is invalid')
+        self.assertIn('circuit open', reasons['bob'])
+
+    def test_unexpected_errors_reject_only_their_record(self):
+        # Arrange
+        client = authy_client()
+        enroll = client.users.create.side_effect
+
+        def create(email, phone_number, country_code):
+            if email == 'alice@example.com':
+                raise ValueError('boom')
+            return enroll(email, phone_number, country_code)
+
+        client.users.create.side_effect = create
+        saturated = MagicMock(**{'run.side_effect': ExecutorSaturated()})
+
+        # Act
+        with patch.object(password_hasher, 'executor', saturated), \
+                self.assertLogs('twofa.bulk'):
+            stats = self._importer(client).run(read_records(io.StringIO(CSV), 'csv'))
+
+        # Assert
+        self.assertEqual((stats.imported, stats.rejected), (1, 2))
+        self.assertEqual(dict(self.rejects)['alice'], 'boom')
+        self.assertTrue(User.query.get('bob').check_password('secret'))
+
+    def test_resumes_after_the_last_committed_batch(self):
+        # Arrange
+        path = os.path.join(self.tmp, 'import.checkpoint')
+        Checkpoint(path).save(1)
+        client = authy_client()
+
+        # Act
+        stats = self._importer(client, batch_size=1).run(
+            read_records(io.StringIO(CSV), 'csv'), Checkpoint(path)
+        )
+
+        # Assert
+        self.assertIsNone(User.query.get('alice'))
+        self.assertIsNotNone(User.query.get('bob'))
+        self.assertEqual(stats.imported, 1)
+        self.assertEqual(Checkpoint(path).position, 3)
+
+
+class UserCommandsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(UserCommandsTestCase, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.runner = self.app.test_cli_runner()
+
+    @patch('twofa.bulk.authy')
+    def test_import_writes_rejects_file(self, authy):
+        # Arrange
+        authy.client = authy_client()
+        source = os.path.join(self.tmp, 'users.csv')
+        rejects = os.path.join(self.tmp, 'rejects.jsonl')
+        with open(source, 'w') as f:
+            f.write(CSV)
+
+        # Act
+        result = self.runner.invoke(
+            args=['users', 'import', source, '--rejects', rejects]
+        )
+
+        # Assert
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('2 imported, 0 skipped, 1 rejected', result.output)
+        with open(rejects) as f:
+            rejected = [json.loads(line) for line in f]
+        self.assertEqual(rejected[0]['username'], 'carol')
+        self.assertIn('error', rejected[0])
+
+    def test_export_round_trips_through_import(self):
+        # Arrange
+        db.session.add(User('alice', 'alice@example.com', 'secret', '7'))
+        db.session.commit()
+        export = os.path.join(self.tmp, 'users.jsonl')
+
+        # Act
+        result = self.runner.invoke(
+            args=['users', 'export', export, '--with-password-hashes']
+        )
+        db.session.delete(User.query.get('alice'))
+        db.session.commit()
+        self.runner.invoke(args=['users', 'import', export])
+
+        # Assert
+        self.assertEqual(result.exit_code, 0, result.output)
+        alice = User.query.get('alice')
+        self.assertEqual(alice.authy_id, '7')
+        self.assertTrue(alice.check_password('secret'))
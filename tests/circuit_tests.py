@@ -0,0 +1,83 @@
+from unittest import TestCase
+
+from twofa.circuit import Bulkhead, CircuitBreaker
+
+
+class CircuitBreakerTestCase(TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker(2, 10, clock=lambda: self.now)
+
+    def test_opens_after_consecutive_failures(self):
+        # Act
+        self.breaker.record_failure()
+        still_closed = self.breaker.allow()
+        self.breaker.record_failure()
+
+        # Assert
+        self.assertTrue(still_closed)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 10)
+
+    def test_success_resets_failure_count(self):
+        # Act
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+
+        # Assert
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_lets_one_trial_through(self):
+        # Arrange
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now = 10
+
+        # Act
+        trial = self.breaker.allow()
+        second = self.breaker.allow()
+        self.breaker.record_success()
+
+        # Assert
+        self.assertTrue(trial)
+        self.assertFalse(second)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_reopens_the_circuit(self):
+        # Arrange
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now = 10
+        self.breaker.allow()
+
+        # Act
+        self.breaker.record_failure()
+
+        # Assert
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 10)
+
+
+class BulkheadTestCase(TestCase):
+
+    def test_rejects_calls_over_the_cap(self):
+        # Arrange
+        bulkhead = Bulkhead(1)
+
+        # Act
+        first = bulkhead.acquire()
+        second = bulkhead.acquire()
+        bulkhead.release()
+        third = bulkhead.acquire()
+
+        # Assert
+        self.assertEqual((first, second, third), (True, False, True))
+
+    def test_zero_means_unbounded(self):
+        # Arrange
+        bulkhead = Bulkhead(0)
+
+        # Act / Assert
+        self.assertTrue(all(bulkhead.acquire() for _ in range(100)))
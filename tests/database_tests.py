@@ -0,0 +1,80 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from tests.base import BaseTestCase
+from twofa import create_app
+from twofa.database import InstrumentedQueuePool, PoolStats, db
+
+
+class PoolStatsTestCase(TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(
+            'sqlite://', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0
+        )
+        self.engine.pool.stats = self.stats = PoolStats()
+        self.stats.listen(self.engine.pool)
+
+    def test_queue_pool_reports_checkouts(self):
+        # Act
+        connection = self.engine.connect()
+        during = self.stats.snapshot(self.engine.pool)
+        connection.close()
+        after = self.stats.snapshot(self.engine.pool)
+
+        # Assert
+        self.assertEqual(during['checked_out'], 1)
+        self.assertEqual(after['checked_out'], 0)
+        self.assertEqual(after['checkouts'], 1)
+        self.assertEqual(after['connects'], 1)
+        self.assertEqual(after['waits'], 0)
+        self.assertEqual(after['wait_seconds_total'], 0)
+
+    def test_only_checkouts_from_an_exhausted_pool_wait(self):
+        # Arrange
+        connection = self.engine.connect()
+        threading.Timer(0.05, connection.close).start()
+
+        # Act
+        self.engine.connect().close()
+
+        # Assert
+        stats = self.stats.snapshot(self.engine.pool)
+        self.assertEqual(stats['waits'], 1)
+        self.assertGreaterEqual(stats['wait_seconds_total'], 0.04)
+
+
+class EngineOptionsTestCase(BaseTestCase):
+
+    def test_pool_options_are_dropped_for_sqlite(self):
+        # Arrange
+        before = db.pool_stats()['checkouts']
+
+        # Act
+        db.session.execute('SELECT 1')
+        stats = db.pool_stats()
+
+        # Assert
+        self.assertEqual(stats['checkouts'], before + 1)
+        self.assertNotIn('size', stats)
+
+    def test_sqlite_pragmas_are_applied_on_connect(self):
+        # Arrange
+        path = os.path.join(tempfile.mkdtemp(), 'pragmas.sqlite')
+        app = create_app('testing')
+        app.config.update(
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + path,
+            SQLITE_PRAGMAS={'journal_mode': 'WAL'},
+        )
+
+        # Act
+        with app.app_context():
+            mode = db.session.execute('PRAGMA journal_mode').scalar()
+            db.session.remove()
+
+        # Assert
+        self.assertEqual(mode, 'wal')
@@ -0,0 +1,97 @@
+import threading
+from unittest import TestCase
+
+from tests.base import BaseTestCase
+from twofa.database import db
+from twofa.executors import BoundedExecutor, ExecutorSaturated
+from twofa.models import User, password_hasher
+
+
+class BoundedExecutorTestCase(TestCase):
+
+    def setUp(self):
+        self.executor = BoundedExecutor(1, queue_limit=0)
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+
+    def _block(self):
+        self.started.set()
+        self.release.wait(1)
+
+    def test_runs_calls_and_records_metrics(self):
+        # Act
+        result = self.executor.run(pow, 2, 10)
+
+        # Assert
+        self.assertEqual(result, 1024)
+        metrics = self.executor.metrics()
+        self.assertEqual(metrics['completed'], 1)
+        self.assertEqual(metrics['queue_depth'], 0)
+
+    def test_rejects_work_when_saturated(self):
+        # Arrange
+        blocker = threading.Thread(target=self.executor.run, args=(self._block,))
+        blocker.start()
+        self.started.wait(1)
+
+        # Act / Assert
+        with self.assertRaises(ExecutorSaturated):
+            self.executor.run(pow, 2, 10)
+        self.assertEqual(self.executor.metrics()['rejected'], 1)
+        self.release.set()
+        blocker.join()
+
+
+class PasswordHashingPoolTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        db.session.add(User(username='test', password='test'))
+        db.session.commit()
+        password_hasher.executor = BoundedExecutor(1, queue_limit=0)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        password_hasher.executor.shutdown()
+        password_hasher.executor = None
+        super().tearDown()
+
+    def test_login_returns_503_when_hashing_pool_is_full(self):
+        # Arrange
+        started = threading.Event()
+
+        def block():
+            started.set()
+            self.release.wait(1)
+
+        blocker = threading.Thread(target=password_hasher.executor.run, args=(block,))
+        blocker.start()
+        started.wait(1)
+
+        # Act
+        response = self.client.post('/login', data={
+            'username': 'test',
+            'password': 'test'
+        })
+
+        # Assert
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.release.set()
+        blocker.join()
+
+    def test_login_hashes_on_the_pool(self):
+        # Act
+        response = self.client.post('/login', data={
+            'username': 'test',
+            'password': 'test'
+        })
+
+        # Assert
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(password_hasher.metrics()['completed'], 1)
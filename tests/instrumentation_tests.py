@@ -0,0 +1,69 @@
+from tests.base import BaseTestCase
+from twofa import db
+from twofa.instrumentation import QueryBudgetExceeded, count_queries
+from twofa.models import User
+
+
+class QueryInstrumentationTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(QueryInstrumentationTestCase, self).setUp()
+        db.session.add(User('test', 'test@example.com', 'password', '123'))
+        db.session.commit()
+
+    def test_count_queries_collects_statements(self):
+        # Act
+        with count_queries() as statements:
+            User.query.get('test')
+            db.session.expire_all()
+            User.query.filter_by(email='test@example.com').first()
+
+        # Assert
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(all(s.startswith('SELECT') for s in statements))
+
+    def test_stats_headers_report_query_count(self):
+        # Arrange
+        self.app.config['QUERY_STATS_HEADERS'] = True
+
+        # Act
+        resp = self.client.get('/login')
+
+        # Assert
+        self.assertEqual(resp.headers['X-DB-Queries'], '0')
+        self.assertIn('X-DB-Time', resp.headers)
+
+    def test_strict_budget_raises_when_exceeded(self):
+        # Arrange
+        self.app.config['QUERY_BUDGETS'] = {'twofa.login': 0}
+
+        # Act / Assert
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.post('/login', data={'username': 'test', 'password': 'password'})
+
+    def test_relaxed_budget_only_logs(self):
+        # Arrange
+        self.app.config.update(
+            QUERY_BUDGETS={'twofa.login': 0}, QUERY_BUDGET_STRICT=False
+        )
+
+        # Act
+        with self.assertLogs('twofa.sql', 'WARNING') as logs:
+            resp = self.client.post(
+                '/login', data={'username': 'test', 'password': 'password'}
+            )
+
+        # Assert
+        self.assertEqual(resp.status_code, 302)
+        self.assertIn('twofa.login issued 1 queries (budget 0)', logs.output[0])
+
+    def test_slow_queries_are_logged_with_endpoint(self):
+        # Arrange
+        self.app.config['SLOW_QUERY_THRESHOLD'] = 0
+
+        # Act
+        with self.assertLogs('twofa.sql', 'WARNING') as logs:
+            self.client.post('/login', data={'username': 'test', 'password': 'password'})
+
+        # Assert
+        self.assertIn('in twofa.login', logs.output[0])
@@ -0,0 +1,258 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from flask import Flask
+
+from tests.base import BaseTestCase
+from twofa.authy_client import AuthyUnavailable
+from twofa.jobs import FAILURE_HANDLERS, TASKS, JobFailed, JobQueue, jobs
+from twofa.models import User
+
+REGISTRATION = {
+    'username': 'newuser',
+    'email': 'new@example.com',
+    'password': 'secret',
+    'confirm_password': 'secret',
+    'country_code': '1',
+    'phone_number': '2015550123',
+}
+
+
+class JobQueueTestCase(TestCase):
+
+    def setUp(self):
+        self.queue = JobQueue(Flask(__name__), workers=0, max_attempts=3, retry_delay=0)
+        self.calls = []
+        self.addCleanup(TASKS.pop, 'test.task', None)
+
+    def _register(self, *outcomes):
+        outcomes = list(outcomes)
+
+        def run(*args):
+            self.calls.append(args)
+            outcome = outcomes.pop(0)
+            if outcome is not None:
+                raise outcome
+
+        TASKS['test.task'] = run
+
+    def test_transient_errors_are_retried(self):
+        # Arrange
+        self._register(RuntimeError('flaky'), None)
+
+        # Act
+        job_id = self.queue.enqueue('test.task', 'a', 1)
+        self.queue.drain()
+
+        # Assert
+        self.assertEqual(self.calls, [('a', 1), ('a', 1)])
+        self.assertEqual(self.queue.status(job_id), {'state': 'done', 'error': None})
+        self.assertEqual(self.queue.stats()['retried_total'], 1)
+
+    def test_job_failed_is_not_retried(self):
+        # Arrange
+        self._register(JobFailed('bad number'))
+
+        # Act
+        job_id = self.queue.enqueue('test.task')
+        self.queue.drain()
+
+        # Assert
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(
+            self.queue.status(job_id), {'state': 'failed', 'error': 'bad number'}
+        )
+
+    def test_gives_up_after_max_attempts(self):
+        # Arrange
+        self._register(*[RuntimeError('down')] * 3)
+
+        # Act
+        with self.assertLogs('twofa.jobs'):
+            job_id = self.queue.enqueue('test.task')
+            self.queue.drain()
+
+        # Assert
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(self.queue.status(job_id)['state'], 'failed')
+
+    def test_failure_handler_runs_once_attempts_are_used_up(self):
+        # Arrange
+        self._register(*[RuntimeError('down')] * 3)
+        failures = []
+        FAILURE_HANDLERS['test.task'] = lambda error, *args: failures.append(
+            (error, args)
+        )
+        self.addCleanup(FAILURE_HANDLERS.pop, 'test.task', None)
+
+        # Act
+        with self.assertLogs('twofa.jobs'):
+            self.queue.enqueue('test.task', 'a')
+            self.queue.drain()
+
+        # Assert
+        self.assertEqual(failures, [('down', ('a',))])
+
+    def test_retries_wait_for_their_backoff(self):
+        # Arrange
+        self.queue.retry_delay = 60
+        self._register(RuntimeError('flaky'), None)
+
+        # Act
+        job_id = self.queue.enqueue('test.task')
+        self.queue.drain()
+
+        # Assert
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.queue.status(job_id)['state'], 'pending')
+        self.assertEqual(self.queue.stats()['queued'], 1)
+
+    def test_worker_threads_run_jobs(self):
+        # Arrange
+        self._register(None)
+        self.queue.workers = 1
+        self.addCleanup(self.queue.stop)
+
+        # Act
+        job_id = self.queue.enqueue('test.task')
+        for _ in range(200):
+            if self.queue.status(job_id)['state'] == 'done':
+                break
+            self.queue._stopping.wait(0.01)
+
+        # Assert
+        self.assertEqual(self.queue.status(job_id)['state'], 'done')
+
+
+class BackgroundViewsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(BackgroundViewsTestCase, self).setUp()
+        self.app.config.update(JOBS_ENABLED=True, JOB_WORKERS=0)
+        jobs.init_app(self.app)
+        self.queue = self.app.extensions['jobs']
+
+    @patch('twofa.tasks.authy_api')
+    @patch('twofa.views.authy_api')
+    def test_registration_enrolls_with_authy_in_background(self, view_api, task_api):
+        # Arrange
+        task_api.users.create.return_value = MagicMock(id='4242')
+
+        # Act
+        response = self.client.post('/register', data=REGISTRATION)
+        pending = self.client.get('/enrollment')
+        self.queue.drain()
+        done = self.client.get('/enrollment')
+
+        # Assert
+        self.assertTrue(response.location.endswith('/enrollment'))
+        view_api.users.create.assert_not_called()
+        self.assertIn('http-equiv="refresh"', pending.get_data(as_text=True))
+        task_api.users.create.assert_called_once_with(
+            'new@example.com', '2015550123', '+1'
+        )
+        self.assertEqual(User.query.get('newuser').authy_id, '4242')
+        self.assertTrue(done.location.endswith('/protected'))
+
+    @patch('twofa.tasks.authy_api')
+    def test_rejected_registration_is_rolled_back(self, task_api):
+        # Arrange
+        task_api.users.create.return_value = MagicMock(**{
+            'ok.return_value': False,
+            'errors.return_value': {'cellphone': 'is invalid'},
+        })
+
+        # Act
+        self.client.post('/register', data=REGISTRATION)
+        self.queue.drain()
+        response = self.client.get('/enrollment')
+
+        # Assert
+        self.assertIn('cellphone: is invalid', response.get_data(as_text=True))
+        self.assertIsNone(User.query.get('newuser'))
+
+    @patch('twofa.tasks.authy_api')
+    def test_registration_is_rolled_back_when_retries_run_out(self, task_api):
+        # Arrange
+        self.queue.retry_delay = 0
+        task_api.users.create.side_effect = AuthyUnavailable(
+            'users.create', 'circuit open'
+        )
+
+        # Act
+        self.client.post('/register', data=REGISTRATION)
+        with self.assertLogs('twofa.jobs'):
+            self.queue.drain()
+        failed = self.client.get('/enrollment')
+        again = self.client.post('/register', data=REGISTRATION)
+
+        # Assert
+        self.assertEqual(task_api.users.create.call_count, self.queue.max_attempts)
+        self.assertIn('circuit open', failed.get_data(as_text=True))
+        self.assertTrue(again.location.endswith('/enrollment'))
+
+    @patch('twofa.tasks.authy_api')
+    def test_enrollment_with_an_unknown_job_status_keeps_waiting(self, task_api):
+        # Arrange
+        self.client.post('/register', data=REGISTRATION)
+        with self.client.session_transaction() as sess:
+            sess['enrollment_job'] = 'queued-by-another-worker'
+
+        # Act
+        response = self.client.get('/enrollment')
+
+        # Assert
+        self.assertIn('http-equiv="refresh"', response.get_data(as_text=True))
+        self.assertNotIn('Register again', response.get_data(as_text=True))
+        self.assertIsNotNone(User.query.get('newuser'))
+
+    @patch('twofa.tasks.authy_api')
+    def test_pending_enrollment_redirects_2fa(self, task_api):
+        # Act
+        self.client.post('/register', data=REGISTRATION)
+        response = self.client.get('/2fa')
+
+        # Assert
+        self.assertTrue(response.location.endswith('/enrollment'))
+
+    @patch('twofa.tasks.authy_api')
+    @patch('twofa.views.authy_api')
+    def test_verification_start_runs_in_background(self, view_api, task_api):
+        # Act
+        response = self.client.post('/verification', data={
+            'country_code': '1',
+            'phone_number': '2015550123',
+            'via': 'sms',
+        })
+        pending = self.client.get('/verification/token')
+        self.queue.drain()
+
+        # Assert
+        self.assertEqual(response.status_code, 302)
+        view_api.phones.verification_start.assert_not_called()
+        self.assertIn('Sending your verification code', pending.get_data(as_text=True))
+        task_api.phones.verification_start.assert_called_once_with(
+            '2015550123', '+1', via='sms'
+        )
+
+    @patch('twofa.tasks.authy_api')
+    def test_failed_verification_start_is_shown(self, task_api):
+        # Arrange
+        task_api.phones.verification_start.return_value = MagicMock(**{
+            'ok.return_value': False,
+            'errors.return_value': {'message': 'SEND FAILED XYZ'},
+        })
+        self.client.post('/verification', data={
+            'country_code': '1',
+            'phone_number': '2015550123',
+            'via': 'sms',
+        })
+        self.queue.drain()
+
+        # Act
+        first = self.client.get('/verification/token')
+        reload = self.client.get('/verification/token')
+
+        # Assert
+        self.assertIn('message: SEND FAILED XYZ', first.get_data(as_text=True))
+        self.assertIn('message: SEND FAILED XYZ', reload.get_data(as_text=True))
@@ -0,0 +1,109 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from tests.base import BaseTestCase
+from twofa import db
+from twofa.authy_client import AuthyUnavailable, authy
+from twofa.metrics import Counter, Histogram, render
+from twofa.models import User
+
+
+class HistogramTestCase(TestCase):
+
+    def test_buckets_are_cumulative_in_text_format(self):
+        # Arrange
+        histogram = Histogram('latency_seconds', 'Latency.', ('route',), (0.1, 1))
+
+        # Act
+        histogram.observe(0.05, 'a')
+        histogram.observe(0.5, 'a')
+        histogram.observe(5, 'a')
+        text = render([histogram])
+
+        # Assert
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('latency_seconds_bucket{route="a",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{route="a",le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{route="a",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_sum{route="a"} 5.55', text)
+        self.assertIn('latency_seconds_count{route="a"} 3', text)
+
+    def test_label_values_are_escaped(self):
+        # Arrange
+        counter = Counter('errors_total', 'Errors.', ('reason',))
+
+        # Act
+        counter.inc('say "hi"\n')
+
+        # Assert
+        self.assertIn(r'errors_total{reason="say \"hi\"\n"} 1', render([counter]))
+
+
+class MetricsEndpointTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(MetricsEndpointTestCase, self).setUp()
+        db.session.add(User('test', 'test@example.com', 'password', '123'))
+        db.session.commit()
+        self.registry = self.app.extensions['metrics']
+
+    def test_requests_are_timed_per_endpoint(self):
+        # Act
+        self.client.post('/login', data={'username': 'test', 'password': 'password'})
+        text = self.client.get('/metrics').get_data(as_text=True)
+
+        # Assert
+        duration = self.registry.request_duration
+        self.assertEqual(duration.count('twofa.login', 'POST', '302'), 1)
+        self.assertEqual(self.registry.db_queries.value('twofa.login'), 1)
+        self.assertIn(
+            'http_request_duration_seconds_count'
+            '{endpoint="twofa.login",method="POST",status="302"} 1',
+            text,
+        )
+        self.assertIn('db_pool_checkouts_total', text)
+        self.assertIn('user_cache_hits_total', text)
+
+    def test_other_addresses_need_the_token(self):
+        # Arrange
+        self.app.config['METRICS_TOKEN'] = 'scrape-secret'
+        remote = {'REMOTE_ADDR': '203.0.113.7'}
+
+        # Act
+        anonymous = self.client.get('/metrics', environ_base=remote)
+        forged = self.client.get('/metrics', environ_base=remote,
+                                 headers={'Authorization': 'Bearer guess'})
+        scraper = self.client.get('/metrics', environ_base=remote,
+                                  headers={'Authorization': 'Bearer scrape-secret'})
+
+        # Assert
+        self.assertEqual(anonymous.status_code, 403)
+        self.assertEqual(forged.status_code, 403)
+        self.assertEqual(scraper.status_code, 200)
+
+    def test_template_rendering_is_timed(self):
+        # Act
+        self.client.get('/login')
+
+        # Assert
+        self.assertEqual(self.registry.render_duration.count('login.html'), 1)
+
+    def test_authy_calls_are_counted_by_operation_and_outcome(self):
+        # Arrange
+        session = authy.client.transport.session
+        failed = MagicMock(ok=False, status_code=400)
+
+        # Act
+        with patch.object(session, 'request', return_value=failed):
+            authy.client.users.request_sms('42')
+        with patch.object(session, 'request', side_effect=requests.Timeout()):
+            with self.assertRaises(AuthyUnavailable):
+                authy.client.tokens.verify('42', '1234567')
+
+        # Assert
+        requests_total = self.registry.authy_requests
+        self.assertEqual(requests_total.value('users.request_sms', 'error'), 1)
+        self.assertEqual(requests_total.value('tokens.verify', 'unavailable'), 1)
+        self.assertEqual(self.registry.authy_duration.count('tokens.verify'), 1)
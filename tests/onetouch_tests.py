@@ -0,0 +1,117 @@
+import threading
+import time
+from unittest import TestCase
+
+from twofa.onetouch import ApprovalStatusCache, MemoryBackend
+
+
+class ApprovalStatusCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = ApprovalStatusCache(pending_ttl=0.05, status_ttl=60)
+
+    def test_terminal_statuses_outlive_pending_ones(self):
+        # Act
+        self.cache.publish('pending-uuid', 'pending')
+        self.cache.publish('approved-uuid', 'approved')
+        time.sleep(0.1)
+
+        # Assert
+        self.assertIsNone(self.cache.get('pending-uuid'))
+        self.assertEqual(self.cache.get('approved-uuid'), 'approved')
+
+    def test_lookup_uses_cached_status(self):
+        # Arrange
+        self.cache.publish('uuid', 'denied')
+
+        # Act
+        status = self.cache.lookup('uuid', lambda uuid: self.fail('fetched'))
+
+        # Assert
+        self.assertEqual(status, 'denied')
+
+    def test_concurrent_lookups_share_one_fetch(self):
+        # Arrange
+        calls = []
+        release = threading.Event()
+
+        def fetch(uuid):
+            calls.append(uuid)
+            release.wait(1)
+            return 'approved'
+
+        results = []
+
+        def lookup():
+            results.append(self.cache.lookup('uuid', fetch))
+
+        threads = [threading.Thread(target=lookup) for _ in range(5)]
+
+        # Act
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        # Assert
+        self.assertEqual(calls, ['uuid'])
+        self.assertEqual(results, ['approved'] * 5)
+
+    def test_failed_fetch_is_raised_to_every_waiter_and_not_cached(self):
+        # Arrange
+        def fetch(uuid):
+            raise RuntimeError('upstream down')
+
+        # Act / Assert
+        with self.assertRaises(RuntimeError):
+            self.cache.lookup('uuid', fetch)
+        self.assertIsNone(self.cache.get('uuid'))
+
+    def test_wait_returns_as_soon_as_status_changes(self):
+        # Arrange
+        self.cache.publish('uuid', 'pending')
+        timer = threading.Timer(0.02, self.cache.publish, ('uuid', 'approved'))
+
+        # Act
+        timer.start()
+        start = time.monotonic()
+        status = self.cache.wait('uuid', 'pending', timeout=5)
+
+        # Assert
+        self.assertEqual(status, 'approved')
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_wait_asks_upstream_when_no_callback_arrives(self):
+        # Arrange
+        self.cache.fetch_interval = 0.05
+        self.cache.publish('uuid', 'pending')
+        calls = []
+
+        def fetch(uuid):
+            calls.append(uuid)
+            return 'approved' if len(calls) > 1 else 'pending'
+
+        # Act
+        start = time.monotonic()
+        status = self.cache.wait('uuid', 'pending', timeout=5, fetch=fetch)
+
+        # Assert
+        self.assertEqual(status, 'approved')
+        self.assertEqual(len(calls), 2)
+        self.assertLess(time.monotonic() - start, 1)
+
+
+class MemoryBackendTestCase(TestCase):
+
+    def test_entries_expire(self):
+        # Arrange
+        backend = MemoryBackend()
+
+        # Act
+        backend.set('key', 'value', 0.01)
+        time.sleep(0.02)
+
+        # Assert
+        self.assertIsNone(backend.get('key'))
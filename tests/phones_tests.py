@@ -0,0 +1,30 @@
+from unittest import TestCase
+
+from twofa.phones import PhoneNumberValidator
+
+
+class PhoneNumberValidatorTestCase(TestCase):
+
+    def setUp(self):
+        self.validator = PhoneNumberValidator(cache_size=16)
+
+    def test_valid_number(self):
+        self.assertIsNone(self.validator.validate('+1', '2015550123'))
+
+    def test_invalid_number(self):
+        self.assertEqual(
+            self.validator.validate('+1', '1234'), 'Invalid phone number'
+        )
+
+    def test_unparseable_number_reports_parser_error(self):
+        error = self.validator.validate('+1', 'abc')
+        self.assertIn('did not seem to be a phone number', error)
+
+    def test_equivalent_spellings_share_a_cache_entry(self):
+        # Act
+        self.validator.validate('+1', '(201) 555-0123')
+        self.validator.validate('1', '201 555 0123')
+
+        # Assert
+        info = self.validator.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
@@ -0,0 +1,88 @@
+import glob
+import json
+import os
+import pstats
+import shutil
+import tempfile
+
+from tests.base import BaseTestCase
+from twofa.authy_client import Authy
+from twofa.profiling import ProfilerMiddleware, request_profiling
+
+
+class RequestProfilingTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(RequestProfilingTestCase, self).setUp()
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        self.app.config.update(PROFILING_ENABLED=True, PROFILE_DIR=self.profile_dir)
+
+    def _enable(self, **config):
+        self.app.config.update(config)
+        request_profiling.init_app(self.app)
+
+    def _token(self):
+        output = self.app.test_cli_runner().invoke(args=['profile-token']).output
+        header, value = output.strip().split(': ')
+        return {header: value}
+
+    def _files(self, pattern):
+        return glob.glob(os.path.join(self.profile_dir, pattern))
+
+    def test_disabled_by_default(self):
+        # Assert
+        self.assertNotIsInstance(self.app.wsgi_app, ProfilerMiddleware)
+
+    def test_signed_header_profiles_the_request(self):
+        # Arrange
+        self._enable()
+
+        # Act
+        response = self.client.get('/login', headers=self._token())
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self._files('*twofa.login*.folded')), 1)
+        with open(self._files('*.json')[0]) as f:
+            tags = json.load(f)
+        self.assertEqual(tags['endpoint'], 'twofa.login')
+        self.assertEqual(tags['status'], '200')
+        self.assertIn('db_queries', tags)
+        self.assertIn('authy_time_ms', tags)
+
+    def test_invalid_or_missing_tokens_are_not_profiled(self):
+        # Arrange
+        self._enable()
+
+        # Act
+        self.client.get('/login', headers={'X-Profile': 'profile.forged.token'})
+        self.client.get('/login')
+
+        # Assert
+        self.assertEqual(self._files('*'), [])
+
+    def test_sampled_requests_get_a_cprofile_dump(self):
+        # Arrange
+        self._enable(PROFILER='cprofile', PROFILE_SAMPLE_RATE=1.0)
+
+        # Act
+        self.client.get('/login')
+
+        # Assert
+        stats = pstats.Stats(self._files('*.prof')[0])
+        self.assertGreater(stats.total_calls, 0)
+
+    def test_authy_time_is_tracked_per_request(self):
+        # Arrange
+        observe = self.app.extensions['authy'].observer
+
+        # Act
+        with self.app.test_request_context('/token/sms'):
+            self.app.preprocess_request()
+            observe('users.request_sms', 'ok', 0.25)
+            observe('users.status', 'ok', 0.5)
+            stats = Authy.request_stats()
+
+        # Assert
+        self.assertEqual(stats, (2, 0.75))
@@ -0,0 +1,356 @@
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from tests.base import BaseTestCase
+from twofa.database import db
+from twofa.models import User
+from twofa.ratelimit import (
+    AttemptLimiter,
+    MemoryAttemptBackend,
+    MemoryBucketBackend,
+    RateLimited,
+    TokenBucketLimiter,
+    rate_limiter,
+)
+
+
+class TokenBucketLimiterTestCase(TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.backend = MemoryBucketBackend(clock=lambda: self.now)
+        self.limiter = TokenBucketLimiter(
+            self.backend, per_user={'sms': (2, 60)}, per_ip={'sms': (3, 60)}
+        )
+
+    def test_burst_then_reject_with_retry_after(self):
+        # Act
+        self.limiter.hit('sms', 'alice', '10.0.0.1')
+        self.limiter.hit('sms', 'alice', '10.0.0.1')
+        with self.assertRaises(RateLimited) as context:
+            self.limiter.hit('sms', 'alice', '10.0.0.1')
+
+        # Assert
+        self.assertAlmostEqual(context.exception.retry_after, 30)
+        self.assertEqual(self.limiter.stats(), {'allowed_total': 2, 'rejected_total': 1})
+
+    def test_tokens_refill_over_time(self):
+        # Arrange
+        self.limiter.hit('sms', 'alice')
+        self.limiter.hit('sms', 'alice')
+
+        # Act
+        self.now = 30
+        self.limiter.hit('sms', 'alice')
+
+        # Assert
+        with self.assertRaises(RateLimited):
+            self.limiter.hit('sms', 'alice')
+
+    def test_ip_limit_applies_across_users(self):
+        # Act
+        for user in ('alice', 'bob', 'carol'):
+            self.limiter.hit('sms', user, '10.0.0.1')
+
+        # Assert
+        with self.assertRaises(RateLimited):
+            self.limiter.hit('sms', 'dave', '10.0.0.1')
+        self.limiter.hit('sms', 'dave', '10.0.0.2')
+
+    def test_rejected_calls_do_not_spend_the_shared_ip_allowance(self):
+        # Arrange
+        self.limiter.hit('sms', 'alice', '10.0.0.1')
+        self.limiter.hit('sms', 'alice', '10.0.0.1')
+        for _ in range(30):
+            with self.assertRaises(RateLimited):
+                self.limiter.hit('sms', 'alice', '10.0.0.1')
+
+        # Act
+        self.limiter.hit('sms', 'bob', '10.0.0.1')
+
+        # Assert
+        with self.assertRaises(RateLimited):
+            self.limiter.hit('sms', 'carol', '10.0.0.1')
+
+    def test_unlisted_actions_are_not_limited(self):
+        # Act / Assert
+        for _ in range(10):
+            self.limiter.hit('voice', 'alice', '10.0.0.1')
+
+    def test_full_buckets_are_swept(self):
+        # Arrange
+        self.backend.max_keys = 2
+        self.limiter.hit('sms', 'alice')
+        self.limiter.hit('sms', 'bob')
+
+        # Act
+        self.now = 60
+        self.limiter.hit('sms', 'carol')
+
+        # Assert
+        self.assertEqual(list(self.backend._buckets), ['sms:user:carol'])
+
+
+class AttemptLimiterTestCase(TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.limiter = AttemptLimiter(
+            MemoryAttemptBackend(clock=lambda: self.now),
+            {'token_verify': (3, 60, 300)},
+        )
+
+    def _hit(self, times, key='alice'):
+        for _ in range(times):
+            self.limiter.hit('token_verify', key)
+
+    def _lock_out(self, key='alice'):
+        self._hit(3, key)
+        with self.assertRaises(RateLimited) as context:
+            self.limiter.hit('token_verify', key)
+        return context.exception
+
+    def test_locks_out_after_max_attempts(self):
+        # Act
+        error = self._lock_out()
+
+        # Assert
+        self.assertEqual(error.retry_after, 300)
+        self.limiter.hit('token_verify', 'bob')
+        self.assertEqual(self.limiter.stats(), {'allowed_total': 4, 'rejected_total': 1})
+
+    def test_lockout_expires(self):
+        # Arrange
+        self._lock_out()
+
+        # Act
+        self.now = 301
+
+        # Assert
+        self.limiter.hit('token_verify', 'alice')
+
+    def test_attempts_outside_the_window_are_forgotten(self):
+        # Arrange
+        self._hit(2)
+
+        # Act
+        self.now = 61
+        self._hit(3)
+
+        # Assert
+        with self.assertRaises(RateLimited):
+            self.limiter.hit('token_verify', 'alice')
+
+    def test_success_clears_attempts(self):
+        # Arrange
+        self._hit(2)
+
+        # Act
+        self.limiter.succeeded('token_verify', 'alice')
+        self._hit(3)
+
+        # Assert
+        with self.assertRaises(RateLimited):
+            self.limiter.hit('token_verify', 'alice')
+
+    def test_concurrent_attempts_cannot_exceed_the_limit(self):
+        # Arrange
+        limiter = AttemptLimiter(policies={'token_verify': (3, 60, 300)})
+        start = threading.Barrier(20)
+        allowed = []
+
+        def guess():
+            start.wait()
+            try:
+                limiter.hit('token_verify', 'alice')
+            except RateLimited:
+                return
+            allowed.append(True)
+
+        threads = [threading.Thread(target=guess) for _ in range(20)]
+
+        # Act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Assert
+        self.assertEqual(len(allowed), 3)
+        self.assertEqual(limiter.stats(), {'allowed_total': 3, 'rejected_total': 17})
+
+
+class TokenCheckLimitsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(TokenCheckLimitsTestCase, self).setUp()
+        db.session.add(User('test', 'test@example.com', 'test', '42'))
+        db.session.commit()
+        self.client.post('/login', data={'username': 'test', 'password': 'test'})
+        self.app.extensions['attempt_limiter'].policies.update({
+            'token_verify': (2, 60, 600),
+            'phone_verify': (2, 60, 600),
+        })
+
+    @patch('twofa.forms.authy_api')
+    def test_malformed_tokens_never_reach_authy(self, authy_api):
+        # Act
+        responses = [
+            self.client.post('/2fa', data={'token': token})
+            for token in ('12ab56', '123', '12345678901')
+        ]
+
+        # Assert
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        self.assertIn('Invalid Token', responses[0].get_data(as_text=True))
+        authy_api.tokens.verify.assert_not_called()
+
+    @patch('twofa.forms.authy_api')
+    def test_spaces_are_stripped_before_verifying(self, authy_api):
+        # Act
+        self.client.post('/2fa', data={'token': '123 456'})
+
+        # Assert
+        authy_api.tokens.verify.assert_called_once_with('42', '123456')
+
+    @patch('twofa.forms.authy_api')
+    def test_repeated_wrong_tokens_lock_the_user_out(self, authy_api):
+        # Arrange
+        authy_api.tokens.verify.return_value = MagicMock(ok=lambda: False)
+        self.client.post('/2fa', data={'token': '111111'})
+        self.client.post('/2fa', data={'token': '222222'})
+
+        # Act
+        response = self.client.post('/2fa', data={'token': '333333'})
+
+        # Assert
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '600')
+        self.assertEqual(authy_api.tokens.verify.call_count, 2)
+
+    @patch('twofa.views.authy_api')
+    def test_repeated_wrong_codes_lock_the_phone_out(self, authy_api):
+        # Arrange
+        authy_api.phones.verification_check.return_value = MagicMock(
+            ok=lambda: False, errors=lambda: {'message': 'Wrong code'}
+        )
+        with self.client.session_transaction() as sess:
+            sess['phone_number'] = '2015550123'
+            sess['country_code'] = '+1'
+        self.client.post('/verification/token', data={'token': '1111'})
+        self.client.post('/verification/token', data={'token': '2222'})
+
+        # Act
+        response = self.client.post('/verification/token', data={'token': '3333'})
+
+        # Assert
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(authy_api.phones.verification_check.call_count, 2)
+
+
+class RateLimiterExtensionTestCase(BaseTestCase):
+
+    def test_attempt_limits_stay_on_when_rate_limiting_is_off(self):
+        # Arrange
+        self.app.config['RATE_LIMIT_ENABLED'] = False
+
+        # Act
+        rate_limiter.init_app(self.app)
+
+        # Assert
+        self.assertEqual(self.app.extensions['rate_limiter'].per_user, {})
+        self.assertIn('token_verify', self.app.extensions['attempt_limiter'].policies)
+
+    def test_attempt_limits_have_their_own_switch(self):
+        # Arrange
+        self.app.config['TOKEN_ATTEMPT_LIMITS_ENABLED'] = False
+
+        # Act
+        rate_limiter.init_app(self.app)
+
+        # Assert
+        self.assertEqual(self.app.extensions['attempt_limiter'].policies, {})
+        self.assertIn('sms', self.app.extensions['rate_limiter'].per_user)
+
+
+class TokenRequestLimitsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(TokenRequestLimitsTestCase, self).setUp()
+        db.session.add(User('test', 'test@example.com', 'test', '42'))
+        db.session.commit()
+        self.client.post('/login', data={'username': 'test', 'password': 'test'})
+
+    @patch('twofa.views.authy_api')
+    def test_sms_requests_over_the_limit_get_429(self, authy_api):
+        # Arrange
+        self.app.extensions['rate_limiter'].per_user['sms'] = (1, 60)
+
+        # Act
+        first = self.client.post('/token/sms')
+        second = self.client.post('/token/sms')
+
+        # Assert
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+        self.assertEqual(second.headers['Retry-After'], '60')
+        authy_api.users.request_sms.assert_called_once()
+
+    @patch('twofa.views.authy_api')
+    def test_repeat_onetouch_reuses_pending_request(self, authy_api):
+        # Arrange
+        authy_api.one_touch.send_request.return_value = MagicMock(
+            **{'get_uuid.return_value': 'first-uuid'}
+        )
+
+        # Act
+        self.client.post('/token/onetouch')
+        response = self.client.post('/token/onetouch')
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        authy_api.one_touch.send_request.assert_called_once()
+        with self.client.session_transaction() as sess:
+            self.assertEqual(sess['onetouch_uuid'], 'first-uuid')
+
+    @patch('twofa.views.authy_api')
+    def test_answered_onetouch_is_not_reused(self, authy_api):
+        # Arrange
+        authy_api.one_touch.send_request.side_effect = [
+            MagicMock(**{'get_uuid.return_value': 'first-uuid'}),
+            MagicMock(**{'get_uuid.return_value': 'second-uuid'}),
+        ]
+        self.client.post('/token/onetouch')
+        self.app.extensions['onetouch'].publish('first-uuid', 'denied')
+
+        # Act
+        self.client.post('/token/onetouch')
+
+        # Assert
+        self.assertEqual(authy_api.one_touch.send_request.call_count, 2)
+        with self.client.session_transaction() as sess:
+            self.assertEqual(sess['onetouch_uuid'], 'second-uuid')
+
+    @patch('twofa.views.authy_api')
+    def test_onetouch_is_not_shared_between_sessions(self, authy_api):
+        # Arrange
+        authy_api.one_touch.send_request.side_effect = [
+            MagicMock(**{'get_uuid.return_value': 'victim-uuid'}),
+            MagicMock(**{'get_uuid.return_value': 'attacker-uuid'}),
+        ]
+        attacker = self.app.test_client()
+        attacker.post('/login', data={'username': 'test', 'password': 'test'})
+        self.client.post('/token/onetouch')
+
+        # Act
+        attacker.post('/token/onetouch')
+        self.app.extensions['onetouch'].publish('victim-uuid', 'approved')
+        status = attacker.post('/onetouch-status')
+
+        # Assert
+        self.assertEqual(authy_api.one_touch.send_request.call_count, 2)
+        self.assertEqual(status.get_data(as_text=True), 'pending')
+        with attacker.session_transaction() as sess:
+            self.assertEqual(sess['onetouch_uuid'], 'attacker-uuid')
+            self.assertFalse(sess.get('authy'))
@@ -0,0 +1,120 @@
+from unittest.mock import patch
+
+from tests.base import BaseTestCase
+from twofa.database import db
+from twofa.models import User
+from twofa.sessions import MemorySessionStore, server_side_sessions
+
+
+class CountingStore(MemorySessionStore):
+
+    def __init__(self):
+        super(CountingStore, self).__init__()
+        self.writes = 0
+
+    def set(self, sid, data):
+        self.writes += 1
+        super(CountingStore, self).set(sid, data)
+
+
+class ServerSideSessionTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ServerSideSessionTestCase, self).setUp()
+        self.app.config['SESSION_BACKEND'] = 'memory'
+        server_side_sessions.init_app(self.app)
+        self.store = self.app.session_interface.store = CountingStore()
+        db.session.add(User('test', 'test@example.com', 'test', '42'))
+        db.session.commit()
+
+    def _session_cookie(self, response):
+        cookies = response.headers.getlist('Set-Cookie')
+        return [c for c in cookies if c.startswith('session=')]
+
+    def _sid(self):
+        return next(c.value for c in self.client.cookie_jar if c.name == 'session')
+
+    def _login(self):
+        return self.client.post('/login', data={'username': 'test', 'password': 'test'})
+
+    def test_cookie_holds_only_the_session_id(self):
+        # Act
+        response = self._login()
+
+        # Assert
+        cookie = self._session_cookie(response)[0]
+        sid = cookie.split(';')[0][len('session='):]
+        self.assertEqual(len(sid), 22)
+        self.assertIn('"_user_id":"test"', self.store.get(sid))
+
+    def test_unchanged_sessions_are_not_saved(self):
+        # Arrange
+        self._login()
+        with self.client.session_transaction() as sess:
+            sess['authy'] = True
+        self.client.get('/protected')  # stores the page's CSRF token
+        writes = self.store.writes
+
+        # Act
+        response = self.client.get('/protected')
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.store.writes, writes)
+        self.assertEqual(self._session_cookie(response), [])
+
+    def test_pages_that_only_read_the_session_vary_on_cookie(self):
+        # Arrange
+        self._login()
+        with self.client.session_transaction() as sess:
+            sess['authy'] = True
+        self.client.get('/protected')
+
+        # Act
+        response = self.client.get('/protected')
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Cookie', response.vary)
+
+    @patch('twofa.views.authy_api')
+    def test_changes_are_stored_without_resending_the_cookie(self, authy_api):
+        # Arrange
+        authy_api.one_touch.send_request.return_value.get_uuid.return_value = 'uuid'
+        self._login()
+
+        # Act
+        response = self.client.post('/token/onetouch')
+
+        # Assert
+        self.assertEqual(self._session_cookie(response), [])
+        with self.client.session_transaction() as sess:
+            self.assertEqual(sess['onetouch_uuid'], 'uuid')
+
+    def test_login_issues_a_new_session_id(self):
+        # Arrange
+        with self.client.session_transaction() as sess:
+            sess['planted'] = True
+        planted = self._sid()
+
+        # Act
+        self._login()
+
+        # Assert
+        sid = self._sid()
+        self.assertNotEqual(sid, planted)
+        self.assertIsNone(self.store.get(planted))
+
+    def test_store_evicts_least_recently_used(self):
+        # Arrange
+        store = MemorySessionStore(maxsize=2)
+        store.set('a', '{}')
+        store.set('b', '{}')
+        store.get('a')
+
+        # Act
+        store.set('c', '{}')
+
+        # Assert
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('a'), '{}')
@@ -0,0 +1,145 @@
+import base64
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from tests.base import BaseTestCase
+from twofa.database import db
+from twofa.models import User
+from twofa.totp import SecretBox, TOTPVerifier, generate_secret, local_totp, totp
+
+# The SHA1 seed from RFC 6238, appendix B.
+RFC_SECRET = base64.b32encode(b'12345678901234567890').decode('ascii')
+
+
+class TOTPTestCase(TestCase):
+
+    def setUp(self):
+        self.now = 59
+        self.verifier = TOTPVerifier(clock=lambda: self.now)
+
+    def test_matches_rfc_6238_vectors(self):
+        # Act / Assert
+        self.assertEqual(totp(RFC_SECRET, 59 // 30, 8), '94287082')
+        self.assertEqual(totp(RFC_SECRET, 1111111109 // 30, 8), '07081804')
+        self.assertEqual(totp(RFC_SECRET, 20000000000 // 30, 8), '65353130')
+
+    def test_accepts_codes_within_the_window(self):
+        # Arrange
+        previous = totp(RFC_SECRET, 0)
+
+        # Act / Assert
+        self.assertEqual(self.verifier.verify('alice', RFC_SECRET, previous), 'accepted')
+        self.assertIsNone(self.verifier.verify('alice', RFC_SECRET, totp(RFC_SECRET, 5)))
+
+    def test_a_code_is_accepted_only_once(self):
+        # Arrange
+        code = totp(RFC_SECRET, 1)
+
+        # Act
+        first = self.verifier.verify('alice', RFC_SECRET, code)
+        second = self.verifier.verify('alice', RFC_SECRET, code)
+
+        # Assert
+        self.assertEqual((first, second), ('accepted', 'replayed'))
+
+    def test_authy_length_codes_are_not_checked_locally(self):
+        # Act / Assert
+        self.assertIsNone(self.verifier.verify('alice', RFC_SECRET, '1234567'))
+
+    def test_secret_box_rotates_keys(self):
+        # Arrange
+        old_key = base64.urlsafe_b64encode(b'o' * 32)
+        new_key = base64.urlsafe_b64encode(b'n' * 32)
+        token = SecretBox([old_key]).encrypt('SECRET')
+
+        # Act
+        secret = SecretBox([new_key, old_key]).decrypt(token)
+
+        # Assert
+        self.assertEqual(secret, 'SECRET')
+        self.assertNotIn('SECRET', token)
+
+
+class LocalTOTPViewsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(LocalTOTPViewsTestCase, self).setUp()
+        self.app.config['TOTP_ENABLED'] = True
+        local_totp.init_app(self.app)
+        self.state = self.app.extensions['totp']
+        self.secret = generate_secret()
+        user = User('test', 'test@example.com', 'test', '42')
+        user.totp_secret = self.state.box.encrypt(self.secret)
+        db.session.add(user)
+        db.session.commit()
+        self.client.post('/login', data={'username': 'test', 'password': 'test'})
+
+    def _code(self, secret=None):
+        return totp(secret or self.secret, int(time.time() // 30))
+
+    @patch('twofa.forms.authy_api')
+    def test_authenticator_codes_skip_authy(self, authy_api):
+        # Act
+        response = self.client.post('/2fa', data={'token': self._code()})
+
+        # Assert
+        self.assertTrue(response.location.endswith('/protected'))
+        authy_api.tokens.verify.assert_not_called()
+
+    @patch('twofa.forms.authy_api')
+    def test_replayed_code_is_rejected_without_authy(self, authy_api):
+        # Arrange
+        code = self._code()
+        self.client.post('/2fa', data={'token': code})
+
+        # Act
+        response = self.client.post('/2fa', data={'token': code})
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Token already used', response.get_data(as_text=True))
+        authy_api.tokens.verify.assert_not_called()
+
+    @patch('twofa.forms.authy_api')
+    def test_sms_codes_fall_back_to_authy(self, authy_api):
+        # Act
+        response = self.client.post('/2fa', data={'token': '1234567'})
+
+        # Assert
+        authy_api.tokens.verify.assert_called_once_with('42', '1234567')
+        self.assertTrue(response.location.endswith('/protected'))
+
+    def test_enrollment_stores_the_encrypted_secret(self):
+        # Arrange
+        User.query.get('test').totp_secret = None
+        db.session.commit()
+        with self.client.session_transaction() as sess:
+            sess['authy'] = True
+        self.client.get('/2fa/totp')
+        with self.client.session_transaction() as sess:
+            secret = self.state.box.decrypt(sess['totp_pending'])
+
+        # Act
+        response = self.client.post('/2fa/totp', data={'token': self._code(secret)})
+
+        # Assert
+        self.assertTrue(response.location.endswith('/protected'))
+        stored = User.query.get('test').totp_secret
+        self.assertEqual(self.state.box.decrypt(stored), secret)
+
+    def test_enrollment_rejects_a_wrong_code(self):
+        # Arrange
+        User.query.get('test').totp_secret = None
+        db.session.commit()
+        with self.client.session_transaction() as sess:
+            sess['authy'] = True
+        self.client.get('/2fa/totp')
+
+        # Act
+        response = self.client.post('/2fa/totp', data={'token': '000000x'})
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Invalid Token', response.get_data(as_text=True))
+        self.assertIsNone(User.query.get('test').totp_secret)
@@ -2,9 +2,13 @@
 from unittest.mock import patch, MagicMock
 from urllib.parse import urlparse
 
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
 from tests.base import BaseTestCase
+from twofa import create_app
 from twofa.database import db
-from twofa.models import User
+from twofa.models import User, password_hasher, user_cache
 
 
 class TwoFATestCase(BaseTestCase):
@@ -27,6 +31,24 @@ class TwoFATestCase(BaseTestCase):
         }, follow_redirects=False)
         self.assertEqual(response.status_code, 302)
 
+    def test_login_and_logout_do_not_write_to_the_database(self):
+        # Arrange
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+
+        # Act
+        self._login()
+        self.client.get('/logout')
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+        # Assert
+        self.assertTrue(statements)
+        self.assertTrue(all(s.lstrip().upper().startswith('SELECT') for s in statements))
+
     def test_protected_redirect_anonymous_to_login(self):
         # Arrange
 
@@ -139,3 +161,226 @@ class TwoFATestCase(BaseTestCase):
             {'force': True}
         )
         request_call_response.ok.assert_called_once()
+
+    @patch('twofa.views.authy_api')
+    def test_onetouch_callback_wakes_long_poll(self, authy_api):
+        # Arrange
+        authy_api.one_touch.validate_one_touch_signature.return_value = True
+        self._login()
+        with self.client.session_transaction() as sess:
+            sess['onetouch_uuid'] = 'callback-uuid'
+
+        # Act
+        callback = self.client.post('/onetouch/callback', json={
+            'uuid': 'callback-uuid',
+            'status': 'approved',
+        })
+        response = self.client.post('/onetouch-status/wait', data={'status': 'pending'})
+
+        # Assert
+        self.assertEqual(callback.status_code, 200)
+        self.assertEqual(response.get_data(as_text=True), 'approved')
+        authy_api.one_touch.get_approval_status.assert_not_called()
+        with self.client.session_transaction() as sess:
+            self.assertTrue(sess['authy'])
+
+    @patch('twofa.views.authy_api')
+    def test_onetouch_callback_rejects_bad_signature(self, authy_api):
+        # Arrange
+        authy_api.one_touch.validate_one_touch_signature.return_value = False
+
+        # Act
+        response = self.client.post('/onetouch/callback', json={
+            'uuid': 'forged-uuid',
+            'status': 'approved',
+        })
+
+        # Assert
+        self.assertEqual(response.status_code, 400)
+
+    @patch('twofa.views.authy_api')
+    def test_onetouch_long_poll_falls_back_to_authy(self, authy_api):
+        # Arrange
+        approval_status = MagicMock()
+        approval_status.ok.return_value = True
+        approval_status.__getitem__.return_value = {'status': 'denied'}
+        authy_api.one_touch.get_approval_status.return_value = approval_status
+        self._login()
+        with self.client.session_transaction() as sess:
+            sess['onetouch_uuid'] = 'silent-uuid'
+
+        # Act
+        response = self.client.post('/onetouch-status/wait', data={'status': 'pending'})
+
+        # Assert
+        self.assertEqual(response.get_data(as_text=True), 'denied')
+        authy_api.one_touch.get_approval_status.assert_called_once_with('silent-uuid')
+
+    @patch('twofa.views.authy_api')
+    def test_onetouch_long_poll_waits_for_the_callback_when_configured(self, authy_api):
+        # Arrange
+        self.app.config['ONETOUCH_CALLBACK_URL'] = 'https://server.test/onetouch/callback'
+        approvals = self.app.extensions['onetouch']
+        approvals.fetch_interval = approvals.pending_ttl = 0.01
+        approval_status = MagicMock()
+        approval_status.ok.return_value = True
+        approval_status.__getitem__.return_value = {'status': 'pending'}
+        authy_api.one_touch.get_approval_status.return_value = approval_status
+        self._login()
+        with self.client.session_transaction() as sess:
+            sess['onetouch_uuid'] = 'pushed-uuid'
+
+        # Act
+        response = self.client.post('/onetouch-status/wait', data={'status': 'pending'})
+
+        # Assert
+        self.assertEqual(response.get_data(as_text=True), 'pending')
+        authy_api.one_touch.get_approval_status.assert_called_once_with('pushed-uuid')
+
+
+class UserCacheTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        user_cache.maxsize = 16
+        user_cache.clear()
+        db.session.add(User(
+            username='cached',
+            password='cached',
+            email='cached@example.com',
+            authy_id='fake_id'
+        ))
+        db.session.commit()
+        self.queries = []
+        event.listen(db.engine, 'before_cursor_execute', self._count_query)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self._count_query)
+        user_cache.maxsize = 0
+        user_cache.clear()
+        super().tearDown()
+
+    def _count_query(self, conn, cursor, statement, *args):
+        self.queries.append(statement)
+
+    def test_authenticated_requests_reuse_cached_user(self):
+        # Arrange
+        self.client.post('/login', data={'username': 'cached', 'password': 'cached'})
+        with self.client.session_transaction() as sess:
+            sess['authy'] = True
+        self.client.get('/protected')
+        del self.queries[:]
+
+        # Act
+        response = self.client.get('/protected')
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.queries, [])
+        self.assertGreater(user_cache.stats()['hits'], 0)
+
+    def test_set_password_invalidates_cached_user(self):
+        # Arrange
+        user = User.get_cached('cached')
+        db.session.expunge_all()
+
+        # Act
+        user.set_password('changed')
+
+        # Assert
+        self.assertEqual(user_cache.stats()['size'], 0)
+
+
+class UserLookupTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        db.session.add(User('alice', ' Alice@Example.COM', 'secret', '1234'))
+        db.session.add(User('bob', 'bob@example.com', 'secret', '5678'))
+        db.session.commit()
+
+    def test_find_by_authy_id(self):
+        # Act
+        user = User.find_by_authy_id(1234)
+
+        # Assert
+        self.assertEqual(user.username, 'alice')
+        self.assertIsNone(User.find_by_authy_id('0'))
+
+    def test_find_by_email_ignores_case(self):
+        # Act
+        user = User.find_by_email('ALICE@example.com ')
+
+        # Assert
+        self.assertEqual(user.username, 'alice')
+
+    def test_changing_email_updates_the_normalized_copy(self):
+        # Arrange
+        user = User.query.get('bob')
+
+        # Act
+        user.email = 'Robert@Example.com'
+        db.session.commit()
+
+        # Assert
+        self.assertEqual(User.find_by_email('robert@example.com').username, 'bob')
+        self.assertIsNone(User.find_by_email('bob@example.com'))
+
+    def test_lookups_use_an_index(self):
+        # Arrange
+        statement = 'EXPLAIN QUERY PLAN SELECT * FROM users WHERE {} = :value'
+
+        # Act
+        plans = [
+            db.session.execute(statement.format(column), {'value': 'x'}).fetchall()
+            for column in ('authy_id', 'email_normalized')
+        ]
+
+        # Assert
+        for column, plan in zip(('authy_id', 'email_normalized'), plans):
+            self.assertIn('ix_users_{}'.format(column), str(plan))
+
+
+class PasswordHasherTestCase(BaseTestCase):
+
+    def test_login_upgrades_outdated_password_hash(self):
+        # Arrange
+        user = User(username='legacy', password='legacy', email='legacy@example.com')
+        user.pw_hash = generate_password_hash('legacy', 'pbkdf2:sha256:500', 8)
+        db.session.add(user)
+        db.session.commit()
+
+        # Act
+        response = self.client.post('/login', data={
+            'username': 'legacy',
+            'password': 'legacy'
+        })
+
+        # Assert
+        self.assertEqual(response.status_code, 302)
+        db.session.expire_all()
+        user = User.query.get('legacy')
+        self.assertFalse(password_hasher.needs_rehash(user.pw_hash))
+        self.assertTrue(user.check_password('legacy'))
+
+    def test_current_hashes_do_not_need_rehash(self):
+        # Act
+        user = User(username='fresh', password='fresh')
+
+        # Assert
+        self.assertTrue(user.pw_hash.startswith(password_hasher.method + '$'))
+        self.assertFalse(password_hasher.needs_rehash(user.pw_hash))
+
+    def test_each_app_keeps_its_own_hasher(self):
+        # Arrange
+        hasher = self.app.extensions['password_hasher']
+        hasher.executor = MagicMock()
+
+        # Act
+        other = create_app('development')
+
+        # Assert
+        self.assertIs(password_hasher._get_current_object(), hasher)
+        self.assertEqual(hasher.method, 'pbkdf2:sha256:1000')
+        self.assertIsNot(other.extensions['password_hasher'], hasher)
+        hasher.executor.shutdown.assert_not_called()
@@ -1,3 +1,5 @@
+import os
+
 from flask import Flask
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
@@ -5,27 +7,63 @@ from flask_wtf.csrf import CSRFProtect
 from .config import config_classes
 from .database import db, migrate
 
-app = Flask(__name__)
+csrf = CSRFProtect()
+login_manager = LoginManager()
 
-# load the instance config
-environment = app.config.get('ENV', 'production')
-app.config.from_object(config_classes[environment])
 
-db.init_app(app)
-migrate.init_app(app, db)
+def create_app(config_name=None):
+    """Build a configured app; ``config_name`` defaults to ``FLASK_ENV``.
 
-csrf = CSRFProtect(app)
+    Extensions, models and views (and through them authy, requests and
+    phonenumbers) are imported here rather than at package import, so
+    ``import twofa`` stays cheap and each call returns an isolated app.
+    """
+    app = Flask(__name__)
 
-# from .database import init_db  # noqa: F401, E402
-# from .models import User  # noqa: E402
+    # load the instance config
+    if config_name is None:
+        config_name = os.environ.get('FLASK_ENV', 'production')
+    app.config.from_object(config_classes[config_name])
 
-login_manager = LoginManager()
-login_manager.init_app(app)
+    db.init_app(app)
+    migrate.init_app(app, db)
+    csrf.init_app(app)
+    login_manager.init_app(app)
 
-import twofa.models  # noqa: F401, E402
+    from .assets import assets
+    from .authy_client import authy
+    from .bulk import users_cli
+    from .instrumentation import query_instrumentation
+    from .jobs import jobs
+    from .metrics import metrics
+    from .models import User, password_hashing, user_caching
+    from .onetouch import onetouch
+    from .phones import phone_validation
+    from .profiling import request_profiling
+    from .ratelimit import rate_limiter
+    from .sessions import server_side_sessions
+    from .templating import template_precompiler
+    from .totp import local_totp
 
-from .models import User  # noqa: E402
-login_manager.user_loader(User.load_user)
+    query_instrumentation.init_app(app)
+    metrics.init_app(app)
+    request_profiling.init_app(app)
+    assets.init_app(app)
+    authy.init_app(app)
+    onetouch.init_app(app)
+    rate_limiter.init_app(app)
+    jobs.init_app(app)
+    local_totp.init_app(app)
+    server_side_sessions.init_app(app)
+    phone_validation.init_app(app)
+    password_hashing.init_app(app)
+    user_caching.init_app(app)
+    login_manager.user_loader(User.load_user)
+    app.cli.add_command(users_cli)
 
+    from . import tasks  # noqa: F401 (registers the background jobs)
+    from .views import bp
 
-from . import views  # noqa: F401, E402
+    app.register_blueprint(bp)
+    template_precompiler.init_app(app)
+    return app
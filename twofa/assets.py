@@ -0,0 +1,200 @@
+import base64
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+import re
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import AppGroup
+
+# Third-party files served from static/vendor once ``flask assets vendor``
+# has fetched them, and from their CDN until then.
+VENDOR_ASSETS = {
+    'vendor/bootstrap.min.css': (
+        'https://maxcdn.bootstrapcdn.com/bootstrap/3.3.7/css/bootstrap.min.css',
+        'sha384-BVYiiSIFeK1dGmJRAkycuHAHRg32OmUcww7on3RYdg4Va+PmSTsz/K68vbdEjh4u',
+    ),
+    'vendor/bootstrap-theme.min.css': (
+        'https://maxcdn.bootstrapcdn.com/bootstrap/3.3.7/css/bootstrap-theme.min.css',
+        'sha384-rHyoN1iRsVXV4nD0JutlnGaslCJuC7uwjduW9SVrLvRYooPp2bWYgmgJQIXwl/Sp',
+    ),
+    'vendor/bootstrap.min.js': (
+        'https://maxcdn.bootstrapcdn.com/bootstrap/3.3.7/js/bootstrap.min.js',
+        'sha384-Tc5IQib027qvyjSMfHjOMaLkfuWVxZxUPnCJA7l2mCWNIpG9mGCD8wGNIcPD7Txa',
+    ),
+    'vendor/jquery.min.js': (
+        'https://cdnjs.cloudflare.com/ajax/libs/jquery/3.2.1/jquery.min.js',
+        None,
+    ),
+}
+
+# Precompressed variants, best first, as (Accept-Encoding token, suffix).
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.map')
+
+_FINGERPRINTED = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+
+
+class AssetManifest(object):
+    """Content hashes of the files under the static folder.
+
+    ``url_for('js/2fa.js')`` becomes ``/static/js/2fa.<hash>.js``: the URL
+    changes whenever the file does, so responses can be cached for a year.
+    """
+
+    def __init__(self, static_folder, static_url_path='/static'):
+        self.static_folder = static_folder
+        self.static_url_path = static_url_path
+        self.digests = {}
+        if static_folder and os.path.isdir(static_folder):
+            self._scan()
+
+    def _scan(self):
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                if name.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                    continue
+                path = os.path.join(root, name)
+                logical = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    self.digests[logical] = hashlib.sha256(f.read()).hexdigest()[:12]
+
+    def url_for(self, filename):
+        digest = self.digests.get(filename)
+        if digest is None:
+            if filename in VENDOR_ASSETS:
+                return VENDOR_ASSETS[filename][0]
+            return '{}/{}'.format(self.static_url_path, filename)
+        stem, ext = os.path.splitext(filename)
+        return '{}/{}.{}{}'.format(self.static_url_path, stem, digest, ext)
+
+    def resolve(self, filename):
+        """Map a requested name to (file on disk, whether the hash is current)."""
+        match = _FINGERPRINTED.match(filename)
+        if match is None:
+            return filename, False
+        logical = match.group('stem') + match.group('ext')
+        return logical, self.digests.get(logical) == match.group('digest')
+
+
+def integrity_for(filename):
+    return VENDOR_ASSETS.get(filename, (None, None))[1] or ''
+
+
+class Assets(object):
+    """Serves fingerprinted static files with long-lived cache headers.
+
+    Replaces Flask's static view: a ``.br`` or ``.gz`` file next to the
+    requested one is sent as is when the client accepts that encoding, so
+    nothing is compressed per request. ``asset_url()`` in templates builds
+    fingerprinted URLs. Files are hashed once at startup, so fingerprinting
+    is off in development, where edits should show up without a restart.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        fingerprint = app.config.get('ASSETS_FINGERPRINT', True)
+        app.extensions['assets'] = AssetManifest(
+            app.static_folder if fingerprint else None, app.static_url_path
+        )
+        app.view_functions['static'] = self.send_static_file
+        app.jinja_env.globals.update(
+            asset_url=lambda filename: current_app.extensions['assets'].url_for(filename),
+            asset_integrity=integrity_for,
+        )
+        app.cli.add_command(assets_cli)
+
+    @staticmethod
+    def send_static_file(filename):
+        app = current_app
+        logical, immutable = app.extensions['assets'].resolve(filename)
+        mimetype = mimetypes.guess_type(logical)[0] or 'application/octet-stream'
+        response = None
+        for encoding, suffix in ENCODINGS:
+            path = os.path.join(app.static_folder, logical + suffix)
+            if encoding in request.accept_encodings and os.path.isfile(path):
+                response = send_from_directory(
+                    app.static_folder, logical + suffix, mimetype=mimetype
+                )
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(app.static_folder, logical, mimetype=mimetype)
+        if logical.endswith(COMPRESSIBLE):
+            response.vary.add('Accept-Encoding')
+        if immutable:
+            max_age = app.config.get('ASSETS_MAX_AGE', 31536000)
+            response.headers['Cache-Control'] = (
+                'public, max-age={}, immutable'.format(max_age)
+            )
+        return response
+
+
+assets_cli = AppGroup('assets', help='Manage static assets.')
+
+
+@assets_cli.command('vendor')
+def vendor_assets():
+    """Download the CDN libraries into static/vendor and check their hashes."""
+    import requests
+
+    for filename, (url, integrity) in sorted(VENDOR_ASSETS.items()):
+        content = requests.get(url, timeout=30).content
+        if integrity:
+            algorithm, expected = integrity.split('-', 1)
+            digest = base64.b64encode(hashlib.new(algorithm, content).digest())
+            if digest.decode('ascii') != expected:
+                raise click.ClickException('{} failed its integrity check'.format(url))
+        path = os.path.join(current_app.static_folder, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        click.echo('{} ({} bytes)'.format(filename, len(content)))
+
+
+@assets_cli.command('compress')
+def compress_assets():
+    """Write .gz (and, with the brotli package, .br) next to text assets."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        click.echo('brotli is not installed; writing gzip variants only')
+
+    for filename in sorted(current_app.extensions['assets'].digests or _walk_static()):
+        if not filename.endswith(COMPRESSIBLE):
+            continue
+        path = os.path.join(current_app.static_folder, filename)
+        with open(path, 'rb') as f:
+            content = f.read()
+        variants = [('.gz', _gzip(content))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content)))
+        for suffix, compressed in variants:
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+        click.echo('{}: {} -> {}'.format(
+            filename, len(content), ', '.join(str(len(c)) for _, c in variants)
+        ))
+
+
+def _gzip(content):
+    # A fixed mtime keeps the output reproducible; gzip.compress only takes
+    # one from Python 3.8.
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+def _walk_static():
+    return AssetManifest(current_app.static_folder).digests
+
+
+assets = Assets()
@@ -0,0 +1,343 @@
+import json
+import re
+import threading
+import time
+from functools import partial
+
+import requests
+from authy import AuthyException
+from authy.api import AuthyApiClient
+from authy.api.resources import Apps, OneTouch, Phones, StatsResource, Tokens, Users
+from flask import current_app, g, has_request_context
+from requests.adapters import HTTPAdapter
+from werkzeug.local import LocalProxy
+
+from .circuit import Bulkhead, CircuitBreaker
+
+
+class AuthyUnavailable(AuthyException):
+    """Raised when the Authy API could not be reached in time.
+
+    ``retry_after`` is set, in seconds, when the call was refused because
+    the operation's circuit is open.
+    """
+
+    def __init__(self, operation, reason, retry_after=None):
+        super(AuthyUnavailable, self).__init__(
+            '{} failed: {}'.format(operation, reason)
+        )
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+OPERATIONS = [
+    ('POST', re.compile(r'^/protected/json/users/new$'), 'users.create'),
+    ('GET', re.compile(r'^/protected/json/sms/'), 'users.request_sms'),
+    ('GET', re.compile(r'^/protected/json/call/'), 'users.request_call'),
+    ('GET', re.compile(r'^/protected/json/users/[^/]+/status$'), 'users.status'),
+    ('POST', re.compile(r'^/protected/json/users/[^/]+/delete$'), 'users.delete'),
+    ('POST', re.compile(r'^/protected/json/users/[^/]+/secret$'), 'users.generate_qr'),
+    ('GET', re.compile(r'^/protected/json/registrations/'), 'users.registration_status'),
+    ('GET', re.compile(r'^/protected/json/verify/'), 'tokens.verify'),
+    ('GET', re.compile(r'^/protected/json/app/details$'), 'apps.fetch'),
+    ('GET', re.compile(r'^/protected/json/app/stats$'), 'stats.fetch'),
+    (
+        'POST',
+        re.compile(r'^/protected/json/phones/verification/start$'),
+        'phones.verification_start',
+    ),
+    (
+        'GET',
+        re.compile(r'^/protected/json/phones/verification/check$'),
+        'phones.verification_check',
+    ),
+    ('GET', re.compile(r'^/protected/json/phones/info$'), 'phones.info'),
+    (
+        'POST',
+        re.compile(r'^/onetouch/json/users/[^/]+/approval_requests$'),
+        'one_touch.send_request',
+    ),
+    (
+        'GET',
+        re.compile(r'^/onetouch/json/approval_requests/'),
+        'one_touch.get_approval_status',
+    ),
+]
+
+
+def operation_for(method, path):
+    """Map an Authy API request to the client method that issued it."""
+    for operation_method, pattern, operation in OPERATIONS:
+        if method == operation_method and pattern.match(path):
+            return operation
+    return 'unknown'
+
+
+def family_for(operation):
+    """Operations in one family (``users``, ``phones``...) share a circuit."""
+    return operation.partition('.')[0]
+
+
+class Transport(object):
+    """Sends Authy requests over one keep-alive session with timeouts.
+
+    Each operation family gets a circuit breaker, opened by timeouts,
+    connection failures and 5xx responses, and a bulkhead of at most
+    ``bulkhead_size`` concurrent calls. Calls refused by either fail at once
+    with ``AuthyUnavailable`` instead of tying up a worker.
+
+    ``observer``, if given, is called as ``observer(operation, outcome,
+    seconds)`` after every call, with an outcome of ``ok``, ``error`` (an
+    error response), ``unavailable`` (timeout or connection failure) or
+    ``rejected`` (refused by the circuit breaker or bulkhead).
+    """
+
+    def __init__(self, session, connect_timeout=3.05, read_timeout=10,
+                 operation_timeouts=None, observer=None, circuit_failures=5,
+                 circuit_reset_timeout=30, bulkhead_size=0):
+        self.session = session
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.operation_timeouts = operation_timeouts or {}
+        self.observer = observer
+        self.circuit_failures = circuit_failures
+        self.circuit_reset_timeout = circuit_reset_timeout
+        self.bulkhead_size = bulkhead_size
+        self.in_flight = self.rejected = 0
+        self._guards = {}
+        self._lock = threading.Lock()
+
+    def timeout_for(self, operation):
+        read_timeout = self.operation_timeouts.get(operation, self.read_timeout)
+        return (self.connect_timeout, read_timeout)
+
+    def guards_for(self, family):
+        guards = self._guards.get(family)
+        if guards is None:
+            with self._lock:
+                guards = self._guards.setdefault(family, (
+                    CircuitBreaker(self.circuit_failures, self.circuit_reset_timeout),
+                    Bulkhead(self.bulkhead_size),
+                ))
+        return guards
+
+    def send(self, method, url, path, headers, data):
+        operation = operation_for(method, path)
+        breaker, bulkhead = self.guards_for(family_for(operation))
+        if not bulkhead.acquire():
+            self._reject(operation, 'too many concurrent requests')
+        if not breaker.allow():
+            bulkhead.release()
+            self._reject(operation, 'circuit open', breaker.retry_after())
+
+        kwargs = {'headers': headers, 'timeout': self.timeout_for(operation)}
+        if method == 'GET':
+            kwargs['params'] = data
+        else:
+            kwargs['data'] = json.dumps(data)
+        with self._lock:
+            self.in_flight += 1
+        outcome = 'error'
+        response = None
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+            if response.ok:
+                outcome = 'ok'
+            elif response.status_code >= 500:
+                outcome = 'unavailable'
+            return response
+        except (requests.Timeout, requests.ConnectionError) as e:
+            outcome = 'unavailable'
+            raise AuthyUnavailable(operation, e)
+        finally:
+            bulkhead.release()
+            # Only a real response below 500 shows Authy is healthy; anything
+            # that raised counts against the circuit.
+            if outcome == 'unavailable' or response is None:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            with self._lock:
+                self.in_flight -= 1
+            if self.observer is not None:
+                self.observer(operation, outcome, time.perf_counter() - start)
+
+    def _reject(self, operation, reason, retry_after=None):
+        with self._lock:
+            self.rejected += 1
+        if self.observer is not None:
+            self.observer(operation, 'rejected', 0.0)
+        raise AuthyUnavailable(operation, reason, retry_after)
+
+    def metrics(self):
+        open_connections = idle_connections = 0
+        for adapter in set(self.session.adapters.values()):
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools[key]
+                open_connections += pool.num_connections
+                idle_connections += sum(
+                    1 for connection in list(pool.pool.queue) if connection is not None
+                )
+        return {
+            'in_flight': self.in_flight,
+            'connections_opened': open_connections,
+            'connections_idle': idle_connections,
+            'circuits_open': sum(
+                1 for breaker, _ in list(self._guards.values())
+                if breaker.state != CircuitBreaker.CLOSED
+            ),
+            'rejected_total': self.rejected,
+        }
+
+
+def build_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class PooledResource(object):
+    def __init__(self, api_uri, api_key, transport):
+        super(PooledResource, self).__init__(api_uri, api_key)
+        self.transport = transport
+
+    def request(self, method, path, data={}, headers={}):
+        headers = dict(self.def_headers, **headers)
+        headers['X-Authy-API-Key'] = self.api_key
+        return self.transport.send(method, self.api_uri + path, path, headers, data)
+
+
+class PooledUsers(PooledResource, Users):
+    pass
+
+
+class PooledTokens(PooledResource, Tokens):
+    pass
+
+
+class PooledApps(PooledResource, Apps):
+    pass
+
+
+class PooledStats(PooledResource, StatsResource):
+    pass
+
+
+class PooledPhones(PooledResource, Phones):
+    pass
+
+
+class PooledOneTouch(PooledResource, OneTouch):
+    pass
+
+
+class PooledAuthyApiClient(AuthyApiClient):
+    """An ``AuthyApiClient`` whose resources share one pooled transport."""
+
+    def __init__(self, api_key, api_uri='https://api.authy.com', transport=None):
+        super(PooledAuthyApiClient, self).__init__(api_key, api_uri)
+        self.transport = transport or Transport(build_session(10))
+        self.users = PooledUsers(api_uri, api_key, self.transport)
+        self.tokens = PooledTokens(api_uri, api_key, self.transport)
+        self.apps = PooledApps(api_uri, api_key, self.transport)
+        self.stats = PooledStats(api_uri, api_key, self.transport)
+        self.phones = PooledPhones(api_uri, api_key, self.transport)
+        self.one_touch = PooledOneTouch(api_uri, api_key, self.transport)
+
+    @classmethod
+    def from_config(cls, config, observer=None):
+        transport = Transport(
+            build_session(config.get('AUTHY_POOL_SIZE', 10)),
+            connect_timeout=config.get('AUTHY_CONNECT_TIMEOUT', 3.05),
+            read_timeout=config.get('AUTHY_READ_TIMEOUT', 10),
+            operation_timeouts=config.get('AUTHY_OPERATION_TIMEOUTS'),
+            observer=observer,
+            circuit_failures=config.get('AUTHY_CIRCUIT_FAILURES', 5),
+            circuit_reset_timeout=config.get('AUTHY_CIRCUIT_RESET_TIMEOUT', 30),
+            bulkhead_size=config.get('AUTHY_BULKHEAD_SIZE', 0),
+        )
+        return cls(
+            config.get('ACCOUNT_SECURITY_API_KEY'),
+            config.get('ACCOUNT_SECURITY_API_URI', 'https://api.authy.com'),
+            transport,
+        )
+
+
+class Authy(object):
+    """Flask extension owning the app's single pooled Authy client.
+
+    The client is built from the app config on first use, so every module
+    shares one connection pool and picks up config set after import.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['authy'] = _AuthyState(
+            app.config, partial(_observe, app.extensions.get('metrics'))
+        )
+        app.before_request(_reset_request_stats)
+
+    @staticmethod
+    def request_stats():
+        """(Authy calls, seconds waiting on Authy) for this request."""
+        return g.get('authy_calls', 0), g.get('authy_time', 0.0)
+
+    @property
+    def _state(self):
+        return current_app.extensions['authy']
+
+    @property
+    def client(self):
+        return self._state.get_client()
+
+    def metrics(self):
+        state = self._state
+        if state.client is None:
+            return {
+                'in_flight': 0,
+                'connections_opened': 0,
+                'connections_idle': 0,
+                'circuits_open': 0,
+                'rejected_total': 0,
+            }
+        return state.client.transport.metrics()
+
+
+def _reset_request_stats():
+    g.authy_calls = 0
+    g.authy_time = 0.0
+
+
+def _observe(registry, operation, outcome, elapsed):
+    if has_request_context():
+        g.authy_calls = g.get('authy_calls', 0) + 1
+        g.authy_time = g.get('authy_time', 0.0) + elapsed
+    if registry is not None:
+        registry.observe_authy(operation, outcome, elapsed)
+
+
+class _AuthyState(object):
+    def __init__(self, config, observer=None):
+        self.config = config
+        self.observer = observer
+        self.client = None
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        if self.client is None:
+            with self._lock:
+                if self.client is None:
+                    self.client = PooledAuthyApiClient.from_config(
+                        self.config, self.observer
+                    )
+        return self.client
+
+
+authy = Authy()
+authy_api = LocalProxy(lambda: authy.client)
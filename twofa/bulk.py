@@ -0,0 +1,283 @@
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+import click
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import select
+
+from .authy_client import AuthyUnavailable, authy
+from .database import db
+from .models import User, normalize_email, password_hasher
+from .phones import PhoneNumberValidator, phone_validator
+
+logger = logging.getLogger('twofa.bulk')
+
+EXPORT_FIELDS = ('username', 'email', 'authy_id')
+
+
+def read_records(stream, fmt):
+    """Yield one dict per user from a CSV (with a header row) or JSONL stream."""
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def guess_format(filename, fmt=None):
+    if fmt:
+        return fmt
+    return 'jsonl' if filename.endswith(('.jsonl', '.json', '.ndjson')) else 'csv'
+
+
+class Checkpoint(object):
+    """How many input records have been fully processed, kept in a file.
+
+    The file is replaced atomically after each committed batch, so a crash
+    leaves the position of the last batch that made it to the database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.position = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.position = json.load(f)['position']
+
+    def save(self, position):
+        self.position = position
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'position': position}, f)
+        os.replace(tmp, self.path)
+
+
+class ImportStats(object):
+    def __init__(self):
+        self.imported = self.skipped = self.rejected = 0
+        self.started = time.perf_counter()
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        total = self.imported + self.skipped + self.rejected
+        return '{} imported, {} skipped, {} rejected in {:.1f}s ({:.0f} users/s)'.format(
+            self.imported, self.skipped, self.rejected, elapsed,
+            total / elapsed if elapsed else 0,
+        )
+
+
+class UserImporter(object):
+    """Creates users from records in batches of ``batch_size``.
+
+    For each batch, usernames that already exist are skipped with one query
+    and the other records validated; the remaining records are enrolled with
+    Authy (unless they carry an ``authy_id``) and have their password
+    hashed (unless they carry a ``pw_hash``) on ``workers`` threads; then
+    the batch is written with one multi-row insert and one commit. Records
+    that fail are passed to ``on_reject`` with the reason instead of
+    stopping the import.
+
+    Authy returns the existing ID for a known email and phone, so records
+    enrolled again after resuming from a checkpoint keep their ID.
+    """
+
+    def __init__(self, client, workers=8, batch_size=500, retries=3, on_reject=None):
+        self.client = client
+        self.workers = workers
+        self.batch_size = batch_size
+        self.retries = retries
+        self.on_reject = on_reject or (lambda record, reason: None)
+        self.stats = ImportStats()
+
+    def run(self, records, checkpoint=None):
+        checkpoint = checkpoint or Checkpoint(None)
+        records = islice(records, checkpoint.position, None)
+        position = checkpoint.position
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='import') as pool:
+            while True:
+                batch = list(islice(records, self.batch_size))
+                if not batch:
+                    break
+                self._import_batch(batch, pool)
+                position += len(batch)
+                checkpoint.save(position)
+                logger.info('%d records processed: %s', position, self.stats.summary())
+        return self.stats
+
+    def _import_batch(self, batch, pool):
+        names = [record.get('username') for record in batch]
+        existing = {
+            username for username, in db.session.query(User.username)
+            .filter(User.username.in_([name for name in names if name]))
+        }
+        pending = {}
+        for record in batch:
+            if record.get('username') in existing:
+                self.stats.skipped += 1
+                continue
+            error = self._validate(record)
+            if error is None and record['username'] in pending:
+                error = 'Duplicate username in input'
+            if error is not None:
+                self._reject(record, error)
+            else:
+                pending[record['username']] = record
+
+        # Hash on the import's own threads: the request-sized hashing pool
+        # (PASSWORD_HASH_WORKERS) would refuse most of a batch.
+        prepare = partial(self._prepare, password_hasher.hash_in_thread)
+        rows = []
+        for record, row, error in pool.map(prepare, pending.values()):
+            if error is not None:
+                self._reject(record, error)
+            else:
+                rows.append(row)
+        if rows:
+            db.session.execute(User.__table__.insert(), rows)
+            db.session.commit()
+            self.stats.imported += len(rows)
+
+    @staticmethod
+    def _validate(record):
+        for field in ('username', 'email'):
+            if not record.get(field):
+                return 'Missing {}'.format(field)
+        if not record.get('password') and not record.get('pw_hash'):
+            return 'Missing password or pw_hash'
+        if record.get('authy_id'):
+            return None
+        if not record.get('country_code') or not record.get('phone_number'):
+            return 'Missing country_code or phone_number'
+        return phone_validator.validate(record['country_code'], record['phone_number'])
+
+    def _prepare(self, hash_password, record):
+        """Enroll and hash one record; return (record, row, error)."""
+        try:
+            authy_id = record.get('authy_id')
+            if not authy_id:
+                authy_id, error = self._enroll(record)
+                if error is not None:
+                    return record, None, error
+            return record, {
+                'username': record['username'],
+                'email': record['email'],
+                'email_normalized': normalize_email(record['email']),
+                'authy_id': str(authy_id),
+                'pw_hash': record.get('pw_hash') or hash_password(record['password']),
+            }, None
+        except Exception as e:
+            logger.exception('Could not import %s', record['username'])
+            return record, None, str(e) or type(e).__name__
+
+    def _enroll(self, record):
+        country_code, phone_number = PhoneNumberValidator.normalize(
+            record['country_code'], record['phone_number']
+        )
+        for attempt in range(1, self.retries + 1):
+            try:
+                authy_user = self.client.users.create(
+                    record['email'], phone_number, country_code
+                )
+            except AuthyUnavailable as e:
+                if attempt == self.retries:
+                    return None, str(e)
+                time.sleep(e.retry_after or attempt)
+                continue
+            if not authy_user.ok():
+                return None, ', '.join(
+                    '{}: {}'.format(k, v) for k, v in authy_user.errors().items()
+                )
+            return authy_user.id, None
+
+    def _reject(self, record, reason):
+        self.stats.rejected += 1
+        self.on_reject(record, reason)
+
+
+def export_records(batch_size=1000, with_password_hashes=False):
+    """Yield every user as a dict, streamed from the database in batches."""
+    columns = [User.__table__.c[name] for name in EXPORT_FIELDS]
+    if with_password_hashes:
+        columns.append(User.__table__.c.pw_hash)
+    query = select(columns).order_by(User.__table__.c.username)
+    result = db.session.execute(query.execution_options(stream_results=True))
+    keys = [column.name for column in columns]
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(keys, row))
+
+
+def write_records(stream, fmt, records, fields):
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fields)
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        for record in records:
+            stream.write(json.dumps(record) + '\n')
+
+
+users_cli = AppGroup('users', help='Bulk user import and export.')
+
+FORMATS = click.Choice(['csv', 'jsonl'])
+
+
+@users_cli.command('import')
+@click.argument('source', type=click.File('r'))
+@click.option('--format', 'fmt', type=FORMATS, help='Defaults to the file extension.')
+@click.option('--workers', default=8, show_default=True,
+              help='Concurrent Authy enrollments and password hashes.')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Users per insert and commit.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='Progress file; a re-run resumes after the last committed batch.')
+@click.option('--rejects', type=click.File('w'),
+              help='JSONL file for records that could not be imported.')
+@with_appcontext
+def import_users(source, fmt, workers, batch_size, checkpoint, rejects):
+    """Create users from a CSV or JSONL file.
+
+    Each record needs username, email and either password or pw_hash (a
+    werkzeug hash, e.g. from `flask users export --with-password-hashes`),
+    plus authy_id or country_code and phone_number to enroll with Authy.
+    """
+    def on_reject(record, reason):
+        if rejects is not None:
+            rejects.write(json.dumps(dict(record, error=reason)) + '\n')
+
+    importer = UserImporter(authy.client, workers, batch_size, on_reject=on_reject)
+    state = Checkpoint(checkpoint)
+    if state.position:
+        click.echo('Resuming after {} records'.format(state.position))
+    records = read_records(source, guess_format(source.name, fmt))
+    click.echo(importer.run(records, state).summary())
+
+
+@users_cli.command('export')
+@click.argument('destination', type=click.File('w'))
+@click.option('--format', 'fmt', type=FORMATS, help='Defaults to the file extension.')
+@click.option('--with-password-hashes', is_flag=True,
+              help='Include pw_hash so users keep their passwords on import.')
+@with_appcontext
+def export_users(destination, fmt, with_password_hashes):
+    """Write every user to a CSV or JSONL file."""
+    fields = EXPORT_FIELDS + (('pw_hash',) if with_password_hashes else ())
+    write_records(
+        destination,
+        guess_format(destination.name, fmt),
+        export_records(with_password_hashes=with_password_hashes),
+        fields,
+    )
@@ -0,0 +1,77 @@
+import threading
+import time
+
+
+class CircuitBreaker(object):
+    """Stops calling a failing dependency until it has had time to recover.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    ``allow()`` returns False for ``reset_timeout`` seconds. Then a single
+    trial call is let through: success closes the circuit, failure opens it
+    again for another ``reset_timeout``.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if self._clock() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def retry_after(self):
+        """Seconds until the circuit will let a trial call through."""
+        remaining = self.opened_at + self.reset_timeout - self._clock()
+        return max(0.0, remaining) if self.state == self.OPEN else 0.0
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+
+
+class Bulkhead(object):
+    """Caps concurrent calls to a dependency; 0 means no cap.
+
+    Callers over the cap are turned away immediately rather than queued, so
+    a slow dependency can hold at most ``max_concurrent`` workers.
+    """
+
+    def __init__(self, max_concurrent=0):
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent or 1)
+
+    def acquire(self):
+        return not self.max_concurrent or self._slots.acquire(blocking=False)
+
+    def release(self):
+        if self.max_concurrent:
+            self._slots.release()
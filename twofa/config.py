@@ -7,13 +7,201 @@ class DefaultConfig(object):
     SECRET_KEY = os.environ.get('SECRET_KEY', 'secret-key')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI')
     ACCOUNT_SECURITY_API_KEY = os.environ.get('ACCOUNT_SECURITY_API_KEY')
+    ACCOUNT_SECURITY_API_URI = os.environ.get(
+        'ACCOUNT_SECURITY_API_URI', 'https://api.authy.com'
+    )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DEBUG = False
 
+    # Connection pool for server databases (ignored for SQLite). Each process
+    # holds up to pool_size + max_overflow connections, so size it to the
+    # worker's thread count and keep workers x that under the server limit.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DATABASE_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DATABASE_POOL_PRE_PING', '1') == '1',
+    }
+    SQLITE_PRAGMAS = {}
+
+    # Statements slower than this many seconds are logged with their endpoint.
+    # Endpoints over their QUERY_BUDGETS statement count are logged too, or
+    # fail the request when QUERY_BUDGET_STRICT is set.
+    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD', 0.25))
+    QUERY_BUDGETS = {
+        'twofa.login': 2,
+        'twofa.logout': 1,
+        'twofa.register': 3,
+        'twofa.protected': 1,
+        'twofa.twofa': 1,
+    }
+    QUERY_BUDGET_STRICT = False
+    QUERY_STATS_HEADERS = False
+
+    # Request, database, Authy and template timings in the Prometheus text
+    # format. METRICS_PATH only answers clients in METRICS_ALLOWED_IPS, or
+    # ones sending "Authorization: Bearer <METRICS_TOKEN>".
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_PATH = os.environ.get('METRICS_PATH', '/metrics')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_ALLOWED_IPS = os.environ.get(
+        'METRICS_ALLOWED_IPS', '127.0.0.1,::1'
+    ).split(',')
+
+    # Outbound Authy calls share one keep-alive pool; timeouts are in seconds
+    # and AUTHY_OPERATION_TIMEOUTS overrides the read timeout per operation,
+    # e.g. {'tokens.verify': 5}.
+    AUTHY_POOL_SIZE = int(os.environ.get('AUTHY_POOL_SIZE', 10))
+    AUTHY_CONNECT_TIMEOUT = float(os.environ.get('AUTHY_CONNECT_TIMEOUT', 3.05))
+    AUTHY_READ_TIMEOUT = float(os.environ.get('AUTHY_READ_TIMEOUT', 10))
+    AUTHY_OPERATION_TIMEOUTS = {}
+
+    # Each Authy operation family (users, tokens, phones, one_touch) fails
+    # fast once AUTHY_CIRCUIT_FAILURES calls in a row time out or get a 5xx,
+    # for AUTHY_CIRCUIT_RESET_TIMEOUT seconds. AUTHY_BULKHEAD_SIZE caps the
+    # concurrent calls per family so a slow Authy cannot take every worker.
+    AUTHY_CIRCUIT_FAILURES = int(os.environ.get('AUTHY_CIRCUIT_FAILURES', 5))
+    AUTHY_CIRCUIT_RESET_TIMEOUT = float(os.environ.get('AUTHY_CIRCUIT_RESET_TIMEOUT', 30))
+    AUTHY_BULKHEAD_SIZE = int(os.environ.get('AUTHY_BULKHEAD_SIZE', 8))
+
+    # OneTouch approvals are pushed to /onetouch/callback; set the URL exactly
+    # as configured in the Authy dashboard when running behind a proxy.
+    ONETOUCH_CALLBACK_URL = os.environ.get('ONETOUCH_CALLBACK_URL')
+    ONETOUCH_LONGPOLL_TIMEOUT = float(os.environ.get('ONETOUCH_LONGPOLL_TIMEOUT', 25))
+    # Without a callback URL, long-polls ask Authy this often instead; with
+    # one, they only ask once when they time out.
+    ONETOUCH_FETCH_INTERVAL = float(os.environ.get('ONETOUCH_FETCH_INTERVAL', 3))
+    # Approval statuses are cached per UUID: pending ones briefly (never less
+    # than ONETOUCH_FETCH_INTERVAL), terminal ones until long after the request
+    # expires. Point ONETOUCH_CACHE_REDIS_URL at Redis to share the cache
+    # between workers (requires the redis package).
+    ONETOUCH_PENDING_TTL = float(os.environ.get('ONETOUCH_PENDING_TTL', 3))
+    ONETOUCH_STATUS_TTL = float(os.environ.get('ONETOUCH_STATUS_TTL', 600))
+    ONETOUCH_CACHE_REDIS_URL = os.environ.get('ONETOUCH_CACHE_REDIS_URL')
+    # Clicking OneTouch again within this many seconds reuses the unanswered
+    # push instead of sending a new one (pushes expire after 120 seconds).
+    ONETOUCH_REUSE_WINDOW = float(os.environ.get('ONETOUCH_REUSE_WINDOW', 60))
+
+    # Token buckets per user and per client IP for each way of sending a
+    # token: (burst, seconds to refill it). IP limits are looser to allow for
+    # users behind a shared NAT; behind a proxy make sure remote_addr is the
+    # client's (e.g. with werkzeug's ProxyFix). RATE_LIMIT_REDIS_URL shares the
+    # buckets between workers (requires the redis package).
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    RATE_LIMITS_PER_USER = {'sms': (3, 300), 'voice': (3, 300), 'onetouch': (5, 300)}
+    RATE_LIMITS_PER_IP = {'sms': (30, 300), 'voice': (30, 300), 'onetouch': (50, 300)}
+    RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL')
+    # Unsuccessful code checks per user (2FA tokens) and per phone number
+    # (phone verification): (attempts allowed, within seconds, lockout
+    # seconds). Locked out checks get a 429 without reaching Authy. This is
+    # brute-force protection, so RATE_LIMIT_ENABLED does not turn it off.
+    TOKEN_ATTEMPT_LIMITS_ENABLED = (
+        os.environ.get('TOKEN_ATTEMPT_LIMITS_ENABLED', '1') == '1'
+    )
+    TOKEN_ATTEMPT_LIMITS = {
+        'token_verify': (5, 900, 900),
+        'phone_verify': (5, 900, 900),
+    }
+
+    # With JOBS_ENABLED, registration and phone verification return at once
+    # and their Authy calls run on JOB_WORKERS background threads, retried
+    # with exponential backoff. JOBS_REDIS_URL keeps queued jobs and their
+    # statuses in Redis so they survive a restart and every process sees them
+    # (requires the redis package). It is required when running more than one
+    # process: without it a job is only visible to the process that queued it.
+    JOBS_ENABLED = os.environ.get('JOBS_ENABLED', '0') == '1'
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 1))
+    JOB_STATUS_REFRESH = 2
+    JOBS_REDIS_URL = os.environ.get('JOBS_REDIS_URL')
+
+    # With TOTP_ENABLED users can enroll an authenticator app whose codes are
+    # checked in-process instead of by Authy. Secrets are stored encrypted
+    # with TOTP_ENCRYPTION_KEYS (comma-separated Fernet keys, newest first;
+    # derived from SECRET_KEY if unset). TOTP_REPLAY_REDIS_URL shares the
+    # record of used codes between workers (requires the redis package).
+    TOTP_ENABLED = os.environ.get('TOTP_ENABLED', '0') == '1'
+    TOTP_ENCRYPTION_KEYS = os.environ.get('TOTP_ENCRYPTION_KEYS')
+    TOTP_ISSUER = os.environ.get('TOTP_ISSUER', 'Account Security Quickstart')
+    TOTP_VALID_WINDOW = int(os.environ.get('TOTP_VALID_WINDOW', 1))
+    TOTP_REPLAY_REDIS_URL = os.environ.get('TOTP_REPLAY_REDIS_URL')
+
+    # Set SESSION_BACKEND to 'memory' (one process only) or 'redis' to keep
+    # session data on the server; the cookie then holds just a session ID and
+    # is only re-sent when the ID changes. Stored sessions expire
+    # SESSION_STORE_TTL seconds after they last changed.
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND')
+    SESSION_STORE_SIZE = int(os.environ.get('SESSION_STORE_SIZE', 10000))
+    SESSION_STORE_TTL = int(os.environ.get('SESSION_STORE_TTL', 86400))
+    SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL')
+
+    # Static files are served under content-hashed names (js/2fa.<hash>.js)
+    # with a one-year immutable Cache-Control, and as their .br/.gz variants
+    # when present (`flask assets compress`). Bootstrap and jQuery come from
+    # static/vendor once `flask assets vendor` has fetched them, and from the
+    # CDN until then.
+    ASSETS_FINGERPRINT = os.environ.get('ASSETS_FINGERPRINT', '1') == '1'
+    ASSETS_MAX_AGE = int(os.environ.get('ASSETS_MAX_AGE', 31536000))
+
+    # Opt-in request profiling; nothing is installed unless PROFILING_ENABLED.
+    # A PROFILE_SAMPLE_RATE fraction of requests, and any request carrying the
+    # PROFILE_HEADER printed by `flask profile-token` (valid for
+    # PROFILE_TOKEN_MAX_AGE seconds, signed with PROFILE_SECRET or SECRET_KEY),
+    # is profiled into PROFILE_DIR with a JSON file of its endpoint, DB and
+    # Authy timings. PROFILER is 'sampling' (collapsed stacks for flame graphs,
+    # low overhead) or 'cprofile' (.prof files for pstats or snakeviz).
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILER = os.environ.get('PROFILER', 'sampling')
+    PROFILE_SAMPLING_INTERVAL = float(os.environ.get('PROFILE_SAMPLING_INTERVAL', 0.005))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    PROFILE_HEADER = os.environ.get('PROFILE_HEADER', 'X-Profile')
+    PROFILE_SECRET = os.environ.get('PROFILE_SECRET')
+    PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', 600))
+
+    # Compile every template at startup rather than on first render. With
+    # JINJA_BYTECODE_CACHE_DIR set, compiled templates are kept on disk and
+    # shared by workers and restarts.
+    TEMPLATES_PRECOMPILE = os.environ.get('TEMPLATES_PRECOMPILE', '1') == '1'
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR')
+
+    # Cross-request cache of user rows (0 disables it). It is per process and
+    # only invalidated locally, so with several workers keep the TTL short.
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 0))
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+
+    # Any werkzeug hashing method, e.g. 'pbkdf2:sha512:210000'. Hashes made
+    # with older settings are upgraded on the next successful login; size the
+    # cost with `python -m benchmarks.password_hashing`.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+    # Hash on a bounded pool of this many threads (0 hashes on the request
+    # thread). Past PASSWORD_HASH_QUEUE_LIMIT waiting hashes, requests get a 503.
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', 8))
+
+    # Phone number validation results are cached per normalized number. Eager
+    # loading moves the phonenumbers metadata load from the first request to
+    # startup, where preforking servers can share it between workers.
+    PHONE_VALIDATION_CACHE_SIZE = int(os.environ.get('PHONE_VALIDATION_CACHE_SIZE', 4096))
+    PHONENUMBERS_EAGER_LOAD = os.environ.get('PHONENUMBERS_EAGER_LOAD', '1') == '1'
+
 
 class DevelopmentConfig(DefaultConfig):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'dev.sqlite')
+    # WAL lets the dev server read while another request writes.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'foreign_keys': 'ON',
+    }
+    PHONENUMBERS_EAGER_LOAD = False
+    ASSETS_FINGERPRINT = False
+    TEMPLATES_PRECOMPILE = False
 
 
 class TestConfig(DefaultConfig):
@@ -23,6 +211,12 @@ class TestConfig(DefaultConfig):
     DEBUG = True
     TESTING = True
     SERVER_NAME = 'server.test'
+    ONETOUCH_LONGPOLL_TIMEOUT = 0.1
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PHONENUMBERS_EAGER_LOAD = False
+    QUERY_BUDGET_STRICT = True
+    ASSETS_FINGERPRINT = False
+    TEMPLATES_PRECOMPILE = False
 
 
 config_classes = {
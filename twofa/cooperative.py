@@ -0,0 +1,98 @@
+"""Cooperative serving mode: one gevent greenlet per connection.
+
+The views stay synchronous, but with the standard library monkey-patched
+every socket wait (Authy calls, OneTouch long-polls, Redis, the job queue's
+condition variables) yields to the other connections, so thousands of users
+waiting on upstream calls cost a greenlet each rather than a thread.
+
+Importing the twofa package loads Flask and SQLAlchemy, which is too late to
+patch, so serve through the top-level ``gevent_app`` module instead:
+
+    gunicorn -k gevent --worker-connections 2000 'gevent_app:app'
+    python gevent_app.py --port 5000
+
+Requires the gevent package.
+"""
+import argparse
+import os
+import threading
+
+from gevent import monkey
+from gevent.pywsgi import WSGIServer
+from gevent.threadpool import ThreadPool
+
+from . import create_app
+from .executors import ExecutorSaturated
+
+if not monkey.is_module_patched('socket'):
+    raise RuntimeError(
+        'twofa.cooperative needs the standard library patched by gevent '
+        'first; serve it through gevent_app instead'
+    )
+
+
+class NativeThreadPool(object):
+    """Runs CPU-bound calls on real OS threads.
+
+    Password hashing never waits on a socket, so in a greenlet it would
+    stall every other connection for its full duration. This takes the
+    place of the password hasher's ``BoundedExecutor`` in cooperative mode,
+    and like it lets at most ``queue_limit`` calls wait for a thread before
+    raising ``ExecutorSaturated``.
+    """
+
+    def __init__(self, size, queue_limit=0):
+        self._pool = ThreadPool(size)
+        self._slots = threading.BoundedSemaphore(size + queue_limit)
+        self._lock = threading.Lock()
+        self.completed = self.rejected = 0
+
+    def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorSaturated()
+        try:
+            return self._pool.apply(func, args)
+        finally:
+            self._slots.release()
+            with self._lock:
+                self.completed += 1
+
+    def metrics(self):
+        return {
+            'queue_depth': self._pool.task_queue.qsize(),
+            'active': len(self._pool),
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+    def shutdown(self, wait=True):
+        self._pool.kill()
+
+
+def create_cooperative_app(config_name=None):
+    app = create_app(config_name)
+    workers = app.config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1
+    hasher = app.extensions['password_hasher']
+    if hasher.executor is not None:
+        hasher.executor.shutdown(wait=False)
+    hasher.executor = NativeThreadPool(
+        workers, app.config.get('PASSWORD_HASH_QUEUE_LIMIT', 8)
+    )
+    return app
+
+
+app = create_cooperative_app()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the app on gevent.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    WSGIServer((args.host, args.port), app).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
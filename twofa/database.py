@@ -1,5 +1,137 @@
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+# Pool tuning only applies to server databases; SQLite gets a NullPool or
+# StaticPool from Flask-SQLAlchemy, which reject or ignore these options.
+POOL_OPTIONS = (
+    'pool_size',
+    'max_overflow',
+    'pool_timeout',
+    'pool_recycle',
+    'pool_pre_ping',
+)
+
+
+class PoolStats(object):
+    """Counters fed by pool events, read with ``snapshot()``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = self.checkouts = self.invalidations = 0
+        self.waits = 0
+        self.wait_time = self.max_wait_time = 0.0
+
+    def listen(self, pool):
+        event.listen(pool, 'connect', self._on_connect)
+        event.listen(pool, 'checkout', self._on_checkout)
+        event.listen(pool, 'invalidate', self._on_invalidate)
+
+    def record_wait(self, elapsed):
+        with self._lock:
+            self.waits += 1
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+
+    def snapshot(self, pool):
+        stats = {
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'invalidations': self.invalidations,
+            'waits': self.waits,
+            'wait_seconds_total': self.wait_time,
+            'wait_seconds_max': self.max_wait_time,
+        }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+            })
+        return stats
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection.
+
+    Only checkouts that find the pool exhausted (every connection, overflow
+    included, checked out) count as waits, so the time spent opening new
+    connections does not hide contention.
+    """
+
+    stats = None
+
+    def _do_get(self):
+        if self.stats is None or not self._exhausted():
+            return super(InstrumentedQueuePool, self)._do_get()
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        finally:
+            self.stats.record_wait(time.perf_counter() - start)
+
+    def _exhausted(self):
+        return (
+            self._max_overflow > -1
+            and self.checkedout() >= self.size() + self._max_overflow
+        )
+
+    def recreate(self):
+        pool = super(InstrumentedQueuePool, self).recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """Flask-SQLAlchemy with pool instrumentation and SQLite pragmas."""
+
+    def create_engine(self, sa_url, engine_opts):
+        app = self.get_app()
+        if sa_url.drivername.startswith('sqlite'):
+            for option in POOL_OPTIONS:
+                engine_opts.pop(option, None)
+        else:
+            engine_opts.setdefault('poolclass', InstrumentedQueuePool)
+
+        engine = create_engine(sa_url, **engine_opts)
+        engine.pool_stats = engine.pool.stats = PoolStats()
+        engine.pool_stats.listen(engine.pool)
+
+        pragmas = app.config.get('SQLITE_PRAGMAS')
+        if pragmas and sa_url.drivername.startswith('sqlite'):
+            event.listen(engine, 'connect', _set_sqlite_pragmas(pragmas))
+        return engine
+
+    def pool_stats(self, app=None):
+        engine = self.get_engine(self.get_app(app))
+        return engine.pool_stats.snapshot(engine.pool)
+
+
+def _set_sqlite_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+        cursor.close()
+    return on_connect
+
 
 db = SQLAlchemy()
 migrate = Migrate()
@@ -0,0 +1,72 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExecutorSaturated(Exception):
+    """Raised when a BoundedExecutor has no free worker or queue slot."""
+
+
+class BoundedExecutor(object):
+    """Thread pool that rejects work instead of queueing it without bound.
+
+    At most ``max_workers`` calls run at once and ``queue_limit`` more may
+    wait; anything beyond that raises ``ExecutorSaturated`` immediately so
+    the caller can shed load rather than pile up requests.
+    """
+
+    def __init__(self, max_workers, queue_limit=0, name='worker'):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + queue_limit)
+        self._lock = threading.Lock()
+        self.queued = self.active = self.completed = self.rejected = 0
+        self.run_time = self.wait_time = self.max_run_time = 0.0
+
+    def run(self, func, *args, **kwargs):
+        """Call ``func`` on the pool and block until it returns."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorSaturated()
+        with self._lock:
+            self.queued += 1
+        try:
+            future = self._executor.submit(
+                self._call, time.perf_counter(), func, args, kwargs
+            )
+            return future.result()
+        finally:
+            self._slots.release()
+
+    def _call(self, submitted, func, args, kwargs):
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.wait_time += started - submitted
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+                self.run_time += elapsed
+                self.max_run_time = max(self.max_run_time, elapsed)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'queue_depth': self.queued,
+                'active': self.active,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'run_seconds_total': self.run_time,
+                'run_seconds_max': self.max_run_time,
+                'wait_seconds_total': self.wait_time,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait)
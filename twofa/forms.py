@@ -1,18 +1,45 @@
-import phonenumbers
+import re
 
 from authy import AuthyFormatException
-from authy.api import AuthyApiClient
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SelectField
 from wtforms.fields.html5 import EmailField
 from wtforms.validators import DataRequired, ValidationError
-from phonenumbers.phonenumberutil import NumberParseException
 
-from . import app
+from .authy_client import authy_api
 from .models import User
+from .phones import phone_validator
+from .ratelimit import attempts
+from .totp import TOTPVerifier, local_totp, totp_state
 
 
-authy_api = AuthyApiClient(app.config.get('ACCOUNT_SECURITY_API_KEY'))
+# (shortest, longest) codes Authy issues: app, SMS and voice tokens, and
+# phone verification codes.
+TOKEN_LENGTH = (6, 10)
+VERIFICATION_CODE_LENGTH = (4, 10)
+
+_TOKEN_SEPARATORS = re.compile(r'[\s-]')
+
+
+def validate_token_format(field, min_length, max_length):
+    """Strip spaces and dashes from ``field`` and check it is all digits.
+
+    Malformed codes are rejected here rather than costing an Authy call.
+    """
+    field.data = _TOKEN_SEPARATORS.sub('', field.data or '')
+    pattern = '[0-9]{{{},{}}}'.format(min_length, max_length)
+    if not re.fullmatch(pattern, field.data):
+        field.errors.append('Invalid Token')
+        return False
+    return True
+
+
+def validate_phone_number(form):
+    error = phone_validator.validate(form.country_code.data, form.phone_number.data)
+    if error:
+        form.phone_number.errors.append(error)
+        return False
+    return True
 
 
 class LoginForm(FlaskForm):
@@ -22,7 +49,7 @@ class LoginForm(FlaskForm):
     def validate(self):
         if not super(LoginForm, self).validate():
             return False
-        self.user = User.query.get(self.username.data)
+        self.user = User.get_cached(self.username.data)
         if not self.user or not self.user.check_password(self.password.data):
             self.errors['non_field'] = 'Invalid username and/or password'
             return False
@@ -39,7 +66,7 @@ class RegistrationForm(FlaskForm):
     phone_number = StringField('phone_number', validators=[DataRequired()])
 
     def validate_username(self, field):
-        if User.query.get(field.data):
+        if User.get_cached(field.data):
             raise ValidationError('Username already taken')
 
     def validate_country_code(self, field):
@@ -53,40 +80,54 @@ class RegistrationForm(FlaskForm):
             self.errors['non_field'] = "Password and confirmation didn't match"
             return False
 
-        phone_number = self.country_code.data + self.phone_number.data
-        try:
-            phone_number = phonenumbers.parse(phone_number, None)
-            if not phonenumbers.is_valid_number(phone_number):
-                self.phone_number.errors.append('Invalid phone number')
-                return False
-        except NumberParseException as e:
-            self.phone_number.errors.append(str(e))
-            return False
-        return True
+        return validate_phone_number(self)
 
 
 class TokenVerificationForm(FlaskForm):
     token = StringField('token', validators=[DataRequired()])
 
-    def __init__(self, authy_id):
+    def __init__(self, authy_id, user=None):
         self.authy_id = authy_id
+        self.user = user
         super(TokenVerificationForm, self).__init__()
 
     def validate_token(self, field):
+        if not validate_token_format(field, *TOKEN_LENGTH):
+            return False
+        # Counted before verifying; raises RateLimited once the user is
+        # locked out.
+        key = self.user.username if self.user is not None else self.authy_id
+        attempts.hit('token_verify', key)
+        if not self._verify_token(field):
+            return False
+        attempts.succeeded('token_verify', key)
+        return True
+
+    def _verify_token(self, field):
+        if self.user is not None and local_totp.enabled:
+            # Authenticator app codes are checked in-process; anything else
+            # (SMS and voice codes) falls through to Authy.
+            result = totp_state.verify_user(self.user, field.data)
+            if result == TOTPVerifier.ACCEPTED:
+                return True
+            if result == TOTPVerifier.REPLAYED:
+                field.errors.append('Token already used')
+                return False
         try:
-            verification = authy_api.tokens.verify(
-                self.authy_id,
-                self.token.data
-            )
+            verification = authy_api.tokens.verify(self.authy_id, field.data)
             if not verification.ok():
-                self.token.errors.append('Invalid Token')
+                field.errors.append('Invalid Token')
                 return False
         except AuthyFormatException as e:
-            self.token.errors.append(str(e))
+            field.errors.append(str(e))
             return False
         return True
 
 
+class TOTPEnrollmentForm(FlaskForm):
+    token = StringField('token', validators=[DataRequired()])
+
+
 ######################
 # Phone Verification #
 ######################
@@ -104,17 +145,11 @@ class PhoneVerificationForm(FlaskForm):
         if not super(PhoneVerificationForm, self).validate():
             return False
 
-        phone_number = self.country_code.data + self.phone_number.data
-        try:
-            phone_number = phonenumbers.parse(phone_number, None)
-            if not phonenumbers.is_valid_number(phone_number):
-                self.phone_number.errors.append('Invalid phone number')
-                return False
-        except NumberParseException as e:
-            self.phone_number.errors.append(str(e))
-            return False
-        return True
+        return validate_phone_number(self)
 
 
 class TokenPhoneValidationForm(FlaskForm):
     token = StringField('token', validators=[DataRequired()])
+
+    def validate_token(self, field):
+        validate_token_format(field, *VERIFICATION_CODE_LENGTH)
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('twofa.sql')
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when an endpoint issues more SQL statements than budgeted."""
+
+
+class QueryInstrumentation(object):
+    """Counts SQL statements and DB time per request.
+
+    Statements slower than ``SLOW_QUERY_THRESHOLD`` seconds are logged with
+    the endpoint that issued them. Endpoints listed in ``QUERY_BUDGETS`` are
+    checked after each request: over budget is logged, or raised as
+    ``QueryBudgetExceeded`` when ``QUERY_BUDGET_STRICT`` is set (as in tests).
+    """
+
+    _listening = False
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['query_instrumentation'] = self
+        app.before_request(self._reset)
+        app.after_request(self._check_budget)
+        if not QueryInstrumentation._listening:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            QueryInstrumentation._listening = True
+
+    @staticmethod
+    def stats():
+        """(statement count, seconds in the database) for this request."""
+        return g.get('query_count', 0), g.get('query_time', 0.0)
+
+    def _reset(self):
+        g.query_count = 0
+        g.query_time = 0.0
+
+    def _check_budget(self, response):
+        count, elapsed = self.stats()
+        budget = current_app.config.get('QUERY_BUDGETS', {}).get(request.endpoint)
+        if budget is not None and count > budget:
+            message = '{} issued {} queries (budget {})'.format(
+                request.endpoint, count, budget
+            )
+            if current_app.config.get('QUERY_BUDGET_STRICT'):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        if current_app.config.get('QUERY_STATS_HEADERS'):
+            response.headers['X-DB-Queries'] = str(count)
+            response.headers['X-DB-Time'] = '{:.6f}'.format(elapsed)
+        return response
+
+
+@contextmanager
+def count_queries():
+    """Collect the statements executed by this thread inside the block."""
+    statements = []
+    stack = _local.__dict__.setdefault('collectors', [])
+    stack.append(statements)
+    try:
+        yield statements
+    finally:
+        stack.remove(statements)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    for statements in getattr(_local, 'collectors', ()):
+        statements.append(statement)
+
+    if not has_app_context() or 'query_instrumentation' not in current_app.extensions:
+        return
+    endpoint = None
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        g.query_time = g.get('query_time', 0.0) + elapsed
+        endpoint = request.endpoint
+    threshold = current_app.config.get('SLOW_QUERY_THRESHOLD')
+    if threshold is not None and elapsed > threshold:
+        logger.warning(
+            'Slow query (%.1f ms) in %s: %s', elapsed * 1000, endpoint, statement
+        )
+
+
+query_instrumentation = QueryInstrumentation()
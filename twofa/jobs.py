@@ -0,0 +1,304 @@
+import heapq
+import json
+import logging
+import threading
+import time
+import uuid
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from .onetouch import MemoryBackend, RedisBackend
+
+logger = logging.getLogger('twofa.jobs')
+
+TASKS = {}
+FAILURE_HANDLERS = {}
+
+
+def task(name):
+    """Register a function as the job ``name``; it runs in an app context."""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def on_failure(name):
+    """Register ``func(error, *args)`` to run once job ``name`` has failed.
+
+    It runs in an app context for every final failure, whether the task
+    raised ``JobFailed`` or used up its attempts, so it is the place to
+    undo what the view did before queueing the job.
+    """
+    def register(func):
+        FAILURE_HANDLERS[name] = func
+        return func
+    return register
+
+
+class JobFailed(Exception):
+    """Raised by a task for errors that retrying will not fix."""
+
+
+class MemoryJobBackend(object):
+    """Process-local job queue ordered by due time.
+
+    Jobs are lost when the process exits; use a shared backend where queued
+    upstream calls must survive a restart.
+    """
+
+    def __init__(self):
+        self.statuses = MemoryBackend()
+        self._heap = []
+        self._condition = threading.Condition()
+
+    def push(self, job):
+        with self._condition:
+            heapq.heappush(self._heap, (job['run_at'], job['id'], job))
+            self._condition.notify()
+
+    def pop(self, timeout):
+        """Return the next due job, or None after ``timeout`` seconds."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                if self._heap:
+                    remaining = min(remaining, self._heap[0][0] - now)
+                self._condition.wait(remaining)
+
+    def ack(self, job):
+        pass
+
+    def size(self):
+        return len(self._heap)
+
+
+class RedisJobBackend(object):
+    """Job queue in a Redis sorted set scored by due time.
+
+    A popped job is leased rather than removed: it becomes due again after
+    ``lease`` seconds unless acknowledged, so a worker that dies mid-job
+    does not lose it.
+    """
+
+    POP = '''
+        local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+        if due[1] then
+            redis.call('ZADD', KEYS[1], ARGV[1] + ARGV[2], due[1])
+        end
+        return due[1]
+    '''
+
+    def __init__(self, client, key='twofa:jobs', lease=60, poll_interval=0.5):
+        self.client = client
+        self.key = key
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.statuses = RedisBackend(client, key + ':status:')
+        self._pop = client.register_script(self.POP)
+
+    def push(self, job):
+        self.client.zadd(self.key, {json.dumps(job): job['run_at']})
+
+    def pop(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            member = self._pop(keys=[self.key], args=[time.time(), self.lease])
+            if member is not None:
+                job = json.loads(member)
+                job['_member'] = member
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(remaining, self.poll_interval))
+
+    def ack(self, job):
+        self.client.zrem(self.key, job['_member'])
+
+    def size(self):
+        return self.client.zcard(self.key)
+
+
+class JobQueue(object):
+    """Runs registered tasks outside the request on a pool of threads.
+
+    Tasks raising ``JobFailed`` fail at once; any other exception is retried
+    up to ``max_attempts`` times with exponential backoff starting at
+    ``retry_delay`` seconds. Either way a failed job then runs its
+    ``on_failure`` handler, if any. Each job's state (``pending``, ``done`` or
+    ``failed`` with an ``error``) is kept for ``status_ttl`` seconds so the
+    UI can show progress.
+    """
+
+    def __init__(self, app, backend=None, workers=2, max_attempts=5, retry_delay=1,
+                 status_ttl=3600):
+        self.app = app
+        self.backend = backend or MemoryJobBackend()
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.status_ttl = status_ttl
+        self.completed = self.failed = self.retried = 0
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def enqueue(self, name, *args):
+        """Queue ``TASKS[name](*args)`` and return the job id."""
+        job = {
+            'id': uuid.uuid4().hex,
+            'name': name,
+            'args': list(args),
+            'attempts': 0,
+            'run_at': time.time(),
+        }
+        self._set_status(job, 'pending')
+        self.backend.push(job)
+        self.start()
+        return job['id']
+
+    def status(self, job_id):
+        """``{'state': ..., 'error': ...}`` for ``job_id``, or None if unknown."""
+        return self.backend.statuses.get(job_id) if job_id else None
+
+    def start(self):
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name='job-worker-{}'.format(len(self._threads)),
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def drain(self):
+        """Run every job that is due now in the calling thread."""
+        job = self.backend.pop(0)
+        while job is not None:
+            self._run(job)
+            job = self.backend.pop(0)
+
+    def stats(self):
+        return {
+            'queued': self.backend.size(),
+            'completed_total': self.completed,
+            'failed_total': self.failed,
+            'retried_total': self.retried,
+        }
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self.backend.pop(1)
+            if job is not None:
+                self._run(job)
+
+    def _run(self, job):
+        job['attempts'] += 1
+        try:
+            with self.app.app_context():
+                TASKS[job['name']](*job['args'])
+        except JobFailed as e:
+            self._finish(job, 'failed', str(e))
+        except Exception as e:
+            if job['attempts'] >= self.max_attempts:
+                logger.exception('Job %s (%s) failed', job['id'], job['name'])
+                self._finish(job, 'failed', str(e))
+            else:
+                retry = dict(job, run_at=time.time() + self._backoff(job['attempts']))
+                retry.pop('_member', None)
+                self.backend.push(retry)
+                with self._lock:
+                    self.retried += 1
+        else:
+            self._finish(job, 'done')
+        finally:
+            self.backend.ack(job)
+
+    def _backoff(self, attempts):
+        return self.retry_delay * 2 ** (attempts - 1)
+
+    def _finish(self, job, state, error=None):
+        if state == 'failed':
+            self._handle_failure(job, error)
+        self._set_status(job, state, error)
+        with self._lock:
+            if state == 'done':
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def _handle_failure(self, job, error):
+        handler = FAILURE_HANDLERS.get(job['name'])
+        if handler is None:
+            return
+        try:
+            with self.app.app_context():
+                handler(error, *job['args'])
+        except Exception:
+            logger.exception('Failure handler for job %s (%s) failed',
+                             job['id'], job['name'])
+
+    def _set_status(self, job, state, error=None):
+        self.backend.statuses.set(
+            job['id'], {'state': state, 'error': error}, self.status_ttl
+        )
+
+
+class Jobs(object):
+    """Flask extension owning the app's job queue.
+
+    Disabled unless ``JOBS_ENABLED`` is set, in which case views queue their
+    upstream side effects instead of waiting on them.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('JOBS_ENABLED'):
+            app.extensions['jobs'] = None
+            return
+        backend = None
+        if app.config.get('JOBS_REDIS_URL'):
+            import redis
+
+            backend = RedisJobBackend(redis.Redis.from_url(app.config['JOBS_REDIS_URL']))
+        queue = app.extensions['jobs'] = JobQueue(
+            app,
+            backend,
+            workers=app.config.get('JOB_WORKERS', 2),
+            max_attempts=app.config.get('JOB_MAX_ATTEMPTS', 5),
+            retry_delay=app.config.get('JOB_RETRY_DELAY', 1),
+        )
+        # Workers start with the first request (after any fork) and pick up
+        # jobs a shared backend kept from before a restart.
+        app.before_first_request(queue.start)
+
+    @property
+    def queue(self):
+        return current_app.extensions['jobs']
+
+    @property
+    def enabled(self):
+        return self.queue is not None
+
+
+jobs = Jobs()
+job_queue = LocalProxy(lambda: jobs.queue)
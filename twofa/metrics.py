@@ -0,0 +1,295 @@
+import bisect
+import hmac
+import threading
+import time
+
+from flask import Response, abort, current_app, g, request
+from jinja2 import Template
+
+from .instrumentation import QueryInstrumentation
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; wide enough for a cached lookup and a slow Authy call alike.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Counter(object):
+    """Monotonic counter keyed by a tuple of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Histogram(object):
+    """Cumulative histogram keyed by a tuple of label values.
+
+    ``observe`` is one bisect and one locked list update, so it is cheap
+    enough to call on every request.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[0]) if series is not None else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted((k, (list(c), s)) for k, (c, s) in self._series.items())
+        for labels, (counts, total) in series:
+            labels = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield self.name + '_bucket', dict(labels, le=le), cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class Gauge(object):
+    """A value read at scrape time, e.g. from an extension's ``metrics()``."""
+
+    def __init__(self, name, documentation, value, kind='gauge', labels=None):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self._value = value
+        self._labels = labels or {}
+
+    def samples(self):
+        yield self.name, self._labels, self._value
+
+
+class MetricsRegistry(object):
+    """The metrics recorded for one app."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.request_duration = Histogram(
+            'http_request_duration_seconds',
+            'Time spent handling a request.',
+            ('endpoint', 'method', 'status'),
+            buckets,
+        )
+        self.db_time = Histogram(
+            'db_request_duration_seconds',
+            'Time spent in the database per request.',
+            ('endpoint',),
+            buckets,
+        )
+        self.db_queries = Counter(
+            'db_queries_total', 'SQL statements executed.', ('endpoint',)
+        )
+        self.authy_duration = Histogram(
+            'authy_request_duration_seconds',
+            'Time spent waiting for the Authy API.',
+            ('operation',),
+            buckets,
+        )
+        self.authy_requests = Counter(
+            'authy_requests_total',
+            'Authy API calls by outcome (ok, error, unavailable or rejected).',
+            ('operation', 'outcome'),
+        )
+        self.render_duration = Histogram(
+            'template_render_duration_seconds',
+            'Time spent rendering templates.',
+            ('template',),
+            buckets,
+        )
+
+    def observe_request(self, endpoint, method, status, elapsed, queries, db_time):
+        self.request_duration.observe(elapsed, endpoint, method, status)
+        self.db_time.observe(db_time, endpoint)
+        if queries:
+            self.db_queries.inc(endpoint, amount=queries)
+
+    def observe_authy(self, operation, outcome, elapsed):
+        self.authy_duration.observe(elapsed, operation)
+        self.authy_requests.inc(operation, outcome)
+
+    def observe_render(self, template, elapsed):
+        self.render_duration.observe(elapsed, template)
+
+    def collect(self):
+        return [
+            self.request_duration,
+            self.db_time,
+            self.db_queries,
+            self.authy_duration,
+            self.authy_requests,
+            self.render_duration,
+        ]
+
+
+class TimedTemplate(Template):
+    """Template that reports its render time to the environment's registry."""
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            registry = getattr(self.environment, 'metrics', None)
+            if registry is not None:
+                registry.observe_render(
+                    self.name or '<string>', time.perf_counter() - start
+                )
+
+
+class Metrics(object):
+    """Records request, database, Authy and template timings.
+
+    The registry lives in ``app.extensions['metrics']`` and is served in the
+    Prometheus text format at ``METRICS_PATH`` together with the pool, cache
+    and worker statistics the other extensions already keep.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        registry = MetricsRegistry(app.config.get('METRICS_BUCKETS', DEFAULT_BUCKETS))
+        app.extensions['metrics'] = registry
+        if not app.config.get('METRICS_ENABLED', True):
+            return
+        app.before_request(_start_timer)
+        app.after_request(_record_request)
+        app.jinja_env.template_class = TimedTemplate
+        app.jinja_env.metrics = registry
+        app.add_url_rule(app.config.get('METRICS_PATH', '/metrics'), 'metrics', self.view)
+
+    @property
+    def registry(self):
+        return current_app.extensions['metrics']
+
+    def view(self):
+        if not _may_scrape(current_app.config):
+            abort(403)
+        families = self.registry.collect() + _extension_gauges()
+        return Response(render(families), content_type=CONTENT_TYPE)
+
+
+def _may_scrape(config):
+    token = config.get('METRICS_TOKEN')
+    if token:
+        scheme, _, sent = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(sent, token):
+            return True
+    return request.remote_addr in (config.get('METRICS_ALLOWED_IPS') or ())
+
+
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+def _record_request(response):
+    start = g.get('request_start')
+    if start is not None:
+        queries, db_time = QueryInstrumentation.stats()
+        current_app.extensions['metrics'].observe_request(
+            request.endpoint or 'none',
+            request.method,
+            str(response.status_code),
+            time.perf_counter() - start,
+            queries,
+            db_time,
+        )
+    return response
+
+
+def _extension_gauges():
+    from .authy_client import authy
+    from .database import db
+    from .jobs import jobs
+    from .models import password_hasher, user_cache
+    from .phones import phone_validator
+    from .ratelimit import attempts, limits
+
+    gauges = []
+    sources = [
+        ('db_pool_', db.pool_stats()),
+        ('authy_', authy.metrics()),
+        ('password_hash_', password_hasher.metrics()),
+        ('user_cache_', user_cache.stats()),
+        ('phone_validation_cache_', phone_validator.cache_info()._asdict()),
+        ('rate_limit_', limits.stats()),
+        ('token_attempts_', attempts.stats()),
+        ('jobs_', jobs.queue.stats() if jobs.enabled else {}),
+    ]
+    cumulative = {
+        'connects', 'checkouts', 'invalidations', 'completed', 'rejected', 'hits',
+        'misses', 'identity_hits',
+    }
+    for prefix, stats in sources:
+        for key, value in sorted(stats.items()):
+            if key in cumulative or key.endswith('_total'):
+                name = prefix + (key if key.endswith('_total') else key + '_total')
+                gauges.append(Gauge(name, key.replace('_', ' '), value, 'counter'))
+            elif value is not None:
+                gauges.append(Gauge(prefix + key, key.replace('_', ' '), value))
+    return gauges
+
+
+def render(families):
+    """Format metric families in the Prometheus text exposition format."""
+    lines = []
+    for family in families:
+        lines.append('# HELP {} {}'.format(family.name, family.documentation))
+        lines.append('# TYPE {} {}'.format(family.name, family.kind))
+        for name, labels, value in family.samples():
+            lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, _escape(value)) for key, value in labels.items()
+    ) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+metrics = Metrics()
@@ -1,32 +1,220 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached, validates
+
 from .database import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from .executors import BoundedExecutor
+from werkzeug.local import LocalProxy
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    generate_password_hash,
+    check_password_hash,
+)
+
+
+class PasswordHasher(object):
+    """Hashes passwords with a configurable werkzeug method and cost.
+
+    ``method`` is any werkzeug hashing method, e.g. ``pbkdf2:sha256:260000``
+    (algorithm and iteration count). Hashes made with other parameters
+    still verify, and ``needs_rehash`` reports them so they can be upgraded.
+
+    With an ``executor`` the CPU-bound work runs on its bounded pool, which
+    raises ``ExecutorSaturated`` instead of queueing past its limit.
+    """
+
+    def __init__(self, method='pbkdf2:sha256:260000', salt_length=16, executor=None):
+        self.method = method
+        self.salt_length = salt_length
+        self.executor = executor
+
+    @property
+    def stored_method(self):
+        # werkzeug always records the iteration count in the hash itself.
+        if self.method.startswith('pbkdf2:') and self.method.count(':') == 1:
+            return '{}:{}'.format(self.method, DEFAULT_PBKDF2_ITERATIONS)
+        return self.method
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def hash_in_thread(self, password):
+        """``hash`` in the calling thread, for callers with a pool of their own."""
+        return generate_password_hash(password, self.method, self.salt_length)
+
+    def verify(self, pw_hash, password):
+        return self._run(check_password_hash, pw_hash, password)
+
+    def metrics(self):
+        return self.executor.metrics() if self.executor is not None else {}
+
+    def _run(self, func, *args):
+        if self.executor is None:
+            return func(*args)
+        return self.executor.run(func, *args)
+
+    def needs_rehash(self, pw_hash):
+        method, _, rest = pw_hash.partition('$')
+        salt = rest.partition('$')[0]
+        return method != self.stored_method or len(salt) != self.salt_length
+
+
+class PasswordHashing(object):
+    """Flask extension holding the app's password hasher."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        executor = None
+        if app.config.get('PASSWORD_HASH_WORKERS'):
+            executor = BoundedExecutor(
+                app.config['PASSWORD_HASH_WORKERS'],
+                app.config.get('PASSWORD_HASH_QUEUE_LIMIT', 0),
+                name='password-hash',
+            )
+        app.extensions['password_hasher'] = PasswordHasher(
+            app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000'),
+            app.config.get('PASSWORD_SALT_LENGTH', 16),
+            executor,
+        )
+
+    @property
+    def hasher(self):
+        return current_app.extensions['password_hasher']
+
+
+password_hashing = PasswordHashing()
+password_hasher = LocalProxy(lambda: password_hashing.hasher)
+
+
+class UserCache(object):
+    """Bounded LRU cache of user column values shared across requests.
+
+    Only plain column values are stored, never ORM instances, so entries can
+    be handed to any thread's session. Disabled while ``maxsize`` is 0.
+    """
+
+    def __init__(self, maxsize=0, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.identity_hits = 0
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < now:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, values):
+        with self._lock:
+            self._entries[key] = (values, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.identity_hits = 0
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'identity_hits': self.identity_hits,
+        }
+
+
+class UserCaching(object):
+    """Flask extension holding the app's user cache."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['user_cache'] = UserCache(
+            app.config.get('USER_CACHE_SIZE', 0), app.config.get('USER_CACHE_TTL', 60)
+        )
+
+    @property
+    def cache(self):
+        return current_app.extensions['user_cache']
+
+
+user_caching = UserCaching()
+user_cache = LocalProxy(lambda: user_caching.cache)
+
+
+def normalize_email(email):
+    return email.strip().lower() if email else email
 
 
 class User(db.Model):
     __tablename__ = 'users'
 
-    username = db.Column(db.String(50), unique=True, primary_key=True)
+    username = db.Column(db.String(50), primary_key=True)
     email = db.Column(db.String(120))
-    authy_id = db.Column(db.String(12))
-    pw_hash = db.Column(db.String(50))
-    is_authenticated = db.Column(db.Boolean, default=False)
+    # Lowercased copy of email, kept in step by _normalize_email, so lookups
+    # by email can use an index whatever case the address was typed in.
+    email_normalized = db.Column(db.String(120), index=True)
+    authy_id = db.Column(db.String(12), index=True)
+    pw_hash = db.Column(db.String(255))
+    # Fernet token wrapping the user's authenticator app secret, if enrolled.
+    totp_secret = db.Column(db.String(255))
 
-    def __init__(self, username=None, email=None, password=None,
-                 authy_id=None, is_authenticated=False):
+    def __init__(self, username=None, email=None, password=None, authy_id=None):
         self.username = username
         self.email = email
         self.authy_id = authy_id
-        self.is_authenticated = is_authenticated
         self.set_password(password)
 
     def __repr__(self):
         return '<User %r>' % (self.username)
 
     def set_password(self, password):
-        self.pw_hash = generate_password_hash(password)
+        self.pw_hash = password_hasher.hash(password)
+        user_cache.invalidate(self.username)
 
     def check_password(self, password):
-        return check_password_hash(self.pw_hash, password)
+        """Verify ``password``, upgrading a hash made with outdated settings.
+
+        The upgraded hash is only set on the instance; callers commit it.
+        """
+        if not password_hasher.verify(self.pw_hash, password):
+            return False
+        if password_hasher.needs_rehash(self.pw_hash):
+            self.set_password(password)
+        return True
+
+    @property
+    def is_authenticated(self):
+        # Only users loaded by Flask-Login from a valid session reach the
+        # views; anonymous visitors get Flask-Login's AnonymousUserMixin.
+        return True
 
     def is_active(self):
         return True
@@ -37,6 +225,65 @@ class User(db.Model):
     def is_anonymous(self):
         return False
 
+    @validates('email')
+    def _normalize_email(self, key, email):
+        self.email_normalized = normalize_email(email)
+        return email
+
+    @classmethod
+    def find_by_authy_id(cls, authy_id):
+        return cls.query.filter_by(authy_id=str(authy_id)).first()
+
+    @classmethod
+    def find_by_email(cls, email):
+        """The first user registered with ``email``, ignoring case."""
+        return (
+            cls.query.filter_by(email_normalized=normalize_email(email))
+            .order_by(cls.username)
+            .first()
+        )
+
     @staticmethod
     def load_user(user_id):
-        return User.query.get(user_id)
+        return User.get_cached(user_id)
+
+    @classmethod
+    def get_cached(cls, username):
+        """Primary-key lookup that avoids the database when it can.
+
+        A user already loaded in this request's session is reused as is;
+        otherwise the cross-request ``user_cache`` is tried before querying.
+        """
+        key = cls.__mapper__.identity_key_from_primary_key([username])
+        user = db.session.identity_map.get(key)
+        if user is not None:
+            user_cache.identity_hits += 1
+            return user
+        if not user_cache.enabled:
+            return cls.query.get(username)
+
+        values = user_cache.get(username)
+        if values is None:
+            user = cls.query.get(username)
+            if user is not None:
+                user_cache.set(username, user._cache_values())
+            return user
+
+        user = cls.__mapper__.class_manager.new_instance()
+        for name, value in values.items():
+            setattr(user, name, value)
+        make_transient_to_detached(user)
+        db.session.add(user)
+        return user
+
+    def _cache_values(self):
+        return {
+            attr.key: getattr(self, attr.key) for attr in self.__mapper__.column_attrs
+        }
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, user):
+    user_cache.invalidate(user.username)
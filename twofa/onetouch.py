@@ -0,0 +1,194 @@
+import json
+import math
+import threading
+import time
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+TERMINAL_STATUSES = ('approved', 'denied', 'expired')
+
+
+class MemoryBackend(object):
+    """Process-local status storage with per-key expiry."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] < now:
+                del self._data[key]
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now + ttl)
+            expired = [k for k, (_, expires) in self._data.items() if expires < now]
+            for k in expired:
+                del self._data[k]
+
+
+class RedisBackend(object):
+    """Status storage shared by every worker through a Redis client."""
+
+    def __init__(self, client, prefix='twofa:onetouch:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, int(math.ceil(ttl)), json.dumps(value))
+
+
+class _Flight(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ApprovalStatusCache(object):
+    """Latest known status of each OneTouch approval request.
+
+    Terminal statuses are kept until the approval is long expired, pending
+    ones only for ``pending_ttl`` seconds so polling stays fresh. Callback
+    deliveries ``publish`` statuses, long-poll requests ``wait`` on them, and
+    concurrent ``lookup`` calls for the same UUID share one upstream fetch.
+    """
+
+    def __init__(self, backend=None, pending_ttl=3, status_ttl=600, poll_interval=1,
+                 fetch_interval=3):
+        self.backend = backend or MemoryBackend()
+        self.pending_ttl = pending_ttl
+        self.status_ttl = status_ttl
+        self.poll_interval = poll_interval
+        self.fetch_interval = fetch_interval
+        self._condition = threading.Condition()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get(self, uuid):
+        return self.backend.get(uuid)
+
+    def publish(self, uuid, status):
+        ttl = self.status_ttl if status in TERMINAL_STATUSES else self.pending_ttl
+        self.backend.set(uuid, status, ttl)
+        with self._condition:
+            self._condition.notify_all()
+
+    def track(self, owner, uuid, ttl):
+        """Remember ``uuid`` as ``owner``'s outstanding request for ``ttl`` seconds."""
+        self.backend.set('owner:' + owner, uuid, ttl)
+
+    def pending_for(self, owner):
+        """The UUID of ``owner``'s tracked request, unless it has been answered."""
+        uuid = self.backend.get('owner:' + owner)
+        if uuid is None or self.get(uuid) in TERMINAL_STATUSES:
+            return None
+        return uuid
+
+    def wait(self, uuid, previous, timeout, fetch=None):
+        """Block until ``uuid`` has a status other than ``previous``.
+
+        Returns the new status, or whatever is known (possibly None) once
+        ``timeout`` seconds have passed. Local publishes wake waiters at
+        once; a shared backend is re-read every ``poll_interval`` seconds.
+        Without a callback URL nothing is ever published, so with ``fetch``
+        the status is also looked up every ``fetch_interval`` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        next_fetch = time.monotonic() + self.fetch_interval
+        while True:
+            with self._condition:
+                while True:
+                    status = self.get(uuid)
+                    now = time.monotonic()
+                    if status not in (None, previous) or now >= deadline:
+                        return status
+                    if fetch is not None and now >= next_fetch:
+                        break
+                    wake = min(deadline, next_fetch) if fetch is not None else deadline
+                    self._condition.wait(min(wake - now, self.poll_interval))
+            status = self.lookup(uuid, fetch)
+            if status != previous:
+                return status
+            next_fetch = time.monotonic() + self.fetch_interval
+
+    def lookup(self, uuid, fetch):
+        """Return the cached status, or ``fetch(uuid)`` it exactly once.
+
+        Callers arriving while a fetch for the same UUID is running wait for
+        that fetch instead of issuing their own.
+        """
+        status = self.get(uuid)
+        if status is not None:
+            return status
+
+        with self._lock:
+            flight = self._in_flight.get(uuid)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[uuid] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fetch(uuid)
+            self.publish(uuid, flight.result)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[uuid]
+            flight.event.set()
+
+
+class OneTouch(object):
+    """Flask extension holding the app's OneTouch approval status cache."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = None
+        if app.config.get('ONETOUCH_CACHE_REDIS_URL'):
+            import redis
+
+            backend = RedisBackend(
+                redis.Redis.from_url(app.config['ONETOUCH_CACHE_REDIS_URL'])
+            )
+        fetch_interval = app.config.get('ONETOUCH_FETCH_INTERVAL', 3)
+        app.extensions['onetouch'] = ApprovalStatusCache(
+            backend,
+            # A pending status that expires before the next fetch would send
+            # every status check in between to Authy.
+            pending_ttl=max(app.config.get('ONETOUCH_PENDING_TTL', 3), fetch_interval),
+            status_ttl=app.config.get('ONETOUCH_STATUS_TTL', 600),
+            fetch_interval=fetch_interval,
+        )
+
+    @property
+    def cache(self):
+        return current_app.extensions['onetouch']
+
+
+onetouch = OneTouch()
+approvals = LocalProxy(lambda: onetouch.cache)
@@ -0,0 +1,75 @@
+import re
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+_SEPARATORS = re.compile(r'[\s\-().]')
+
+
+class PhoneNumberValidator(object):
+    """Validates (country code, phone number) pairs with an LRU cache.
+
+    Inputs are normalized first (leading ``+`` and common separators are
+    dropped) so equivalent spellings share one cache entry. phonenumbers is
+    only imported on first use, or at startup with ``load_metadata``.
+    """
+
+    def __init__(self, cache_size=4096):
+        self._cached_error = lru_cache(maxsize=cache_size)(self._error)
+
+    @staticmethod
+    def load_metadata():
+        import phonenumbers
+
+        phonenumbers.PhoneMetadata.load_all()
+
+    @staticmethod
+    def normalize(country_code, phone_number):
+        return (
+            _SEPARATORS.sub('', country_code).lstrip('+'),
+            _SEPARATORS.sub('', phone_number),
+        )
+
+    def validate(self, country_code, phone_number):
+        """Return an error message, or None if the number is valid."""
+        return self._cached_error(*self.normalize(country_code, phone_number))
+
+    def cache_info(self):
+        return self._cached_error.cache_info()
+
+    @staticmethod
+    def _error(country_code, phone_number):
+        import phonenumbers
+        from phonenumbers.phonenumberutil import NumberParseException
+
+        try:
+            number = phonenumbers.parse('+' + country_code + phone_number, None)
+        except NumberParseException as e:
+            return str(e)
+        if not phonenumbers.is_valid_number(number):
+            return 'Invalid phone number'
+        return None
+
+
+class PhoneValidation(object):
+    """Flask extension holding the app's phone number validator."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['phone_validator'] = PhoneNumberValidator(
+            app.config.get('PHONE_VALIDATION_CACHE_SIZE', 4096)
+        )
+        if app.config.get('PHONENUMBERS_EAGER_LOAD'):
+            PhoneNumberValidator.load_metadata()
+
+    @property
+    def validator(self):
+        return current_app.extensions['phone_validator']
+
+
+phone_validation = PhoneValidation()
+phone_validator = LocalProxy(lambda: phone_validation.validator)
@@ -0,0 +1,251 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+from itsdangerous import BadSignature, TimestampSigner
+
+from .authy_client import Authy
+from .instrumentation import QueryInstrumentation
+
+logger = logging.getLogger('twofa.profiling')
+
+# The WSGI environ key through which the app reports a profiled request's
+# endpoint and timings back to the middleware.
+TAGS_KEY = 'twofa.profile_tags'
+
+
+class SamplingProfiler(object):
+    """Records the profiled thread's stack every ``interval`` seconds.
+
+    The request thread runs at full speed between samples, so the overhead
+    stays small whatever the request does. ``dump`` writes collapsed
+    stacks (``frame;frame;frame count``), which flamegraph.pl and speedscope
+    read. Under the cooperative gevent server the sampler is itself a
+    greenlet and sees little; use ``cprofile`` there.
+    """
+
+    suffix = '.folded'
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(),),
+            name='profile-sampler',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def _sample(self, target):
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+class CProfileProfiler(object):
+    """Deterministic profile of every call, written for pstats or snakeviz."""
+
+    suffix = '.prof'
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def dump(self, path):
+        self._profile.dump_stats(path)
+
+
+PROFILERS = {
+    'sampling': lambda config: SamplingProfiler(
+        config.get('PROFILE_SAMPLING_INTERVAL', 0.005)
+    ),
+    'cprofile': lambda config: CProfileProfiler(),
+}
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(
+            code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+        ))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class ProfilerMiddleware(object):
+    """WSGI middleware that profiles a sample of requests.
+
+    A request is profiled with probability ``sample_rate``, or when it
+    carries ``header`` with a token from ``signer`` younger than
+    ``max_age`` seconds. Each profile is written to ``profile_dir`` next to
+    a JSON file with the request's endpoint, status, duration and database
+    and Authy timings. Other requests cost one random draw and a header
+    lookup.
+    """
+
+    def __init__(self, wsgi_app, config, profile_dir, sample_rate=0.0, signer=None,
+                 header='X-Profile', max_age=600, profiler='sampling'):
+        self.wsgi_app = wsgi_app
+        self.config = config
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.signer = signer
+        self.environ_key = 'HTTP_' + header.upper().replace('-', '_')
+        self.max_age = max_age
+        self.new_profiler = PROFILERS[profiler]
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def wanted(self, environ):
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        token = environ.get(self.environ_key)
+        if token and self.signer is not None:
+            try:
+                self.signer.unsign(token, max_age=self.max_age)
+                return True
+            except BadSignature:
+                logger.warning('Ignoring invalid or expired profiling token')
+        return False
+
+    def __call__(self, environ, start_response):
+        if not self.wanted(environ):
+            return self.wsgi_app(environ, start_response)
+
+        tags = environ[TAGS_KEY] = {}
+        statuses = []
+
+        def catching_start_response(status, headers, exc_info=None):
+            statuses.append(status)
+            return start_response(status, headers, exc_info)
+
+        profiler = self.new_profiler(self.config)
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            app_iter = self.wsgi_app(environ, catching_start_response)
+            body = list(app_iter)
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        finally:
+            profiler.stop()
+            elapsed = time.perf_counter() - started
+            self._write(profiler, environ, tags, statuses, elapsed)
+        return body
+
+    def _write(self, profiler, environ, tags, statuses, elapsed):
+        tags.update({
+            'method': environ.get('REQUEST_METHOD'),
+            'path': environ.get('PATH_INFO'),
+            'status': statuses[0].split()[0] if statuses else None,
+            'duration_ms': round(elapsed * 1000, 3),
+            'profiler': type(profiler).__name__,
+        })
+        base = os.path.join(self.profile_dir, '{}-{}-{:.0f}ms-{}'.format(
+            time.strftime('%Y%m%dT%H%M%S'),
+            tags.get('endpoint') or 'none',
+            elapsed * 1000,
+            uuid.uuid4().hex[:8],
+        ))
+        profiler.dump(base + profiler.suffix)
+        with open(base + '.json', 'w') as f:
+            json.dump(tags, f, indent=2, sort_keys=True)
+        logger.info('Profiled %s %s in %.1f ms: %s', tags['method'], tags['path'],
+                    elapsed * 1000, base + profiler.suffix)
+
+
+class RequestProfiling(object):
+    """Flask extension installing ``ProfilerMiddleware`` on ``app.wsgi_app``.
+
+    Nothing is installed unless ``PROFILING_ENABLED`` is set, so requests
+    pay nothing for it by default.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.cli.add_command(profile_token)
+        if not app.config.get('PROFILING_ENABLED'):
+            return
+        signer = None
+        if app.config.get('PROFILE_HEADER'):
+            signer = _signer(app.config)
+        app.after_request(_tag_request)
+        app.wsgi_app = ProfilerMiddleware(
+            app.wsgi_app,
+            app.config,
+            app.config.get('PROFILE_DIR')
+            or os.path.join(tempfile.gettempdir(), 'twofa-profiles'),
+            sample_rate=app.config.get('PROFILE_SAMPLE_RATE', 0.0),
+            signer=signer,
+            header=app.config.get('PROFILE_HEADER') or 'X-Profile',
+            max_age=app.config.get('PROFILE_TOKEN_MAX_AGE', 600),
+            profiler=app.config.get('PROFILER', 'sampling'),
+        )
+
+
+def _signer(config):
+    return TimestampSigner(
+        config.get('PROFILE_SECRET') or config['SECRET_KEY'], salt='twofa.profile'
+    )
+
+
+def _tag_request(response):
+    tags = request.environ.get(TAGS_KEY)
+    if tags is not None:
+        queries, db_time = QueryInstrumentation.stats()
+        authy_calls, authy_time = Authy.request_stats()
+        tags.update({
+            'endpoint': request.endpoint,
+            'db_queries': queries,
+            'db_time_ms': round(db_time * 1000, 3),
+            'authy_calls': authy_calls,
+            'authy_time_ms': round(authy_time * 1000, 3),
+        })
+    return response
+
+
+@click.command('profile-token')
+@with_appcontext
+def profile_token():
+    """Print a header that has the request it is sent with profiled."""
+    token = _signer(current_app.config).sign('profile').decode('ascii')
+    click.echo('{}: {}'.format(current_app.config.get('PROFILE_HEADER') or 'X-Profile',
+                               token))
+
+
+request_profiling = RequestProfiling()
@@ -0,0 +1,285 @@
+import threading
+import time
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+
+class RateLimited(Exception):
+    """Raised when a caller has used up its allowance for an action."""
+
+    def __init__(self, action, retry_after):
+        super(RateLimited, self).__init__(
+            '{} rate limited, retry in {:.1f}s'.format(action, retry_after)
+        )
+        self.action = action
+        self.retry_after = retry_after
+
+
+class MemoryBucketBackend(object):
+    """Process-local token buckets.
+
+    Buckets that have refilled completely carry no information, so they are
+    swept once more than ``max_keys`` are held.
+    """
+
+    def __init__(self, max_keys=10000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets):
+        """Take a token from every ``(key, capacity, period)`` bucket, or from none.
+
+        Returns 0, or the seconds until every bucket has a token again.
+        """
+        now = self._clock()
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for key, capacity, period in buckets:
+                rate = capacity / period
+                tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                levels.append((key, capacity, rate, tokens))
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+            if not wait:
+                for key, capacity, rate, tokens in levels:
+                    tokens -= 1
+                    self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+                if len(self._buckets) > self.max_keys:
+                    self._sweep(now)
+        return wait
+
+    def _sweep(self, now):
+        full = [key for key, (_, _, full_at) in self._buckets.items() if full_at <= now]
+        for key in full:
+            del self._buckets[key]
+
+
+class RedisBucketBackend(object):
+    """Token buckets shared by every worker, checked and spent in one script."""
+
+    SCRIPT = '''
+        local now = tonumber(ARGV[1])
+        local levels = {}
+        local wait = 0
+        for i, key in ipairs(KEYS) do
+            local capacity = tonumber(ARGV[2 * i])
+            local rate = capacity / tonumber(ARGV[2 * i + 1])
+            local state = redis.call('HMGET', key, 'tokens', 'updated')
+            local tokens = tonumber(state[1]) or capacity
+            local updated = tonumber(state[2]) or now
+            tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+            levels[i] = tokens
+            if tokens < 1 then
+                wait = math.max(wait, (1 - tokens) / rate)
+            end
+        end
+        if wait == 0 then
+            for i, key in ipairs(KEYS) do
+                redis.call('HMSET', key, 'tokens', levels[i] - 1, 'updated', now)
+                redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[2 * i + 1])))
+            end
+        end
+        return tostring(wait)
+    '''
+
+    def __init__(self, client, prefix='twofa:ratelimit:'):
+        self.prefix = prefix
+        self._take = client.register_script(self.SCRIPT)
+
+    def take(self, buckets):
+        keys, args = [], [time.time()]
+        for key, capacity, period in buckets:
+            keys.append(self.prefix + key)
+            args.extend((capacity, period))
+        return float(self._take(keys=keys, args=args))
+
+
+class TokenBucketLimiter(object):
+    """Per-user and per-IP token buckets for each rate-limited action.
+
+    ``per_user`` and ``per_ip`` map an action to ``(capacity, period)``: a
+    burst of up to ``capacity`` calls, refilled at ``capacity`` per
+    ``period`` seconds. Actions missing from a mapping are not limited on
+    that key.
+    """
+
+    def __init__(self, backend=None, per_user=None, per_ip=None):
+        self.backend = backend or MemoryBucketBackend()
+        self.per_user = dict(per_user or {})
+        self.per_ip = dict(per_ip or {})
+        self.allowed = self.rejected = 0
+
+    def hit(self, action, user_id=None, ip=None):
+        """Count one ``action``, raising ``RateLimited`` if it is over a limit.
+
+        A rejected call spends nothing, so one user hammering their own
+        limit does not use up the allowance of others behind the same IP.
+        """
+        buckets = []
+        scopes = (('ip', self.per_ip, ip), ('user', self.per_user, user_id))
+        for scope, limits, value in scopes:
+            if value is not None and action in limits:
+                capacity, period = limits[action]
+                key = '{}:{}:{}'.format(action, scope, value)
+                buckets.append((key, capacity, period))
+        wait = self.backend.take(buckets) if buckets else 0.0
+        if wait:
+            self.rejected += 1
+            raise RateLimited(action, wait)
+        self.allowed += 1
+
+    def stats(self):
+        return {'allowed_total': self.allowed, 'rejected_total': self.rejected}
+
+
+class MemoryAttemptBackend(object):
+    """Process-local attempt counters and lockouts."""
+
+    def __init__(self, max_keys=10000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, max_attempts, window, lockout):
+        """Count one attempt; return 0, or the seconds ``key`` is locked out.
+
+        The attempt after the ``max_attempts``-th in a window starts a
+        ``lockout`` during which every attempt is refused.
+        """
+        now = self._clock()
+        with self._lock:
+            attempts, expires = self._entries.get(key, (0, 0))
+            if expires <= now:
+                attempts, expires = 0, now + window
+            attempts += 1
+            if attempts == max_attempts + 1:
+                expires = now + lockout
+            self._entries[key] = (attempts, expires)
+            if len(self._entries) > self.max_keys:
+                self._sweep(now)
+        if attempts <= max_attempts:
+            return 0.0
+        # Report the new lockout exactly; later attempts see what is left.
+        return float(lockout) if attempts == max_attempts + 1 else expires - now
+
+    def reset(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _sweep(self, now):
+        stale = [key for key, (_, expires) in self._entries.items() if expires <= now]
+        for key in stale:
+            del self._entries[key]
+
+
+class RedisAttemptBackend(object):
+    """Attempt counters and lockouts shared by every worker."""
+
+    HIT = '''
+        local attempts = redis.call('INCR', KEYS[1])
+        local max_attempts = tonumber(ARGV[1])
+        if attempts == 1 then
+            redis.call('EXPIRE', KEYS[1], ARGV[2])
+        elseif attempts == max_attempts + 1 then
+            redis.call('EXPIRE', KEYS[1], ARGV[3])
+        end
+        if attempts > max_attempts then
+            return math.max(redis.call('TTL', KEYS[1]), 1)
+        end
+        return 0
+    '''
+
+    def __init__(self, client, prefix='twofa:attempts:'):
+        self.client = client
+        self.prefix = prefix
+        self._hit = client.register_script(self.HIT)
+
+    def hit(self, key, max_attempts, window, lockout):
+        wait = self._hit(
+            keys=[self.prefix + key], args=[max_attempts, int(window), int(lockout)]
+        )
+        return float(wait)
+
+    def reset(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class AttemptLimiter(object):
+    """Locks out keys (a user, a phone number) after repeated failed attempts.
+
+    ``policies`` maps an action to ``(max_attempts, window, lockout)``.
+    Each attempt is counted by ``hit`` before the upstream call is made, so
+    concurrent guesses cannot all slip in before the first failure is
+    recorded. Beyond ``max_attempts`` within ``window`` seconds, ``hit``
+    raises ``RateLimited`` for ``lockout`` seconds. A success clears the
+    count. Actions without a policy are never limited.
+    """
+
+    def __init__(self, backend=None, policies=None):
+        self.backend = backend or MemoryAttemptBackend()
+        self.policies = dict(policies or {})
+        self.allowed = self.rejected = 0
+
+    def hit(self, action, key):
+        """Count one attempt at ``action``, raising ``RateLimited`` if locked out."""
+        if action not in self.policies:
+            return
+        wait = self.backend.hit('{}:{}'.format(action, key), *self.policies[action])
+        if wait:
+            self.rejected += 1
+            raise RateLimited(action, wait)
+        self.allowed += 1
+
+    def succeeded(self, action, key):
+        if action in self.policies:
+            self.backend.reset('{}:{}'.format(action, key))
+
+    def stats(self):
+        return {'allowed_total': self.allowed, 'rejected_total': self.rejected}
+
+
+class RateLimiter(object):
+    """Flask extension holding the app's token bucket and attempt limiters."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = attempt_backend = None
+        if app.config.get('RATE_LIMIT_REDIS_URL'):
+            import redis
+
+            client = redis.Redis.from_url(app.config['RATE_LIMIT_REDIS_URL'])
+            backend = RedisBucketBackend(client)
+            attempt_backend = RedisAttemptBackend(client)
+        enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+        app.extensions['rate_limiter'] = TokenBucketLimiter(
+            backend,
+            per_user=app.config.get('RATE_LIMITS_PER_USER') if enabled else None,
+            per_ip=app.config.get('RATE_LIMITS_PER_IP') if enabled else None,
+        )
+        attempts_enabled = app.config.get('TOKEN_ATTEMPT_LIMITS_ENABLED', True)
+        app.extensions['attempt_limiter'] = AttemptLimiter(
+            attempt_backend,
+            app.config.get('TOKEN_ATTEMPT_LIMITS') if attempts_enabled else None,
+        )
+
+    @property
+    def limiter(self):
+        return current_app.extensions['rate_limiter']
+
+    @property
+    def attempt_limiter(self):
+        return current_app.extensions['attempt_limiter']
+
+
+rate_limiter = RateLimiter()
+limits = LocalProxy(lambda: rate_limiter.limiter)
+attempts = LocalProxy(lambda: rate_limiter.attempt_limiter)
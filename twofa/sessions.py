@@ -0,0 +1,186 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session data kept on the server; the cookie only carries ``sid``."""
+
+    def __init__(self, initial=None, sid=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super(ServerSideSession, self).__init__(initial, on_update)
+        self.sid = sid
+        self.user_id = (initial or {}).get('_user_id')
+        self.modified = False
+        self.accessed = False
+
+    # Reads mark the session accessed too, so pages that depend on it get
+    # Vary: Cookie (as with Flask's SecureCookieSession).
+    def __getitem__(self, key):
+        self.accessed = True
+        return super(ServerSideSession, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super(ServerSideSession, self).get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super(ServerSideSession, self).setdefault(key, default)
+
+
+class MemorySessionStore(object):
+    """Process-local LRU of serialized sessions, each expiring after ``ttl``.
+
+    Sessions are only visible to the process that wrote them; use a shared
+    store when running more than one worker.
+    """
+
+    def __init__(self, maxsize=10000, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None or entry[1] < now:
+                self._entries.pop(sid, None)
+                return None
+            self._entries.move_to_end(sid)
+            return entry[0]
+
+    def set(self, sid, data):
+        with self._lock:
+            self._entries[sid] = (data, time.monotonic() + self.ttl)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisSessionStore(object):
+    """Sessions shared by every worker through a Redis client."""
+
+    def __init__(self, client, ttl=86400, prefix='twofa:session:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, sid):
+        return self.client.get(self.prefix + sid)
+
+    def set(self, sid, data):
+        self.client.setex(self.prefix + sid, int(self.ttl), data)
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in ``store`` under a random session ID.
+
+    Data is serialized with Flask's compact tagged JSON and is neither
+    signed nor compressed: the 22-character ID is unguessable, so there is
+    nothing to forge. The store is written only when the session changes,
+    and the cookie only sent when the ID (or a permanent session's expiry)
+    does. A new ID is issued whenever the logged-in user changes, so an ID
+    planted before login is useless afterwards.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSideSession(self.serializer.loads(data), sid)
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session.modified:
+            return
+
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        new_sid = session.sid is None or session.get('_user_id') != session.user_id
+        if new_sid:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(16)
+            session.user_id = session.get('_user_id')
+        self.store.set(session.sid, self.serializer.dumps(dict(session)))
+        # The cookie only changes with the ID, or with the expiry of a
+        # permanent session.
+        if not new_sid and not session.permanent:
+            return
+        response.set_cookie(
+            app.session_cookie_name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+class ServerSideSessions(object):
+    """Flask extension that moves sessions out of the signed cookie.
+
+    Off unless ``SESSION_BACKEND`` is ``memory`` or ``redis``.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('SESSION_BACKEND')
+        ttl = app.config.get('SESSION_STORE_TTL', 86400)
+        if backend == 'memory':
+            store = MemorySessionStore(app.config.get('SESSION_STORE_SIZE', 10000), ttl)
+        elif backend == 'redis':
+            import redis
+
+            store = RedisSessionStore(
+                redis.Redis.from_url(app.config['SESSION_REDIS_URL']), ttl
+            )
+        elif backend:
+            raise ValueError('Unknown SESSION_BACKEND {!r}'.format(backend))
+        else:
+            return
+        app.session_interface = ServerSideSessionInterface(store)
+
+
+server_side_sessions = ServerSideSessions()
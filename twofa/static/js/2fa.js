@@ -0,0 +1,33 @@
+function initializeActionButtons() {
+  $('.action-btn').click(function(ev){
+    ev.preventDefault();
+    var $button = $(ev.target);
+    $.post($button.attr('href'), function(data) {
+      console.log(data);
+      if ($button.attr('href') === "/token/onetouch") {
+        waitForOneTouch('pending');
+      }
+    }).fail(function(data){
+      console.log('Error ', data);
+    });
+    return false;
+  });
+
+  // Long-poll: the server answers as soon as the approval status changes.
+  function waitForOneTouch(status) {
+    $.post("/onetouch-status/wait", {status: status}, function(data) {
+      console.log("OneTouch Status: ", data);
+      if (data === 'approved') {
+        window.location.href = "/protected";
+      } else if (data === 'pending') {
+        waitForOneTouch(data);
+      } else {
+        alert("OneTouch request " + data);
+      }
+    }).fail(function(data){
+      console.log("OneTouch Polling Status: ", data);
+      alert("Something went wrong with the OneTouch polling");
+    });
+  }
+}
+$(document).ready(initializeActionButtons);
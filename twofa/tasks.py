@@ -0,0 +1,47 @@
+from .authy_client import authy_api
+from .database import db
+from .jobs import JobFailed, on_failure, task
+from .models import User
+
+
+def _describe(errors):
+    return ', '.join('{}: {}'.format(key, value) for key, value in errors.items())
+
+
+@task('users.create')
+def create_authy_user(username, email, phone_number, country_code):
+    """Enroll a registered user with Authy and store their Authy ID.
+
+    Authy returns the existing ID for a known email and phone, so a retry
+    after a lost response is harmless.
+    """
+    user = User.query.get(username)
+    if user is None or user.authy_id:
+        return
+    authy_user = authy_api.users.create(email, phone_number, country_code)
+    if not authy_user.ok():
+        raise JobFailed(_describe(authy_user.errors()))
+    user.authy_id = authy_user.id
+    db.session.commit()
+
+
+@on_failure('users.create')
+def remove_pending_user(error, username, *args):
+    remove_unenrolled_user(username)
+
+
+def remove_unenrolled_user(username):
+    """Remove a half-registered user so the username can be registered again."""
+    user = User.query.get(username)
+    if user is not None and not user.authy_id:
+        db.session.delete(user)
+        db.session.commit()
+
+
+@task('phones.verification_start')
+def start_phone_verification(phone_number, country_code, via):
+    verification = authy_api.phones.verification_start(
+        phone_number, country_code, via=via
+    )
+    if not verification.ok():
+        raise JobFailed(_describe(verification.errors()))
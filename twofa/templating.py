@@ -0,0 +1,42 @@
+import logging
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+logger = logging.getLogger('twofa.templating')
+
+
+class TemplatePrecompiler(object):
+    """Compiles every template at startup instead of on its first render.
+
+    With ``JINJA_BYTECODE_CACHE_DIR`` set, compiled templates are also
+    written there and reused by later processes and restarts, which then
+    skip Jinja's parse and compile step entirely.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+        if cache_dir:
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        if app.config.get('TEMPLATES_PRECOMPILE'):
+            self.precompile(app)
+
+    @staticmethod
+    def precompile(app):
+        """Load every template into the environment's cache; return the count."""
+        started = time.perf_counter()
+        names = app.jinja_env.list_templates(extensions=('html',))
+        for name in names:
+            app.jinja_env.get_template(name)
+        logger.info(
+            'Compiled %d templates in %.1f ms', len(names),
+            (time.perf_counter() - started) * 1000,
+        )
+        return len(names)
+
+
+template_precompiler = TemplatePrecompiler()
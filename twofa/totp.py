@@ -0,0 +1,190 @@
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+from urllib.parse import quote, urlencode
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+
+def generate_secret():
+    """A new random 160-bit secret, base32 encoded as authenticator apps expect."""
+    return base64.b32encode(os.urandom(20)).decode('ascii')
+
+
+def totp(secret, counter, digits=6):
+    """The RFC 6238 code (HMAC-SHA1) for ``counter`` time steps."""
+    key = base64.b32decode(secret)
+    digest = hmac.new(key, struct.pack('>Q', counter), hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    code = struct.unpack('>I', digest[offset:offset + 4])[0] & 0x7FFFFFFF
+    return str(code % 10 ** digits).zfill(digits)
+
+
+class MemoryReplayCache(object):
+    """Process-local record of recently accepted codes."""
+
+    def __init__(self):
+        self._expiry = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key, ttl):
+        """Record ``key``; False if it was already recorded and unexpired."""
+        now = time.monotonic()
+        with self._lock:
+            if self._expiry.get(key, 0) > now:
+                return False
+            self._expiry[key] = now + ttl
+            expired = [k for k, expires in self._expiry.items() if expires <= now]
+            for k in expired:
+                del self._expiry[k]
+            return True
+
+
+class RedisReplayCache(object):
+    """Accepted codes shared by every worker, so a code works only once anywhere."""
+
+    def __init__(self, client, prefix='twofa:totp:'):
+        self.client = client
+        self.prefix = prefix
+
+    def claim(self, key, ttl):
+        return bool(self.client.set(self.prefix + key, 1, nx=True, ex=int(ttl) + 1))
+
+
+class TOTPVerifier(object):
+    """Checks authenticator app codes in-process.
+
+    Codes from ``window`` steps either side of now are accepted to allow for
+    clock drift, and each (user, step) is accepted only once.
+    """
+
+    ACCEPTED = 'accepted'
+    REPLAYED = 'replayed'
+
+    def __init__(self, replay_cache=None, digits=6, step=30, window=1,
+                 clock=time.time):
+        self.replay_cache = replay_cache or MemoryReplayCache()
+        self.digits = digits
+        self.step = step
+        self.window = window
+        self._clock = clock
+
+    def matches_format(self, code):
+        return len(code) == self.digits and code.isdigit()
+
+    def verify(self, owner, secret, code):
+        """Return ``ACCEPTED``, ``REPLAYED`` or None if the code does not match."""
+        if not self.matches_format(code):
+            return None
+        now = int(self._clock() // self.step)
+        for counter in range(now - self.window, now + self.window + 1):
+            if hmac.compare_digest(totp(secret, counter, self.digits), code):
+                ttl = (2 * self.window + 1) * self.step
+                key = '{}:{}'.format(owner, counter)
+                if not self.replay_cache.claim(key, ttl):
+                    return self.REPLAYED
+                return self.ACCEPTED
+        return None
+
+    def provisioning_uri(self, secret, account, issuer):
+        """The ``otpauth://`` URI authenticator apps import, e.g. from a QR code."""
+        params = urlencode({
+            'secret': secret,
+            'issuer': issuer,
+            'digits': self.digits,
+            'period': self.step,
+        })
+        return 'otpauth://totp/{}:{}?{}'.format(quote(issuer), quote(account), params)
+
+
+class SecretBox(object):
+    """Encrypts TOTP secrets at rest with Fernet.
+
+    ``keys`` are Fernet keys, newest first: the first encrypts and all of
+    them decrypt, so keys can be rotated without re-enrolling users.
+    """
+
+    def __init__(self, keys):
+        from cryptography.fernet import Fernet, MultiFernet
+
+        self._fernet = MultiFernet([Fernet(key) for key in keys])
+
+    @classmethod
+    def from_config(cls, config):
+        keys = [k.strip() for k in (config.get('TOTP_ENCRYPTION_KEYS') or '').split(',')]
+        keys = [k for k in keys if k]
+        if not keys:
+            # Fall back to a key derived from SECRET_KEY for development.
+            digest = hashlib.sha256(config['SECRET_KEY'].encode('utf-8')).digest()
+            keys = [base64.urlsafe_b64encode(digest)]
+        return cls(keys)
+
+    def encrypt(self, secret):
+        return self._fernet.encrypt(secret.encode('ascii')).decode('ascii')
+
+    def decrypt(self, token):
+        return self._fernet.decrypt(token.encode('ascii')).decode('ascii')
+
+
+class LocalTOTP(object):
+    """Flask extension for locally verified authenticator app codes.
+
+    Disabled unless ``TOTP_ENABLED`` is set; users without a local secret,
+    and codes that do not match one, still go to Authy.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('TOTP_ENABLED'):
+            app.extensions['totp'] = None
+            return
+        replay_cache = None
+        if app.config.get('TOTP_REPLAY_REDIS_URL'):
+            import redis
+
+            replay_cache = RedisReplayCache(
+                redis.Redis.from_url(app.config['TOTP_REPLAY_REDIS_URL'])
+            )
+        app.extensions['totp'] = _TOTPState(
+            SecretBox.from_config(app.config),
+            TOTPVerifier(replay_cache, window=app.config.get('TOTP_VALID_WINDOW', 1)),
+            app.config.get('TOTP_ISSUER', 'Account Security Quickstart'),
+        )
+
+    @property
+    def state(self):
+        return current_app.extensions['totp']
+
+    @property
+    def enabled(self):
+        return self.state is not None
+
+
+class _TOTPState(object):
+    def __init__(self, box, verifier, issuer):
+        self.box = box
+        self.verifier = verifier
+        self.issuer = issuer
+
+    def verify_user(self, user, code):
+        """Check ``code`` against ``user``'s local secret, if they have one."""
+        if not user.totp_secret:
+            return None
+        return self.verifier.verify(
+            user.username, self.box.decrypt(user.totp_secret), code
+        )
+
+    def provisioning_uri(self, secret, account):
+        return self.verifier.provisioning_uri(secret, account, self.issuer)
+
+
+local_totp = LocalTOTP()
+totp_state = LocalProxy(lambda: local_totp.state)
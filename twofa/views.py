@@ -1,57 +1,94 @@
+import math
+import secrets
+
 import flask
 
-from authy.api import AuthyApiClient
+from authy import AuthyFormatException
 from flask_login import login_required, login_user, logout_user, current_user
 
-from . import app, login_manager, db
+from . import csrf, login_manager, db
+from .authy_client import AuthyUnavailable, authy_api
 # from .database import db_session
 from .decorators import twofa_required
+from .executors import ExecutorSaturated
+from .jobs import job_queue, jobs
 from .forms import (
     LoginForm,
     RegistrationForm,
     TokenVerificationForm,
+    TOTPEnrollmentForm,
     PhoneVerificationForm,
     TokenPhoneValidationForm,
 )
 from .models import User
+from .onetouch import approvals
+from .phones import phone_validator
+from .ratelimit import RateLimited, attempts, limits
+from .tasks import remove_unenrolled_user
+from .totp import TOTPVerifier, generate_secret, local_totp, totp_state
+
+
+bp = flask.Blueprint('twofa', __name__)
+
+
+@bp.app_errorhandler(AuthyUnavailable)
+def authy_unavailable(error):
+    response = flask.Response('Authy request failed', status=503)
+    if error.retry_after:
+        response.headers['Retry-After'] = _retry_after(error.retry_after)
+    return response
+
+
+@bp.app_errorhandler(RateLimited)
+def rate_limited(error):
+    return flask.Response(
+        'Too many requests, try again later',
+        status=429,
+        headers={'Retry-After': _retry_after(error.retry_after)},
+    )
 
 
-authy_api = AuthyApiClient(app.config.get('ACCOUNT_SECURITY_API_KEY'))
+def _retry_after(seconds):
+    return str(int(math.ceil(seconds)))
 
 
-@app.route('/protected')
+@bp.app_errorhandler(ExecutorSaturated)
+def server_busy(error):
+    return flask.Response(
+        'Server busy, try again', status=503, headers={'Retry-After': '1'}
+    )
+
+
+@bp.route('/protected')
 @login_required
 @twofa_required
 def protected():
-    return flask.render_template('protected.html')
+    return flask.render_template('protected.html', totp_enabled=local_totp.enabled)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
         login_user(form.user, remember=True)
-        form.user.is_authenticated = True
-        db.session.add(form.user)
-        db.session.commit()
+        if db.session.is_modified(form.user):
+            # The password hash was upgraded to the current settings.
+            db.session.commit()
         next = flask.request.args.get('next')
-        return flask.redirect(next or flask.url_for('protected'))
+        return flask.redirect(next or flask.url_for('.protected'))
     return flask.render_template('login.html', form=form)
 
 
-@app.route("/logout", methods=["GET"])
+@bp.route("/logout", methods=["GET"])
 @login_required
 def logout():
-    current_user.is_authenticated = False
-    db.session.add(current_user)
-    db.session.commit()
     flask.session['authy'] = False
     flask.session['is_verified'] = False
     logout_user()
     return flask.redirect('/login')
 
 
-@app.route('/', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
 def index():
     return flask.redirect('/login')
 
@@ -59,10 +96,12 @@ def index():
 login_manager.unauthorized_handler(index)
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegistrationForm()
     if form.validate_on_submit():
+        if jobs.enabled:
+            return _register_in_background(form)
         authy_user = authy_api.users.create(
             form.email.data,
             form.phone_number.data,
@@ -74,7 +113,6 @@ def register():
                 form.email.data,
                 form.password.data,
                 authy_user.id,
-                is_authenticated=True
             )
             user.authy_id = authy_user.id
             db.session.add(user)
@@ -90,19 +128,100 @@ def register():
     return flask.render_template('register.html', form=form)
 
 
-@app.route('/2fa', methods=['GET', 'POST'])
+def _register_in_background(form):
+    """Save the user now and enroll them with Authy on the job queue."""
+    user = User(form.username.data, form.email.data, form.password.data)
+    db.session.add(user)
+    db.session.commit()
+    login_user(user, remember=True)
+    flask.session['enrollment_job'] = job_queue.enqueue(
+        'users.create',
+        form.username.data,
+        form.email.data,
+        form.phone_number.data,
+        form.country_code.data,
+    )
+    return flask.redirect(flask.url_for('.enrollment'))
+
+
+@bp.route('/enrollment')
+def enrollment():
+    """Waiting page while a background registration enrolls with Authy."""
+    if current_user.is_authenticated and current_user.authy_id:
+        flask.session.pop('enrollment_job', None)
+        return flask.redirect('/protected')
+    job = jobs.enabled and job_queue.status(flask.session.get('enrollment_job'))
+    if job and job['state'] == 'failed':
+        return _abandon_enrollment(job['error'])
+    if not current_user.is_authenticated:
+        return flask.redirect('/login')
+    # A status this process cannot see (another worker's in-memory queue, or
+    # an expired entry) says nothing about the job, so keep waiting: only a
+    # confirmed failure rolls the registration back.
+    return flask.render_template(
+        'enrollment.html', refresh=flask.current_app.config['JOB_STATUS_REFRESH']
+    )
+
+
+def _abandon_enrollment(error):
+    """Drop the half-registered user and ask them to register again."""
+    if current_user.is_authenticated:
+        remove_unenrolled_user(current_user.username)
+    flask.session.pop('enrollment_job', None)
+    logout_user()
+    return flask.render_template('enrollment.html', error=error)
+
+
+@bp.route('/2fa', methods=['GET', 'POST'])
 @login_required
 def twofa():
-    form = TokenVerificationForm(current_user.authy_id)
+    if current_user.authy_id is None:
+        return flask.redirect(flask.url_for('.enrollment'))
+    form = TokenVerificationForm(current_user.authy_id, current_user)
     if form.validate_on_submit():
         flask.session['authy'] = True
         return flask.redirect('/protected')
     return flask.render_template('2fa.html', form=form)
 
 
-@app.route('/token/sms', methods=['POST'])
+@bp.route('/2fa/totp', methods=['GET', 'POST'])
+@login_required
+@twofa_required
+def totp_enrollment():
+    """Set up an authenticator app whose codes are checked locally."""
+    if not local_totp.enabled:
+        flask.abort(404)
+    # The candidate secret lives in the session, encrypted, until the user
+    # proves their app has it by entering a valid code.
+    pending = flask.session.get('totp_pending')
+    if pending is None:
+        secret = generate_secret()
+        flask.session['totp_pending'] = totp_state.box.encrypt(secret)
+    else:
+        secret = totp_state.box.decrypt(pending)
+
+    form = TOTPEnrollmentForm()
+    if form.validate_on_submit():
+        result = totp_state.verifier.verify(
+            current_user.username, secret, form.token.data
+        )
+        if result == TOTPVerifier.ACCEPTED:
+            current_user.totp_secret = flask.session.pop('totp_pending')
+            db.session.commit()
+            return flask.redirect('/protected')
+        form.token.errors.append('Invalid Token')
+    return flask.render_template(
+        'totp_enrollment.html',
+        form=form,
+        secret=secret,
+        uri=totp_state.provisioning_uri(secret, current_user.email),
+    )
+
+
+@bp.route('/token/sms', methods=['POST'])
 @login_required
 def token_sms():
+    _count_token_request('sms')
     sms = authy_api.users.request_sms(current_user.authy_id, {'force': True})
     if sms.ok():
         return flask.Response('SMS request successful', status=200)
@@ -110,9 +229,10 @@ def token_sms():
         return flask.Response('SMS request failed', status=503)
 
 
-@app.route('/token/voice', methods=['POST'])
+@bp.route('/token/voice', methods=['POST'])
 @login_required
 def token_voice():
+    _count_token_request('voice')
     call = authy_api.users.request_call(current_user.authy_id, {'force': True})
     if call.ok():
         return flask.Response('Call request successful', status=200)
@@ -120,9 +240,22 @@ def token_voice():
         return flask.Response('Call request failed', status=503)
 
 
-@app.route('/token/onetouch', methods=['POST'])
+@bp.route('/token/onetouch', methods=['POST'])
 @login_required
 def token_onetouch():
+    # Repeat clicks while a push is still unanswered reuse it rather than
+    # sending the user another one. Only this session's own push is reused:
+    # approving it must not log in other sessions holding the password.
+    owner = '{}:{}'.format(
+        current_user.authy_id,
+        flask.session.setdefault('onetouch_owner', secrets.token_urlsafe(16)),
+    )
+    uuid = approvals.pending_for(owner)
+    if uuid is not None:
+        flask.session['onetouch_uuid'] = uuid
+        return flask.Response('OneTouch request successfull', status=200)
+
+    _count_token_request('onetouch')
     details = {
         'Authy ID': current_user.authy_id,
         'Username': current_user.username,
@@ -141,67 +274,137 @@ def token_onetouch():
         hidden_details=hidden_details
     )
     if response.ok():
-        flask.session['onetouch_uuid'] = response.get_uuid()
+        uuid = response.get_uuid()
+        flask.session['onetouch_uuid'] = uuid
+        approvals.publish(uuid, 'pending')
+        approvals.track(owner, uuid, flask.current_app.config['ONETOUCH_REUSE_WINDOW'])
         return flask.Response('OneTouch request successfull', status=200)
     else:
         return flask.Response('OneTouch request failed', status=503)
 
 
-@app.route('/onetouch-status', methods=['POST'])
+def _count_token_request(action):
+    limits.hit(action, current_user.get_id(), flask.request.remote_addr)
+
+
+def _fetch_approval_status(uuid):
+    approval_status = authy_api.one_touch.get_approval_status(uuid)
+    if not approval_status.ok():
+        raise AuthyUnavailable('one_touch.get_approval_status', approval_status.errors())
+    return approval_status['approval_request']['status']
+
+
+def _approval_response(status):
+    if status == 'approved':
+        flask.session['authy'] = True
+    return flask.Response(status, status=200)
+
+
+@bp.route('/onetouch-status', methods=['POST'])
 @login_required
 def onetouch_status():
     uuid = flask.session['onetouch_uuid']
-    approval_status = authy_api.one_touch.get_approval_status(uuid)
-    if approval_status.ok():
-        if approval_status['approval_request']['status'] == 'approved':
-            flask.session['authy'] = True
-        return flask.Response(
-            approval_status['approval_request']['status'],
-            status=200
+    return _approval_response(approvals.lookup(uuid, _fetch_approval_status))
+
+
+@bp.route('/onetouch-status/wait', methods=['POST'])
+@login_required
+def onetouch_status_wait():
+    """Long-poll: answer as soon as the approval leaves ``status``."""
+    uuid = flask.session['onetouch_uuid']
+    previous = flask.request.form.get('status', 'pending')
+    config = flask.current_app.config
+    # With a callback configured Authy pushes the answer to us; only ask it
+    # ourselves once the long-poll times out.
+    fetch = None if config.get('ONETOUCH_CALLBACK_URL') else _fetch_approval_status
+    status = approvals.wait(uuid, previous, config['ONETOUCH_LONGPOLL_TIMEOUT'], fetch)
+    if status is None:
+        status = approvals.lookup(uuid, _fetch_approval_status)
+    return _approval_response(status)
+
+
+@bp.route('/onetouch/callback', methods=['POST'])
+@csrf.exempt
+def onetouch_callback():
+    params = flask.request.get_json(silent=True) or {}
+    url = flask.current_app.config.get('ONETOUCH_CALLBACK_URL') or flask.request.base_url
+    try:
+        valid = authy_api.one_touch.validate_one_touch_signature(
+            flask.request.headers.get('X-Authy-Signature'),
+            flask.request.headers.get('X-Authy-Signature-Nonce'),
+            flask.request.method,
+            url,
+            params,
         )
-    else:
-        return flask.Response(approval_status.errros(), status=503)
+    except AuthyFormatException:
+        valid = False
+    if not valid or not params.get('uuid') or not params.get('status'):
+        return flask.Response('Invalid OneTouch callback', status=400)
+    approvals.publish(params['uuid'], params['status'])
+    return flask.Response('OK', status=200)
 
 
 ######################
 # Phone Verification #
 ######################
 
-@app.route('/verification', methods=['GET', 'POST'])
+@bp.route('/verification', methods=['GET', 'POST'])
 def phone_verification():
     form = PhoneVerificationForm()
     if form.validate_on_submit():
         flask.session['phone_number'] = form.phone_number.data
         flask.session['country_code'] = form.country_code.data
-        authy_api.phones.verification_start(
-            form.phone_number.data,
-            form.country_code.data,
-            via=form.via.data
-        )
+        if jobs.enabled:
+            flask.session['verification_job'] = job_queue.enqueue(
+                'phones.verification_start',
+                form.phone_number.data,
+                form.country_code.data,
+                form.via.data,
+            )
+        else:
+            authy_api.phones.verification_start(
+                form.phone_number.data,
+                form.country_code.data,
+                via=form.via.data
+            )
         return flask.redirect('/verification/token')
     return flask.render_template('phone_verification.html', form=form)
 
 
-@app.route('/verification/token', methods=['GET', 'POST'])
+@bp.route('/verification/token', methods=['GET', 'POST'])
 def token_validation():
     form = TokenPhoneValidationForm()
+    start_job = None
+    if jobs.enabled:
+        start_job = job_queue.status(flask.session.get('verification_job'))
+        if start_job and start_job['state'] == 'failed':
+            # Kept in the session so a reload still explains what happened;
+            # starting a new verification replaces it.
+            return flask.render_template(
+                'token_validation.html', form=form, error=start_job['error']
+            )
     if form.validate_on_submit():
+        phone = ''.join(phone_validator.normalize(
+            flask.session['country_code'], flask.session['phone_number']
+        ))
+        attempts.hit('phone_verify', phone)
         verification = authy_api.phones.verification_check(
             flask.session['phone_number'],
             flask.session['country_code'],
             form.token.data
         )
         if verification.ok():
+            attempts.succeeded('phone_verify', phone)
             flask.session['is_verified'] = True
             return flask.redirect('/verified')
         else:
-            form.errors['non_field'] = []
-            for error_msg in verification.errors().values():
-                form.errors['non_field'].append(error_msg)
-    return flask.render_template('token_validation.html', form=form)
+            form.token.errors.extend(verification.errors().values())
+    return flask.render_template(
+        'token_validation.html', form=form, start_job=start_job
+    )
 
 
-@app.route('/verified')
+@bp.route('/verified')
 def verified():
     if not flask.session.get('is_verified'):
         return flask.redirect('/verification')